@@ -0,0 +1,344 @@
+"""
+Shadow-Sound — Inference backends
+
+SoundClassifier packs waveforms and pads them to a length bucket; a backend
+only has to turn one such fixed-length waveform into ``(frames, 521)``
+YAMNet scores (and, for the embedding head, ``(frames, 1024)``
+embeddings).  Three runtimes and a stub are supported, selected by
+INFERENCE_BACKEND:
+
+    tensorflow   the pinned SavedModel, one traced tf.function per bucket
+    tflite       exported .tflite model, one interpreter per bucket
+    onnx         exported .onnx model via ONNX Runtime
+    stub         no model: deterministic scores from each frame's loudness,
+                 costing STUB_FRAME_MS per frame (load tests, development)
+
+The tflite and onnx backends import neither TensorFlow nor tensorflow_hub
+(when tflite-runtime / ai-edge-litert is installed), so CPU-only nodes can
+run without the full TF stack.  Their models come from export_model.py.
+"""
+
+import csv
+import os
+import threading
+import time
+
+import numpy as np
+
+import config
+import model_store
+from decoding import PATCH_HOP_SAMPLES, PATCH_SAMPLES, num_frames
+from head import EMBEDDING_SIZE, HEAD_PREFIX, EmbeddingHead, load_head
+from log import get_logger
+
+log = get_logger("backend")
+
+CLASS_MAP_FILE = "yamnet_class_map.csv"
+
+NUM_CLASSES = 521
+
+
+def read_class_names(path: str) -> list[str]:
+    """Display names from a YAMNet class map CSV."""
+    with open(path, newline="") as f:
+        return [row["display_name"] for row in csv.DictReader(f)]
+
+
+def exported_model_path(backend: str, variant: str) -> str:
+    extension = {"tflite": "tflite", "onnx": "onnx"}[backend]
+    return os.path.join(config.EXPORT_DIR, f"yamnet_{variant}.{extension}")
+
+
+class InferenceBackend:
+    """Runs YAMNet on waveforms whose length is one of ``bucket_lengths``."""
+
+    name = "base"
+
+    def __init__(self, artifact: model_store.ModelArtifact, class_names: list[str]) -> None:
+        self.artifact = artifact
+        self.class_names = class_names
+
+    def run(self, waveform: np.ndarray) -> np.ndarray:
+        """``(frames, 521)`` scores for a float32 waveform (bucket-sized or longer)."""
+        raise NotImplementedError
+
+    def run_with_embeddings(self, waveform: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """``(frames, 521)`` scores and ``(frames, 1024)`` embeddings from one call."""
+        raise NotImplementedError
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+
+class TensorFlowBackend(InferenceBackend):
+    """The SavedModel, with one concrete tf.function traced per bucket."""
+
+    name = "tensorflow"
+
+    def __init__(self, bucket_lengths: list[int], artifact: model_store.ModelArtifact | None = None) -> None:
+        import tensorflow as tf
+
+        self._tf = tf
+        artifact = artifact or model_store.load_yamnet()
+        model = artifact.model
+        # Load the class map CSV bundled with the model
+        class_map_path = model.class_map_path().numpy().decode("utf-8")
+        with tf.io.gfile.GFile(class_map_path) as f:
+            class_names = [row["display_name"] for row in csv.DictReader(f)]
+        super().__init__(artifact, class_names)
+
+        # Packed batches are zero-padded up to a bucket, so every call hits a
+        # fixed input signature and TensorFlow never retraces.  trace_count
+        # counts actual traces; any increase after startup is a regression.
+        self.trace_count = 0
+
+        def run(waveform):
+            self.trace_count += 1  # Python side effect — only runs while tracing
+            scores, embeddings, _spectrogram = model(waveform)
+            return scores, embeddings
+
+        traced = tf.function(run)
+        self._calls = {
+            length: traced.get_concrete_function(tf.TensorSpec([length], tf.float32))
+            for length in bucket_lengths
+        }
+        # Single waveforms longer than the largest bucket (long uploads)
+        self._oversize_call = traced.get_concrete_function(tf.TensorSpec([None], tf.float32))
+        self._startup_traces = self.trace_count
+
+    def run(self, waveform: np.ndarray) -> np.ndarray:
+        return self.run_with_embeddings(waveform)[0]
+
+    def run_with_embeddings(self, waveform: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        call = self._calls.get(len(waveform), self._oversize_call)
+        # YAMNet expects a 1-D float32 tensor in [-1.0, 1.0]
+        scores, embeddings = call(self._tf.constant(waveform))
+        return scores.numpy(), embeddings.numpy()
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "traces": self.trace_count,
+            "retraces": self.trace_count - self._startup_traces,
+        }
+
+
+def _tflite_interpreter_class():
+    try:
+        from ai_edge_litert.interpreter import Interpreter
+    except ImportError:
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+    return Interpreter
+
+
+class TFLiteBackend(InferenceBackend):
+    """Exported .tflite model; one pre-sized interpreter per bucket."""
+
+    name = "tflite"
+
+    def __init__(self, bucket_lengths: list[int], variant: str = config.INFERENCE_MODEL_VARIANT) -> None:
+        path = exported_model_path("tflite", variant)
+        started = time.perf_counter()
+        checksum = model_store.verify_exported(path)
+        Interpreter = _tflite_interpreter_class()
+        threads = config.BACKEND_NUM_THREADS or None
+
+        def make(length: int):
+            interpreter = Interpreter(model_path=path, num_threads=threads)
+            interpreter.resize_tensor_input(interpreter.get_input_details()[0]["index"], [length])
+            interpreter.allocate_tensors()
+            return interpreter
+
+        # Interpreters aren't thread-safe, so each one has its own lock
+        self._interpreters = {length: (make(length), threading.Lock()) for length in bucket_lengths}
+        self._oversize = (Interpreter(model_path=path, num_threads=threads), threading.Lock())
+        self._oversize_length = 0
+
+        sample = next(iter(self._interpreters.values()))[0]
+        self._input_index = sample.get_input_details()[0]["index"]
+        outputs = {d["shape_signature"][-1]: d["index"] for d in sample.get_output_details()}
+        self._scores_index = outputs[NUM_CLASSES]
+        self._embeddings_index = outputs.get(EMBEDDING_SIZE)
+
+        artifact = model_store.ModelArtifact(
+            None, "tflite", path, checksum, (time.perf_counter() - started) * 1000,
+        )
+        super().__init__(artifact, read_class_names(os.path.join(config.EXPORT_DIR, CLASS_MAP_FILE)))
+        self.variant = variant
+
+    def run(self, waveform: np.ndarray) -> np.ndarray:
+        return self._run(waveform, (self._scores_index,))[0]
+
+    def run_with_embeddings(self, waveform: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if self._embeddings_index is None:
+            raise RuntimeError("This TFLite export has no embeddings output; re-run export_model.py")
+        scores, embeddings = self._run(waveform, (self._scores_index, self._embeddings_index))
+        return scores, embeddings
+
+    def _run(self, waveform: np.ndarray, outputs: tuple[int, ...]) -> list[np.ndarray]:
+        entry = self._interpreters.get(len(waveform))
+        if entry is None:
+            interpreter, lock = self._oversize
+            with lock:
+                if self._oversize_length != len(waveform):
+                    interpreter.resize_tensor_input(self._input_index, [len(waveform)])
+                    interpreter.allocate_tensors()
+                    self._oversize_length = len(waveform)
+                return self._invoke(interpreter, waveform, outputs)
+
+        interpreter, lock = entry
+        with lock:
+            return self._invoke(interpreter, waveform, outputs)
+
+    def _invoke(self, interpreter, waveform: np.ndarray, outputs: tuple[int, ...]) -> list[np.ndarray]:
+        interpreter.set_tensor(self._input_index, np.ascontiguousarray(waveform, dtype=np.float32))
+        interpreter.invoke()
+        return [interpreter.get_tensor(index).copy() for index in outputs]
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "variant": self.variant}
+
+
+class OnnxBackend(InferenceBackend):
+    """Exported .onnx model via ONNX Runtime (sessions are thread-safe)."""
+
+    name = "onnx"
+
+    def __init__(self, bucket_lengths: list[int], variant: str = config.INFERENCE_MODEL_VARIANT) -> None:
+        import onnxruntime as ort
+
+        path = exported_model_path("onnx", variant)
+        started = time.perf_counter()
+        checksum = model_store.verify_exported(path)
+
+        options = ort.SessionOptions()
+        if config.BACKEND_NUM_THREADS:
+            options.intra_op_num_threads = config.BACKEND_NUM_THREADS
+        self._session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self._input_name = self._session.get_inputs()[0].name
+        outputs = {o.shape[-1]: o.name for o in self._session.get_outputs()}
+        self._scores_name = outputs[NUM_CLASSES]
+        self._embeddings_name = outputs.get(EMBEDDING_SIZE)
+
+        artifact = model_store.ModelArtifact(
+            None, "onnx", path, checksum, (time.perf_counter() - started) * 1000,
+        )
+        super().__init__(artifact, read_class_names(os.path.join(config.EXPORT_DIR, CLASS_MAP_FILE)))
+        self.variant = variant
+
+    def run(self, waveform: np.ndarray) -> np.ndarray:
+        feed = {self._input_name: np.ascontiguousarray(waveform, dtype=np.float32)}
+        return self._session.run([self._scores_name], feed)[0]
+
+    def run_with_embeddings(self, waveform: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        if self._embeddings_name is None:
+            raise RuntimeError("This ONNX export has no embeddings output; re-run export_model.py")
+        feed = {self._input_name: np.ascontiguousarray(waveform, dtype=np.float32)}
+        scores, embeddings = self._session.run([self._scores_name, self._embeddings_name], feed)
+        return scores, embeddings
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "variant": self.variant}
+
+
+class StubBackend(InferenceBackend):
+    """
+    Stand-in for YAMNet with the same output shape and a configurable cost.
+
+    Each frame's RMS level picks one of STUB_CLASSES (5 dB bands from
+    -75 dBFS, quiet to loud), which scores 0.95; every other class scores
+    0.01.  A call sleeps STUB_FRAME_MS per frame, like a runtime that
+    releases the GIL while it computes.
+    """
+
+    name = "stub"
+
+    STUB_CLASSES = (
+        "Silence", "Walk, footsteps", "Door", "Dog", "Speech", "Bicycle bell", "Car", "Train",
+        "Aircraft", "Jackhammer", "Alarm", "Glass", "Vehicle horn, car horn, honking", "Tire squeal", "Siren",
+    )
+
+    def __init__(self, bucket_lengths: list[int], variant: str = "", frame_ms: float | None = None) -> None:
+        class_names = list(self.STUB_CLASSES)
+        class_names += [f"Stub class {i}" for i in range(len(class_names), NUM_CLASSES)]
+        super().__init__(model_store.ModelArtifact(None, "stub", "stub", None, 0.0), class_names)
+        self.frame_ms = config.STUB_FRAME_MS if frame_ms is None else frame_ms
+
+    def run(self, waveform: np.ndarray) -> np.ndarray:
+        frames = num_frames(len(waveform))
+        energy = np.concatenate([[0.0], np.cumsum(np.square(waveform, dtype=np.float64))])
+        starts = np.arange(frames) * PATCH_HOP_SAMPLES
+        stops = np.minimum(starts + PATCH_SAMPLES, len(waveform))
+        rms = np.sqrt(np.maximum(energy[stops] - energy[np.minimum(starts, stops)], 0.0) / PATCH_SAMPLES)
+        dbfs = 20 * np.log10(rms + 1e-10)
+        picked = np.clip((dbfs + 75) // 5, 0, len(self.STUB_CLASSES) - 1).astype(np.int64)
+
+        scores = np.full((frames, NUM_CLASSES), 0.01, dtype=np.float32)
+        scores[np.arange(frames), picked] = 0.95
+        if self.frame_ms > 0:
+            time.sleep(frames * self.frame_ms / 1000)
+        return scores
+
+    def run_with_embeddings(self, waveform: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        scores = self.run(waveform)
+        return scores, np.zeros((len(scores), EMBEDDING_SIZE), dtype=np.float32)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "frame_ms": self.frame_ms}
+
+
+class EmbeddingHeadBackend(InferenceBackend):
+    """
+    Any backend plus the embedding head: scores gain one ``head:<category>``
+    column per head category, computed from the same call's embeddings.
+    """
+
+    def __init__(self, inner: InferenceBackend, head: EmbeddingHead) -> None:
+        super().__init__(inner.artifact, inner.class_names + [HEAD_PREFIX + c for c in head.categories])
+        self.name = inner.name
+        self.inner = inner
+        self.head = head
+
+    def run(self, waveform: np.ndarray) -> np.ndarray:
+        scores, embeddings = self.inner.run_with_embeddings(waveform)
+        return np.hstack([scores, self.head.predict(embeddings)])
+
+    def run_with_embeddings(self, waveform: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        return self.inner.run_with_embeddings(waveform)
+
+    def stats(self) -> dict:
+        return {**self.inner.stats(), "embedding_head": self.head.categories}
+
+
+_BACKENDS = {
+    TensorFlowBackend.name: TensorFlowBackend,
+    TFLiteBackend.name: TFLiteBackend,
+    OnnxBackend.name: OnnxBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def load_backend(
+    bucket_lengths: list[int],
+    name: str = config.INFERENCE_BACKEND,
+    variant: str = config.INFERENCE_MODEL_VARIANT,
+    with_head: bool = True,
+) -> InferenceBackend:
+    """Instantiate the configured backend with its buckets pre-built (and the embedding head, if any)."""
+    if name not in _BACKENDS:
+        raise ValueError(f"INFERENCE_BACKEND must be one of {sorted(_BACKENDS)}, got {name!r}")
+    if name == TensorFlowBackend.name:
+        backend = TensorFlowBackend(bucket_lengths)
+    else:
+        backend = _BACKENDS[name](bucket_lengths, variant)
+    log.info("%s ready — %d classes", backend.name, len(backend.class_names))
+
+    head = load_head() if with_head else None
+    if head is not None:
+        backend = EmbeddingHeadBackend(backend, head)
+        log.info("Embedding head loaded — %s", ", ".join(head.categories))
+    return backend
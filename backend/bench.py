@@ -0,0 +1,512 @@
+"""
+Shadow-Sound — Benchmarks
+
+    python bench.py load [--clients 50] [--duration 60] [--format pcm|wav|binary|m4a]
+                         [--frame-ms 2] [--real-model] [--out bench_results/]
+    python bench.py micro [--out bench_results/]
+    python bench.py compare OLD.json NEW.json
+
+``load`` starts the app in-process (uvicorn on a loopback port, in its own
+thread) with the "stub" inference backend, whose cost per YAMNet frame is
+--frame-ms, or with the configured model under --real-model.  Each
+simulated phone authenticates on /ws/audio and sends a 1.5 s chunk every
+1.5 s, as the app does: a synthetic street scene (noise with sirens, horns
+and voices) pre-encoded in the chosen format, so decoding, the activity
+gate, batching and category mapping all run as they do for real traffic.
+Reported: chunks answered per second, end-to-end latency percentiles
+(send → response), chunks shed or rejected, and the process's CPU use and
+RSS.  Clients share the process with the server, so keep an eye on CPU
+when comparing client counts.
+
+``micro`` times decoding per payload format (decoding.decode_with_info)
+and category mapping on one chunk's scores.
+
+Every run is saved as JSON named after the commit it ran on; ``compare``
+prints the numeric results of two runs side by side.
+"""
+
+import argparse
+import asyncio
+import base64
+import io
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+import wave
+
+import numpy as np
+
+DEFAULT_OUT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_results")
+
+CHUNK_S = 1.5
+SAMPLE_RATE = 16000
+SCENE_CHUNKS = 20          # distinct chunks per client before the scene repeats
+FORMATS = ("pcm", "wav", "binary", "m4a")
+
+
+# ── Synthetic audio ───────────────────────────────────────────────────────
+
+def synthetic_scene(seed: int, seconds: float = SCENE_CHUNKS * CHUNK_S, sample_rate: int = SAMPLE_RATE) -> np.ndarray:
+    """Street-like noise with a siren sweep, horn blasts and voice-like bursts, as int16."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(int(seconds * sample_rate)) / sample_rate
+    audio = 0.02 * rng.standard_normal(len(t))
+
+    # Siren: 700–1500 Hz sweep, 4 s cycle, over the middle third
+    start, stop = len(t) // 3, 2 * len(t) // 3
+    phase = 2 * np.pi * np.cumsum(1100 + 400 * np.sin(2 * np.pi * t[start:stop] / 4)) / sample_rate
+    audio[start:stop] += 0.3 * np.sin(phase)
+
+    # Horn blasts and voice-like bursts at random times
+    for _ in range(int(seconds / 6)):
+        at = rng.integers(0, len(t) - sample_rate)
+        n = int(rng.uniform(0.2, 0.8) * sample_rate)
+        burst = t[:n]
+        if rng.random() < 0.5:
+            tone = np.sin(2 * np.pi * 420 * burst) + 0.5 * np.sin(2 * np.pi * 510 * burst)
+        else:
+            tone = np.sin(2 * np.pi * (180 + 40 * np.sin(2 * np.pi * 5 * burst)) * burst) * (1 + np.sin(2 * np.pi * 4 * burst))
+        audio[at:at + n] += 0.2 * tone
+
+    return (np.clip(audio, -1, 1) * 32767).astype(np.int16)
+
+
+def _wav_bytes(samples: np.ndarray, sample_rate: int = SAMPLE_RATE) -> bytes:
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(samples.tobytes())
+    return buffer.getvalue()
+
+
+def _ffmpeg_bytes(samples: np.ndarray, extension: str, sample_rate: int = SAMPLE_RATE) -> bytes:
+    """Encode with the ffmpeg CLI (the mp4 muxer needs a seekable output file)."""
+    if shutil.which("ffmpeg") is None:
+        raise RuntimeError(f"ffmpeg is needed to encode {extension} payloads")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "chunk." + extension)
+        subprocess.run(
+            ["ffmpeg", "-v", "error", "-f", "s16le", "-ar", str(sample_rate), "-ac", "1", "-i", "-", path],
+            input=samples.tobytes(), check=True,
+        )
+        with open(path, "rb") as f:
+            return f.read()
+
+
+def _binary_frame(samples: np.ndarray, sequence: int, sample_rate: int = SAMPLE_RATE) -> bytes:
+    from protocol import CAPTURE_TIME, CHANNELS, FORMAT_INT16, FRAME_MAGIC, FRAME_VERSION, HEADER
+
+    return (
+        HEADER.pack(FRAME_MAGIC, FRAME_VERSION, FORMAT_INT16, sample_rate, sequence)
+        + CAPTURE_TIME.pack(int(time.time() * 1000))
+        + CHANNELS.pack(1)
+        + samples.astype("<i2").tobytes()
+    )
+
+
+def encode_chunks(seed: int, fmt: str) -> list[np.ndarray | str]:
+    """One client's scene as chunk payloads: base64 strings, or int16 arrays for binary frames."""
+    scene = synthetic_scene(seed)
+    chunk = int(CHUNK_S * SAMPLE_RATE)
+    pieces = [scene[i:i + chunk] for i in range(0, len(scene) - chunk + 1, chunk)]
+    if fmt == "binary":
+        return pieces
+    if fmt == "pcm":
+        encoded = [piece.tobytes() for piece in pieces]
+    elif fmt == "wav":
+        encoded = [_wav_bytes(piece) for piece in pieces]
+    else:
+        encoded = [_ffmpeg_bytes(piece, fmt) for piece in pieces]
+    return [base64.b64encode(data).decode() for data in encoded]
+
+
+# ── Measurement helpers ───────────────────────────────────────────────────
+
+def percentiles(values: list[float]) -> dict:
+    if not values:
+        return {"count": 0}
+    a = np.asarray(values)
+    return {
+        "count": len(a),
+        "mean": round(float(a.mean()), 3),
+        "p50": round(float(np.percentile(a, 50)), 3),
+        "p95": round(float(np.percentile(a, 95)), 3),
+        "p99": round(float(np.percentile(a, 99)), 3),
+        "max": round(float(a.max()), 3),
+    }
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+
+
+def _cpu_s() -> float:
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _commit() -> str:
+    try:
+        root = os.path.dirname(os.path.abspath(__file__))
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=root,
+                               capture_output=True, text=True).stdout.strip()
+        return commit + ("-dirty" if dirty else "")
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def save(kind: str, args: argparse.Namespace, results: dict) -> str:
+    commit = _commit()
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"{kind}-{commit}-{time.strftime('%Y%m%d-%H%M%S')}.json")
+    options = {k: v for k, v in vars(args).items() if k not in ("out", "command")}
+    with open(path, "w") as f:
+        json.dump({
+            "benchmark": kind,
+            "commit": commit,
+            "started": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": sys.version.split()[0],
+            "cpus": os.cpu_count(),
+            "options": options,
+            "results": results,
+        }, f, indent=2)
+    return path
+
+
+# ── Load test ─────────────────────────────────────────────────────────────
+
+class _Server:
+    """The FastAPI app under uvicorn, in a background thread."""
+
+    def __init__(self) -> None:
+        import uvicorn
+
+        import main
+
+        self._server = uvicorn.Server(uvicorn.Config(main.app, host="127.0.0.1", port=0, log_level="warning"))
+        self._thread = threading.Thread(target=self._server.run, name="bench-server", daemon=True)
+
+    def start(self, timeout_s: float = 120.0) -> int:
+        self._thread.start()
+        deadline = time.monotonic() + timeout_s
+        while not self._server.started:
+            if not self._thread.is_alive() or time.monotonic() > deadline:
+                raise RuntimeError("Server failed to start")
+            time.sleep(0.05)
+        return self._server.servers[0].sockets[0].getsockname()[1]
+
+    def stop(self) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=30)
+
+
+class _Client:
+    """One simulated phone: a chunk every CHUNK_S, latencies matched by sequence number."""
+
+    def __init__(self, index: int, fmt: str, payloads: list) -> None:
+        self.index = index
+        self.fmt = fmt
+        self.payloads = payloads
+        self.sent = 0
+        self.latencies_ms: list[float] = []
+        self.errors: dict[str, int] = {}
+        self.throttles = 0
+        self.gated = 0
+        self.detections = 0
+        self._pending: dict[int, float] = {}
+
+    async def run(self, url: str, duration_s: float, grace_s: float) -> None:
+        import websockets
+
+        async with websockets.connect(url, max_size=None) as ws:
+            await ws.send(json.dumps({
+                "type": "auth",
+                "device_id": f"bench-{self.index}",
+                "api_version": "2.0" if self.fmt == "binary" else "1.0",
+            }))
+            while json.loads(await ws.recv())["type"] != "auth_ok":
+                pass
+            receiver = asyncio.create_task(self._receive(ws))
+            try:
+                # Phones start recording at arbitrary times
+                await asyncio.sleep(random.uniform(0, CHUNK_S))
+                started = time.monotonic()
+                while time.monotonic() - started < duration_s:
+                    await self._send(ws, self.sent)
+                    self.sent += 1
+                    await asyncio.sleep(max(0.0, started + self.sent * CHUNK_S - time.monotonic()))
+                deadline = time.monotonic() + grace_s
+                while self._pending and time.monotonic() < deadline:
+                    await asyncio.sleep(0.05)
+            finally:
+                receiver.cancel()
+
+    async def _send(self, ws, sequence: int) -> None:
+        payload = self.payloads[sequence % len(self.payloads)]
+        self._pending[sequence] = time.perf_counter()
+        if self.fmt == "binary":
+            await ws.send(_binary_frame(payload, sequence))
+        else:
+            await ws.send(json.dumps({
+                "type": "audio_chunk", "audio_data": payload, "sample_rate": SAMPLE_RATE, "sequence": sequence,
+            }))
+
+    async def _receive(self, ws) -> None:
+        async for raw in ws:
+            received = time.perf_counter()
+            message = json.loads(raw)
+            kind = message.get("type")
+            if kind == "throttle":
+                self.throttles += message.get("action") == "slow_down"
+                continue
+            if kind == "error":
+                code = message.get("code", "unknown")
+                self.errors[code] = self.errors.get(code, 0) + 1
+                continue
+            sent = self._pending.pop(message.get("sequence"), None)
+            if sent is None:
+                continue
+            self.latencies_ms.append((received - sent) * 1000)
+            self.gated += bool(message.get("gated"))
+            self.detections += len(message.get("detections") or ())
+
+
+async def _drive(port: int, args: argparse.Namespace, payloads: list[list]) -> tuple[list[_Client], float]:
+    url = f"ws://127.0.0.1:{port}/ws/audio"
+    clients = [_Client(i, args.format, payloads[i % len(payloads)]) for i in range(args.clients)]
+    started = time.perf_counter()
+    await asyncio.gather(*(client.run(url, args.duration, args.grace) for client in clients))
+    return clients, time.perf_counter() - started
+
+
+def run_load(args: argparse.Namespace) -> dict:
+    # Configure the app before main/config are imported
+    if not args.real_model:
+        os.environ["INFERENCE_BACKEND"] = "stub"
+        os.environ["STUB_FRAME_MS"] = str(args.frame_ms)
+    if args.no_gate:
+        os.environ["GATE_ENABLED"] = "false"
+    settings_dir = tempfile.mkdtemp(prefix="shadowsound-bench-")
+    os.environ.setdefault("SETTINGS_DB_PATH", os.path.join(settings_dir, "settings.db"))
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+    print(f"Encoding {SCENE_CHUNKS}-chunk scenes as {args.format} …")
+    payloads = [encode_chunks(seed, args.format) for seed in range(min(args.clients, 8))]
+
+    server = _Server()
+    port = server.start()
+    try:
+        print(f"{args.clients} clients for {args.duration:.0f} s against 127.0.0.1:{port} …")
+        cpu_before, rss_before = _cpu_s(), _rss_mb()
+        clients, wall_s = asyncio.run(_drive(port, args, payloads))
+        cpu_s = _cpu_s() - cpu_before
+        with urllib.request.urlopen(f"http://127.0.0.1:{port}/api/v1/inference/stats") as response:
+            server_stats = json.load(response)
+    finally:
+        server.stop()
+        shutil.rmtree(settings_dir, ignore_errors=True)
+
+    latencies = [ms for client in clients for ms in client.latencies_ms]
+    sent = sum(client.sent for client in clients)
+    errors: dict[str, int] = {}
+    for client in clients:
+        for code, count in client.errors.items():
+            errors[code] = errors.get(code, 0) + count
+    return {
+        "clients": args.clients,
+        "wall_s": round(wall_s, 2),
+        "chunks_sent": sent,
+        "chunks_answered": len(latencies),
+        "chunks_unanswered": sent - len(latencies) - sum(errors.values()),
+        "answered_per_s": round(len(latencies) / wall_s, 2),
+        "audio_s_per_s": round(len(latencies) * CHUNK_S / wall_s, 2),
+        "gated": sum(client.gated for client in clients),
+        "detections": sum(client.detections for client in clients),
+        "errors": errors,
+        "throttle_notices": sum(client.throttles for client in clients),
+        "latency_ms": percentiles(latencies),
+        "cpu_percent": round(100 * cpu_s / wall_s, 1),
+        "rss_mb": round(_rss_mb(), 1),
+        "rss_growth_mb": round(_rss_mb() - rss_before, 1),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "backend": server_stats.get("model"),
+        "scheduler": server_stats.get("scheduler"),
+    }
+
+
+def print_load(results: dict) -> None:
+    latency = results["latency_ms"]
+    print(f"\n{results['chunks_answered']}/{results['chunks_sent']} chunks answered "
+          f"({results['answered_per_s']}/s, {results['audio_s_per_s']} s of audio/s)")
+    if latency["count"]:
+        print(f"latency ms   p50 {latency['p50']}   p95 {latency['p95']}   p99 {latency['p99']}   max {latency['max']}")
+    print(f"unanswered {results['chunks_unanswered']}   errors {results['errors'] or 0}   "
+          f"throttle notices {results['throttle_notices']}   gated {results['gated']}")
+    print(f"CPU {results['cpu_percent']}%   RSS {results['rss_mb']} MB (peak {results['peak_rss_mb']} MB)")
+
+
+# ── Microbenchmarks ───────────────────────────────────────────────────────
+
+def _time(fn, repeat: int, warmup: int = 3) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return percentiles(samples)
+
+
+def _decode_payloads() -> dict[str, tuple[bytes, int, int]]:
+    """name → (payload, client sample rate, repeats) for one 1.5 s chunk per format."""
+    chunk16 = synthetic_scene(0, CHUNK_S)
+    chunk44 = synthetic_scene(0, CHUNK_S, 44100)
+    stereo44 = np.repeat(chunk44[:, None], 2, axis=1)
+    payloads = {
+        "pcm_16k": (chunk16.tobytes(), 16000, 500),
+        "pcm_44k": (chunk44.tobytes(), 44100, 200),
+        "wav_16k": (_wav_bytes(chunk16), 16000, 500),
+        "wav_44k": (_wav_bytes(chunk44, 44100), 44100, 200),
+    }
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as f:
+        f.setnchannels(2)
+        f.setsampwidth(2)
+        f.setframerate(44100)
+        f.writeframes(stereo44.tobytes())
+    payloads["wav_44k_stereo"] = (buffer.getvalue(), 44100, 200)
+
+    try:
+        import soundfile as sf
+
+        for fmt in ("flac", "ogg"):
+            buffer = io.BytesIO()
+            sf.write(buffer, chunk16, 16000, format=fmt.upper())
+            payloads[f"{fmt}_16k"] = (buffer.getvalue(), 16000, 100)
+    except ImportError:
+        print("  (soundfile not installed — skipping flac/ogg)")
+    for fmt in ("m4a", "mp3"):
+        try:
+            payloads[f"{fmt}_16k"] = (_ffmpeg_bytes(chunk16, fmt), 16000, 20)
+        except (RuntimeError, subprocess.CalledProcessError) as exc:
+            print(f"  ({fmt}: {exc} — skipping)")
+    return payloads
+
+
+def run_micro(args: argparse.Namespace) -> dict:
+    from backends import StubBackend
+    from classifier import SoundClassifier
+    from decoding import decode_with_info
+
+    results: dict = {"decode_ms": {}, "category_mapping_ms": {}}
+    print("Decoding one 1.5 s chunk:")
+    for name, (payload, sample_rate, repeat) in _decode_payloads().items():
+        if decode_with_info(payload, sample_rate).waveform is None:
+            print(f"  {name:<16} could not be decoded here — skipping")
+            continue
+        stats = _time(lambda: decode_with_info(payload, sample_rate), repeat)
+        results["decode_ms"][name] = stats
+        print(f"  {name:<16} p50 {stats['p50']:>8.3f} ms   p95 {stats['p95']:>8.3f} ms")
+
+    classifier = SoundClassifier(StubBackend([], frame_ms=0), cascade=False)
+    rng = np.random.default_rng(0)
+    scores = (rng.random((4, 521)) ** 8).astype(np.float32)     # mostly low, a few strong classes
+    scores[:, classifier.class_names.index("Siren")] = 0.9
+    scales = np.full(len(classifier.categories), 0.9, dtype=np.float32)
+    cases = {
+        "frame_category_scores": lambda: classifier.frame_category_scores(scores),
+        "category_scores": lambda: classifier.category_scores(scores),
+        "detect_all": lambda: classifier.detect_all(scores),
+        "detect_all_profile_scales": lambda: classifier.detect_all(scores, scales),
+    }
+    print("Category mapping on one chunk's (4, 521) scores:")
+    for name, fn in cases.items():
+        stats = _time(fn, 5000, warmup=50)
+        results["category_mapping_ms"][name] = stats
+        print(f"  {name:<26} p50 {stats['p50'] * 1000:>8.1f} µs   p95 {stats['p95'] * 1000:>8.1f} µs")
+    return results
+
+
+# ── Comparison ────────────────────────────────────────────────────────────
+
+def _flatten(value, prefix: str = "") -> dict[str, float]:
+    if isinstance(value, dict):
+        flat = {}
+        for key, item in value.items():
+            flat.update(_flatten(item, f"{prefix}.{key}" if prefix else str(key)))
+        return flat
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return {prefix: float(value)}
+    return {}
+
+
+def compare(old_path: str, new_path: str) -> None:
+    with open(old_path) as f:
+        old = json.load(f)
+    with open(new_path) as f:
+        new = json.load(f)
+    if old["benchmark"] != new["benchmark"]:
+        print(f"warning: comparing a {old['benchmark']} run with a {new['benchmark']} run")
+    old_flat, new_flat = _flatten(old["results"]), _flatten(new["results"])
+    print(f"{'':<48}{old['commit']:>14}{new['commit']:>14}{'change':>10}")
+    for key in old_flat:
+        if key not in new_flat:
+            continue
+        a, b = old_flat[key], new_flat[key]
+        change = f"{(b - a) / a:+.1%}" if a else "—"
+        print(f"{key:<48}{a:>14.3f}{b:>14.3f}{change:>10}")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Shadow-Sound load and microbenchmarks.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    load = sub.add_parser("load", help="simulated phones against the in-process app")
+    load.add_argument("--clients", type=int, default=50)
+    load.add_argument("--duration", type=float, default=60.0, help="seconds each client streams")
+    load.add_argument("--grace", type=float, default=5.0, help="seconds to wait for outstanding responses")
+    load.add_argument("--format", choices=FORMATS, default="pcm")
+    load.add_argument("--frame-ms", type=float, default=2.0, help="stub model cost per YAMNet frame")
+    load.add_argument("--real-model", action="store_true", help="use the configured model instead of the stub")
+    load.add_argument("--no-gate", action="store_true", help="score every chunk (activity gate off)")
+    load.add_argument("--seed", type=int, default=0)
+    load.add_argument("--out", default=DEFAULT_OUT_DIR)
+
+    micro = sub.add_parser("micro", help="decode and category-mapping microbenchmarks")
+    micro.add_argument("--out", default=DEFAULT_OUT_DIR)
+
+    cmp = sub.add_parser("compare", help="two saved runs side by side")
+    cmp.add_argument("old")
+    cmp.add_argument("new")
+    args = parser.parse_args(argv)
+
+    if args.command == "compare":
+        compare(args.old, args.new)
+        return 0
+    if args.command == "load":
+        random.seed(args.seed)
+        results = run_load(args)
+        print_load(results)
+    else:
+        results = run_micro(args)
+    print(f"Saved → {save(args.command, args, results)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -9,15 +9,23 @@ for pedestrian / environmental safety into the app's own category set and
 ignore everything else.
 """
 
-import io
-import csv
+import logging
+import time
+from collections import Counter
+
 import numpy as np
-import tensorflow as tf
-import tensorflow_hub as hub
+
+import config
+from backends import InferenceBackend, load_backend
+from decoding import PATCH_HOP_SAMPLES, PATCH_SAMPLES, TARGET_SR, decode_audio, num_frames
+from head import BACKGROUND, HEAD_PREFIX
+from log import get_logger
+from student import Cascade, load_student
+
+log = get_logger("classifier")
 
 # ── YAMNet settings ───────────────────────────────────────────────────────
 
-TARGET_SR = 16000          # YAMNet requires 16 kHz mono
 CONFIDENCE_THRESHOLD = 0.4 # Lower threshold since YAMNet distributes probability across many classes
 
 # ── Map YAMNet AudioSet class names → app categories ──────────────────────
@@ -104,6 +112,20 @@ _YAMNET_TO_APP: list[tuple[str, str]] = [
     ("Walk", "footsteps_running"),
 ]
 
+# Categories for short transients: a single loud frame matters, so frames are
+# max-pooled instead of averaged (averaging would dilute a 0.2 s shatter
+# across the whole chunk).
+TRANSIENT_CATEGORIES: frozenset[str] = frozenset({
+    "glass_breaking",
+    "door_slam",
+    "tire_screech",
+})
+
+# Per-category overrides of CONFIDENCE_THRESHOLD.  A category's score in a
+# frame is the score of its strongest YAMNet class, as in the original
+# top-class mapping, so the same threshold applies.
+CATEGORY_THRESHOLDS: dict[str, float] = {}
+
 # ── Urgency & haptics (unchanged from original) ──────────────────────────
 
 URGENCY: dict[str, str] = {
@@ -142,21 +164,143 @@ HAPTIC_PATTERN: dict[str, str] = {
 }
 
 
+def category_threshold(category: str) -> float:
+    """Confidence at which ``category`` is reported."""
+    return CATEGORY_THRESHOLDS.get(category, CONFIDENCE_THRESHOLD)
+
+
+def _packed_stride(num_samples: int) -> int:
+    """Samples a waveform occupies once packed (its padding, rounded to whole hops)."""
+    padded_len = PATCH_SAMPLES + (num_frames(num_samples) - 1) * PATCH_HOP_SAMPLES
+    return -(-padded_len // PATCH_HOP_SAMPLES) * PATCH_HOP_SAMPLES
+
+
+def _bucket_samples(frames: int) -> int:
+    """Waveform length that yields exactly ``frames`` YAMNet frames."""
+    return PATCH_SAMPLES + (frames - 1) * PATCH_HOP_SAMPLES
+
+
+def _pack_waveforms(waveforms: list[np.ndarray]) -> tuple[np.ndarray, list[tuple[int, int]]]:
+    """
+    Concatenate waveforms so one YAMNet call scores all of them.
+
+    Each waveform starts on a multiple of PATCH_HOP_SAMPLES and is followed by
+    enough zeros to reproduce YAMNet's own padding, so frame ``i`` of the packed
+    signal covers the same samples as the matching frame of a solo call.
+
+    Returns the packed waveform and a ``(start, stop)`` frame span per input.
+    """
+    offsets: list[int] = []
+    spans: list[tuple[int, int]] = []
+    total = 0
+    for waveform in waveforms:
+        first_frame = total // PATCH_HOP_SAMPLES
+        offsets.append(total)
+        spans.append((first_frame, first_frame + num_frames(len(waveform))))
+        total += _packed_stride(len(waveform))
+
+    packed = np.zeros(total, dtype=np.float32)
+    for offset, waveform in zip(offsets, waveforms):
+        packed[offset:offset + len(waveform)] = waveform
+    return packed, spans
+
+
+def _detection(category: str, confidence: float, label: str) -> dict:
+    return {
+        "sound_type": category,
+        "confidence": round(confidence, 3),
+        "urgency": URGENCY.get(category, "low"),
+        "haptic_pattern": HAPTIC_PATTERN.get(category, "single_tap"),
+        "yamnet_label": label,  # Include original label for debugging
+    }
+
+
+def _compile_category_index(class_names: list[str]) -> tuple[list[str], np.ndarray, np.ndarray]:
+    """
+    Compile _YAMNET_TO_APP into a (num_categories, max_members) class index.
+
+    Each YAMNet class contributes to at most one category (first substring
+    match wins, as before).  Row ``i`` lists the classes of category ``i``,
+    padded by repeating its first member, so ``frame_scores[:, index]``
+    gathers every category's members at once and a max over the last axis
+    gives each category its strongest class — the top-class score the
+    original mapping compared with CONFIDENCE_THRESHOLD.  Summing members
+    instead would let categories with many weak classes (sirens, vehicles)
+    cross the same threshold far too easily.  The second array flags the
+    categories with at least one class.
+
+    Embedding-head columns (``head:<category>``, see head.py) replace the
+    substring mapping for their category; head categories the mapping
+    doesn't know are added after the mapped ones.
+    """
+    head_columns = {
+        class_idx: name[len(HEAD_PREFIX):]
+        for class_idx, name in enumerate(class_names) if name.startswith(HEAD_PREFIX)
+    }
+    head_categories = set(head_columns.values()) - {BACKGROUND}
+    categories = list(dict.fromkeys(
+        [category for _substring, category in _YAMNET_TO_APP]
+        + [category for category in head_columns.values() if category in head_categories]
+    ))
+    members: dict[str, list[int]] = {category: [] for category in categories}
+    for class_idx, name in enumerate(class_names):
+        if class_idx in head_columns:
+            category = head_columns[class_idx] if head_columns[class_idx] in head_categories else None
+        else:
+            category = SoundClassifier._map_to_app_category(name)
+            if category in head_categories:
+                category = None
+        if category is not None:
+            members[category].append(class_idx)
+    width = max(1, max(len(classes) for classes in members.values()))
+    index = np.zeros((len(categories), width), dtype=np.intp)
+    for row, category in enumerate(categories):
+        classes = members[category] or [0]
+        index[row] = classes + [classes[0]] * (width - len(classes))
+    present = np.array([bool(members[category]) for category in categories])
+    return categories, index, present
+
+
 class SoundClassifier:
     """Loads YAMNet once and exposes a classify() method."""
 
-    def __init__(self) -> None:
-        print("[classifier] Loading YAMNet from TensorFlow Hub …")
-        self.model = hub.load("https://tfhub.dev/google/yamnet/1")
-        # Load the class map CSV bundled with the model
-        class_map_path = self.model.class_map_path().numpy().decode("utf-8")
-        with tf.io.gfile.GFile(class_map_path) as f:
-            reader = csv.DictReader(f)
-            self.class_names = [row["display_name"] for row in reader]
-        print(f"[classifier] YAMNet loaded — {len(self.class_names)} classes.")
+    def __init__(self, backend: InferenceBackend | None = None, cascade: bool = config.CASCADE_ENABLED) -> None:
+        # Packed batches are zero-padded up to one of these lengths so the
+        # backend only ever sees a few fixed input shapes.
+        self._bucket_lengths = sorted({_bucket_samples(f) for f in config.INFERENCE_FRAME_BUCKETS})
+        self.backend = backend or load_backend(self._bucket_lengths)
+        self.artifact = self.backend.artifact
+        self.class_names = self.backend.class_names
+        self.warmup_ms: float | None = None
+        log.info("YAMNet loaded — %d classes.", len(self.class_names))
+        self._compile_scoring()
+        self._bucket_hits: Counter[int] = Counter()
+        self._oversize_calls = 0
+
+        # Distilled student that answers the easy chunks (see student.py)
+        self.cascade: Cascade | None = None
+        student = load_student() if cascade else None
+        if student is not None:
+            try:
+                self.cascade = Cascade(student, self.categories)
+                log.info("Student cascade on — YAMNet only for band %s or critical sounds", self.cascade.band)
+            except ValueError as exc:
+                log.warning("Student cascade off: %s", exc)
 
     # ── public API ─────────────────────────────────────────────────────
 
+    def warm_up(self) -> float:
+        """
+        Run a silent buffer through every length bucket so the first real
+        chunk doesn't pay graph-building or kernel-selection cost.
+        """
+        started = time.perf_counter()
+        for length in self._bucket_lengths:
+            self._run_model(np.zeros(length, dtype=np.float32))
+        self.warmup_ms = (time.perf_counter() - started) * 1000
+        log.info("Warm-up done in %.0f ms", self.warmup_ms)
+        return self.warmup_ms
+
     def classify(
         self,
         audio_bytes: bytes,
@@ -177,46 +321,202 @@ class SoundClassifier:
         dict | None
             Detection dict or None if nothing exceeds threshold.
         """
-        waveform = self._decode_audio(audio_bytes, sample_rate)
+        waveform = self.decode(audio_bytes, sample_rate)
         if waveform is None:
             return None
+        return self.classify_waveforms([waveform])[0]
+
+    def decode(self, audio_bytes: bytes, sample_rate: int = TARGET_SR) -> np.ndarray | None:
+        """Decode audio bytes into the 16 kHz mono float32 waveform YAMNet expects."""
+        return decode_audio(audio_bytes, sample_rate)
 
-        # YAMNet expects a 1-D float32 tensor in [-1.0, 1.0]
-        scores, _embeddings, _spectrogram = self.model(waveform)
-        scores_np = scores.numpy()
-
-        # Average across frames, then pick the top class
-        mean_scores = scores_np.mean(axis=0)
-        top_idx = int(np.argmax(mean_scores))
-        confidence = float(mean_scores[top_idx])
-        yamnet_label = self.class_names[top_idx]
-
-        # Debug: log top-3 predictions
-        top3_indices = np.argsort(mean_scores)[-3:][::-1]
-        top3 = [(self.class_names[i], round(float(mean_scores[i]), 3)) for i in top3_indices]
-        print(f"[classifier] YAMNet top-3: {top3}")
-
-        # Map to app category
-        app_category = self._map_to_app_category(yamnet_label)
-
-        if app_category is None or confidence < CONFIDENCE_THRESHOLD:
-            if app_category is None:
-                print(f"[classifier] '{yamnet_label}' not mapped to any app category — skipping")
-            else:
-                print(f"[classifier] '{app_category}' confidence {confidence:.3f} below threshold {CONFIDENCE_THRESHOLD}")
+    def classify_waveforms(self, waveforms: list[np.ndarray]) -> list[dict | None]:
+        """
+        Classify several decoded waveforms with a single YAMNet invocation.
+
+        Parameters
+        ----------
+        waveforms : list[np.ndarray]
+            16 kHz mono float32 waveforms in [-1.0, 1.0].
+
+        Returns
+        -------
+        list[dict | None]
+            The strongest detection (or None) per input waveform, in input order.
+        """
+        if self.cascade is None:
+            return [self.detect(scores) for scores in self.score_waveforms(waveforms)]
+
+        results: list[dict | None] = [None] * len(waveforms)
+        escalated = []
+        for i, waveform in enumerate(waveforms):
+            detections = self.triage(waveform)
+            if detections is None:
+                escalated.append(i)
+            elif detections:
+                results[i] = detections[0]
+        for i, scores in zip(escalated, self.score_waveforms([waveforms[i] for i in escalated])):
+            results[i] = self.detect(scores)
+        return results
+
+    def triage(self, waveform: np.ndarray, threshold_scale: float | np.ndarray = 1.0) -> list[dict] | None:
+        """
+        The student model's detections for a waveform, or None when it has
+        to go to YAMNet (uncertain, or a critical category is plausible).
+        """
+        pooled = self.pool_categories(self.cascade.frame_scores(waveform))
+        outcome = self.cascade.decide(pooled)
+        self.cascade.record(outcome)
+        if outcome != "student":
             return None
+        fired = np.flatnonzero(pooled >= np.maximum(self._thresholds * threshold_scale, self.cascade.band[1]))
+        return [
+            _detection(self.categories[col], float(pooled[col]), "student")
+            for col in fired[np.argsort(pooled[fired])[::-1]]
+        ]
 
-        print(f"[classifier] ✅ DETECTED: {app_category} ({yamnet_label}) @ {confidence:.3f}")
+    def score_waveforms(self, waveforms: list[np.ndarray]) -> list[np.ndarray]:
+        """
+        Per-frame YAMNet scores for several waveforms from one model call.
+
+        The waveforms are packed end to end on patch-hop boundaries so that
+        every YAMNet frame either lies entirely inside one waveform or is
+        discarded.  Each waveform therefore gets exactly the frame scores it
+        would have received from a solo YAMNet call.
+        Batches larger than the biggest length bucket are split across calls.
+
+        Returns
+        -------
+        list[np.ndarray]
+            A ``(frames, 521)`` score array per input waveform, in input order
+            (plus one column per embedding-head category, if a head is loaded).
+        """
+        results: list[np.ndarray | None] = [None] * len(waveforms)
+        for group in self._bucket_groups(waveforms):
+            packed, spans = _pack_waveforms([waveforms[i] for i in group])
+            scores_np = self._run_model(packed)
+            for i, (start, stop) in zip(group, spans):
+                results[i] = scores_np[start:stop]
+        return results
+
+    def trace_stats(self) -> dict:
+        """Backend, length-bucket usage and (TensorFlow) trace counts."""
         return {
-            "sound_type": app_category,
-            "confidence": round(confidence, 3),
-            "urgency": URGENCY.get(app_category, "low"),
-            "haptic_pattern": HAPTIC_PATTERN.get(app_category, "single_tap"),
-            "yamnet_label": yamnet_label,  # Include original label for debugging
+            **self.backend.stats(),
+            "buckets_frames": [num_frames(length) for length in self._bucket_lengths],
+            "bucket_calls": {
+                num_frames(length): count for length, count in sorted(self._bucket_hits.items())
+            },
+            "oversize_calls": self._oversize_calls,
         }
 
+    def detect(self, scores_np: np.ndarray) -> dict | None:
+        """The strongest detection in a ``(frames, 521)`` block of scores, or None."""
+        detections = self.detect_all(scores_np)
+        return detections[0] if detections else None
+
+    def frame_category_scores(self, scores_np: np.ndarray) -> np.ndarray:
+        """``(frames, categories)`` score of every app category in each frame (its strongest class)."""
+        return np.where(self._category_present, scores_np[:, self._category_index].max(axis=2), 0.0)
+
+    def pool_categories(self, category_frames: np.ndarray) -> np.ndarray:
+        """Pool per-frame category scores: transients by max, the rest by mean."""
+        return np.where(
+            self._transient_mask, category_frames.max(axis=0), category_frames.mean(axis=0),
+        )
+
+    def category_scores(self, scores_np: np.ndarray) -> np.ndarray:
+        """Pooled score of every app category (ordered as ``self.categories``)."""
+        return self.pool_categories(self.frame_category_scores(scores_np))
+
+    def detect_all(self, scores_np: np.ndarray, threshold_scale: float | np.ndarray = 1.0) -> list[dict]:
+        """
+        Every app category above its threshold in a block of frame scores.
+
+        Category scores come from one gather through the compiled class →
+        category index; transient categories are max-pooled over frames and
+        the rest are averaged.  Results are sorted by confidence, highest
+        first, so a siren is still reported while "Speech" dominates.
+
+        ``threshold_scale`` < 1 also reports categories somewhat below their
+        threshold, for callers that apply hysteresis (see events.py).  It
+        may also be an array with one scale per category (a device profile's
+        ``threshold_scales``, where ``inf`` switches a category off).
+        """
+        category_scores = self.category_scores(scores_np)
+
+        # Debug: log top-3 YAMNet classes (only computed when DEBUG is on)
+        if log.isEnabledFor(logging.DEBUG):
+            mean_scores = scores_np.mean(axis=0)
+            top3_indices = np.argpartition(mean_scores, -3)[-3:]
+            top3_indices = top3_indices[np.argsort(mean_scores[top3_indices])[::-1]]
+            top3 = [(self.class_names[i], round(float(mean_scores[i]), 3)) for i in top3_indices]
+            log.debug("YAMNet top-3: %s", top3)
+
+        fired = np.flatnonzero(category_scores >= self._thresholds * threshold_scale)
+        if fired.size == 0:
+            return []
+
+        # Most responsible YAMNet class for each category that fired
+        class_scores = scores_np.max(axis=0)
+        detections = []
+        for col in fired[np.argsort(category_scores[fired])[::-1]]:
+            app_category = self.categories[col]
+            members = self._category_members[col]
+            yamnet_label = self.class_names[members[np.argmax(class_scores[members])]]
+            confidence = float(category_scores[col])
+            log.debug("✅ DETECTED: %s (%s) @ %.3f", app_category, yamnet_label, confidence)
+            detections.append(_detection(app_category, confidence, yamnet_label))
+        return detections
+
     # ── internals ──────────────────────────────────────────────────────
 
+    def _bucket_groups(self, waveforms: list[np.ndarray]) -> list[list[int]]:
+        """Split waveform indices into groups whose packed length fits a bucket."""
+        max_len = self._bucket_lengths[-1]
+        groups: list[list[int]] = []
+        current: list[int] = []
+        current_len = 0
+        for i, waveform in enumerate(waveforms):
+            stride = _packed_stride(len(waveform))
+            if current and current_len + stride > max_len:
+                groups.append(current)
+                current, current_len = [], 0
+            current.append(i)
+            current_len += stride
+        if current:
+            groups.append(current)
+        return groups
+
+    def _run_model(self, packed: np.ndarray) -> np.ndarray:
+        """Score a packed waveform through the smallest bucket that holds it."""
+        length = next((b for b in self._bucket_lengths if b >= len(packed)), None)
+        if length is None:
+            self._oversize_calls += 1
+            return self.backend.run(packed)
+
+        # Frames covering only the padding fall outside every waveform's
+        # span and are discarded by the caller.
+        self._bucket_hits[length] += 1
+        padded = np.zeros(length, dtype=np.float32)
+        padded[:len(packed)] = packed
+        return self.backend.run(padded)
+
+    def _compile_scoring(self) -> None:
+        """Precompute the category matrix, pooling mask and thresholds."""
+        self.categories, self._category_index, self._category_present = _compile_category_index(self.class_names)
+        self._category_members = [
+            np.unique(row) if present else row[:0]
+            for row, present in zip(self._category_index, self._category_present)
+        ]
+        self._transient_mask = np.array(
+            [category in TRANSIENT_CATEGORIES for category in self.categories],
+        )
+        self._thresholds = np.array(
+            [category_threshold(category) for category in self.categories],
+            dtype=np.float32,
+        )
+
     @staticmethod
     def _map_to_app_category(yamnet_label: str) -> str | None:
         """Map a YAMNet display name to an app category, or None if irrelevant."""
@@ -225,57 +525,3 @@ class SoundClassifier:
             if substring.lower() in label_lower:
                 return category
         return None
-
-    @staticmethod
-    def _decode_audio(audio_bytes: bytes, original_sr: int) -> np.ndarray | None:
-        """Decode audio bytes → 16 kHz mono float32 waveform in [-1, 1]."""
-
-        # Attempt 1: pydub + ffmpeg — handles AAC, MP4, WAV, OGG, etc.
-        try:
-            from pydub import AudioSegment
-
-            audio = AudioSegment.from_file(io.BytesIO(audio_bytes))
-            # Convert to mono 16kHz 16-bit PCM
-            audio = audio.set_channels(1).set_frame_rate(TARGET_SR).set_sample_width(2)
-            pcm = np.frombuffer(audio.raw_data, dtype=np.int16)
-            waveform = pcm.astype(np.float32) / 32768.0
-            print(f"[classifier] pydub decoded: {len(waveform)} samples ({len(waveform)/TARGET_SR:.2f}s)")
-            return waveform
-        except Exception as e:
-            print(f"[classifier] pydub decode failed: {e}")
-
-        # Attempt 2: soundfile — WAV/FLAC/OGG
-        try:
-            import soundfile as sf
-
-            waveform, sr = sf.read(io.BytesIO(audio_bytes), dtype="float32")
-            if waveform.ndim > 1:
-                waveform = waveform.mean(axis=1)
-            if sr != TARGET_SR:
-                import librosa
-                waveform = librosa.resample(waveform, orig_sr=sr, target_sr=TARGET_SR)
-            return waveform.astype(np.float32)
-        except Exception as e:
-            print(f"[classifier] soundfile decode failed: {e}")
-
-        # Attempt 3: raw PCM int16
-        try:
-            trimmed = audio_bytes[:len(audio_bytes) - (len(audio_bytes) % 2)]
-            if len(trimmed) < 2:
-                raise ValueError("Audio data too short for PCM int16")
-            pcm = np.frombuffer(trimmed, dtype=np.int16)
-            waveform = pcm.astype(np.float32) / 32768.0
-            if original_sr != TARGET_SR:
-                import librosa
-                waveform = librosa.resample(
-                    waveform, orig_sr=original_sr, target_sr=TARGET_SR
-                )
-            print(f"[classifier] Decoded as raw PCM: {len(waveform)} samples")
-            return waveform
-        except Exception as e:
-            print(f"[classifier] Raw PCM decode failed: {e}")
-
-        print(f"[classifier] All decode attempts failed for {len(audio_bytes)} bytes")
-        return None
-
-
@@ -0,0 +1,295 @@
+"""
+Shadow-Sound — Runtime configuration
+
+Every knob below can be overridden with an environment variable of the same
+name (see docker-compose.yml), so deployments can be tuned without touching
+code.
+"""
+
+import os
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.environ.get(name)
+    return int(value) if value not in (None, "") else default
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+def _env_int_list(name: str, default: tuple[int, ...]) -> tuple[int, ...]:
+    value = os.environ.get(name)
+    if value in (None, ""):
+        return default
+    return tuple(int(part) for part in value.split(",") if part.strip())
+
+
+def _env_str(name: str, default: str) -> str:
+    value = os.environ.get(name)
+    return value if value not in (None, "") else default
+
+
+def _env_float(name: str, default: float) -> float:
+    value = os.environ.get(name)
+    return float(value) if value not in (None, "") else default
+
+
+# ── Inference micro-batching ──────────────────────────────────────────────
+# Chunks from all open sockets are coalesced into one YAMNet call.  A batch
+# is dispatched as soon as it is full or the oldest chunk has waited
+# BATCH_MAX_WAIT_MS, whichever comes first.  BATCH_MAX_SIZE=1 disables it.
+
+BATCH_MAX_SIZE = _env_int("BATCH_MAX_SIZE", 16)
+BATCH_MAX_WAIT_MS = _env_float("BATCH_MAX_WAIT_MS", 15.0)
+
+# ── Worker pools ──────────────────────────────────────────────────────────
+# Decoding runs in a "thread" or "process" pool; YAMNet runs in its own
+# thread pool.  At most MAX_PENDING_CHUNKS chunks may be in flight across all
+# sockets — further chunks are rejected with an "overloaded" error.
+
+DECODE_POOL = _env_str("DECODE_POOL", "thread")
+DECODE_WORKERS = _env_int("DECODE_WORKERS", 2)
+INFERENCE_THREADS = _env_int("INFERENCE_THREADS", 1)
+MAX_PENDING_CHUNKS = _env_int("MAX_PENDING_CHUNKS", 64)
+DECODE_TIMEOUT_S = _env_float("DECODE_TIMEOUT_S", 2.0)
+INFERENCE_TIMEOUT_S = _env_float("INFERENCE_TIMEOUT_S", 3.0)
+
+# ── Stale-chunk shedding ──────────────────────────────────────────────────
+# Each connection's messages are stamped on arrival.  An audio chunk older
+# than CHUNK_DEADLINE_MS is dropped if a newer one is already waiting, and
+# at most INBOX_MAX_CHUNKS chunks are kept queued per connection.  While
+# chunks are being dropped the client gets a "throttle" message at most every
+# THROTTLE_INTERVAL_S, and a "resume" one after THROTTLE_RESUME_S without drops.
+
+CHUNK_DEADLINE_MS = _env_int("CHUNK_DEADLINE_MS", 2500)
+INBOX_MAX_CHUNKS = _env_int("INBOX_MAX_CHUNKS", 8)
+THROTTLE_INTERVAL_S = _env_float("THROTTLE_INTERVAL_S", 5.0)
+THROTTLE_RESUME_S = _env_float("THROTTLE_RESUME_S", 30.0)
+
+# ── Sound events ──────────────────────────────────────────────────────────
+# Clients that authenticate with "events": true get event_start /
+# event_update / event_end messages instead of a detection per chunk (see
+# events.py).  An event ends once its category has stayed below
+# EVENT_OFFSET_RATIO × its threshold for EVENT_RELEASE_S.
+
+EVENT_OFFSET_RATIO = _env_float("EVENT_OFFSET_RATIO", 0.7)
+EVENT_RELEASE_S = _env_float("EVENT_RELEASE_S", 3.0)
+EVENT_MIN_DURATION_S = _env_float("EVENT_MIN_DURATION_S", 1.0)
+EVENT_COOLDOWN_S = _env_float("EVENT_COOLDOWN_S", 5.0)
+EVENT_UPDATE_INTERVAL_S = _env_float("EVENT_UPDATE_INTERVAL_S", 10.0)
+
+# ── Offline classification ────────────────────────────────────────────────
+# POST /api/v1/recordings/classify scores whole recordings into an NDJSON
+# timeline of OFFLINE_SEGMENT_FRAMES-frame segments (0.48 s per frame).  At
+# most OFFLINE_MAX_JOBS run at once per worker; more get a 429.  Audio is
+# scored in blocks of OFFLINE_BLOCK_FRAMES, one block per model call and only
+# while no live chunk is waiting, so a live chunk waits for at most one
+# block.  M4A/CAF bodies are spooled to OFFLINE_SPOOL_DIR (keep it on disk,
+# not tmpfs), up to OFFLINE_SPOOL_MAX_MB each.
+
+OFFLINE_SEGMENT_FRAMES = _env_int("OFFLINE_SEGMENT_FRAMES", 2)
+OFFLINE_MAX_JOBS = _env_int("OFFLINE_MAX_JOBS", 2)
+OFFLINE_BLOCK_FRAMES = _env_int("OFFLINE_BLOCK_FRAMES", 32)
+OFFLINE_SPOOL_DIR = _env_str(
+    "OFFLINE_SPOOL_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "spool"),
+)
+OFFLINE_SPOOL_MAX_MB = _env_int("OFFLINE_SPOOL_MAX_MB", 512)
+
+# ── Streaming inference ───────────────────────────────────────────────────
+# With STREAMING_INFERENCE on, each connection keeps a rolling buffer and
+# only scores YAMNet frames (0.96 s windows, 0.48 s hop) it hasn't scored
+# yet, so sounds straddling two chunks are seen in a full window.  Each
+# detection pools STREAM_POOL_FRAMES consecutive frames.
+
+STREAMING_INFERENCE = _env_bool("STREAMING_INFERENCE", True)
+STREAM_POOL_FRAMES = _env_int("STREAM_POOL_FRAMES", 2)
+
+# ── Stream decoding ───────────────────────────────────────────────────────
+# Clients that authenticate with "stream_format" ("aac" for ADTS, "ogg",
+# "webm") send one continuous compressed stream across their chunks.  Each
+# such connection keeps one ffmpeg process fed over a pipe (see
+# stream_decoder.py), at most STREAM_DECODERS_MAX per worker; past that,
+# auth_ok says "stream_format": null and the client sends whole files.
+# After writing a chunk, the server waits up to STREAM_DECODER_WAIT_MS for
+# its audio; anything later comes with the next chunk.
+
+STREAM_DECODERS_MAX = _env_int("STREAM_DECODERS_MAX", 64)
+STREAM_DECODER_WAIT_MS = _env_float("STREAM_DECODER_WAIT_MS", 50.0)
+
+# ── Direction of arrival ──────────────────────────────────────────────────
+# Stereo chunks (two-channel WAV/M4A, or version 3 binary frames) keep their
+# first two channels, and detections get a direction from the delay between
+# them (GCC-PHAT, see direction.py).  DOA_MIC_SPACING_M is the distance
+# between the phone's two microphones; directions whose correlation peak is
+# below DOA_MIN_CONFIDENCE are left out.
+
+DOA_ENABLED = _env_bool("DOA_ENABLED", True)
+DOA_MIC_SPACING_M = _env_float("DOA_MIC_SPACING_M", 0.14)
+DOA_MIN_CONFIDENCE = _env_float("DOA_MIN_CONFIDENCE", 0.2)
+
+# ── Model artifacts ───────────────────────────────────────────────────────
+# The server loads a pinned YAMNet SavedModel from YAMNET_MODEL_DIR (fetch it
+# with `python model_store.py fetch`) and verifies its SHA-256 against
+# YAMNET_MODEL_SHA256, the committed digest (the image gets it from the
+# Dockerfile's build argument).  fetch refuses a download that doesn't
+# match it.  Start-up never touches the network unless YAMNET_HUB_FALLBACK
+# is switched on, in which case a missing or mismatched artifact is
+# downloaded from the hub.
+
+YAMNET_HUB_URL = "https://tfhub.dev/google/yamnet/1"
+YAMNET_MODEL_DIR = _env_str(
+    "YAMNET_MODEL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", "yamnet"),
+)
+YAMNET_MODEL_SHA256 = _env_str("YAMNET_MODEL_SHA256", "")
+YAMNET_HUB_FALLBACK = _env_bool("YAMNET_HUB_FALLBACK", False)
+MODEL_WARMUP = _env_bool("MODEL_WARMUP", True)
+
+# ── Length buckets ────────────────────────────────────────────────────────
+# Packed batches are padded up to one of these sizes (in YAMNet frames of
+# 0.48 s) and run through a tf.function traced once per size at startup.
+# A lone 1.5 s chunk fits the 4-frame bucket; each extra chunk in a batch
+# adds 5 frames.  More buckets mean less padding but more traced graphs.
+
+INFERENCE_FRAME_BUCKETS = _env_int_list(
+    "INFERENCE_FRAME_BUCKETS", (4, 8, 12, 16, 24, 32, 48, 64, 96, 128),
+)
+
+# ── Inference backend ─────────────────────────────────────────────────────
+# "tensorflow" runs the SavedModel above.  "tflite" and "onnx" run a model
+# produced by `python export_model.py export` from EXPORT_DIR, in the
+# INFERENCE_MODEL_VARIANT precision ("float32", "float16" or "int8"), and
+# don't need TensorFlow installed at all.  BACKEND_NUM_THREADS=0 leaves the
+# runtime's own default.  "stub" loads no model at all and fakes scores
+# from loudness at STUB_FRAME_MS per frame (load tests, see bench.py).
+
+INFERENCE_BACKEND = _env_str("INFERENCE_BACKEND", "tensorflow")
+INFERENCE_MODEL_VARIANT = _env_str("INFERENCE_MODEL_VARIANT", "int8")
+EXPORT_DIR = _env_str(
+    "EXPORT_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", "exported"),
+)
+BACKEND_NUM_THREADS = _env_int("BACKEND_NUM_THREADS", 0)
+STUB_FRAME_MS = _env_float("STUB_FRAME_MS", 2.0)
+
+# ── Embedding head ────────────────────────────────────────────────────────
+# `python train.py --head` trains a dense classifier on YAMNet's per-frame
+# embeddings and saves it here.  While the file exists, its categories are
+# scored by the head instead of by YAMNet class-name mapping (see head.py).
+# An empty EMBEDDING_HEAD_PATH turns the head off.
+
+EMBEDDING_HEAD_PATH = _env_str(
+    "EMBEDDING_HEAD_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", "embedding_head.npz"),
+)
+
+# ── Student cascade ───────────────────────────────────────────────────────
+# With a distilled student model at CASCADE_STUDENT_PATH (`python train.py
+# --student`), each chunk is scored by the student first.  YAMNet runs only
+# when some category's student score is inside [CASCADE_BAND_LOW,
+# CASCADE_BAND_HIGH) or a critical one (siren, glass, tire screech) reaches
+# CASCADE_CRITICAL_FLOOR.  `python student.py report --corpus data/` shows
+# the escalation rate and agreement with YAMNet for a range of bands.
+
+CASCADE_ENABLED = _env_bool("CASCADE_ENABLED", True)
+CASCADE_STUDENT_PATH = _env_str(
+    "CASCADE_STUDENT_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "model", "student.tflite"),
+)
+CASCADE_BAND_LOW = _env_float("CASCADE_BAND_LOW", 0.1)
+CASCADE_BAND_HIGH = _env_float("CASCADE_BAND_HIGH", 0.6)
+CASCADE_CRITICAL_FLOOR = _env_float("CASCADE_CRITICAL_FLOOR", 0.05)
+
+# ── Device settings ───────────────────────────────────────────────────────
+# Per-device settings live in an SQLite database (WAL mode, shared by every
+# worker).  Each worker keeps SETTINGS_CACHE_SIZE compiled profiles and
+# picks up writes made through other workers every SETTINGS_REFRESH_S.  With
+# battery saver on, the phone is asked to send a chunk every
+# BATTERY_SAVER_CHUNK_MS instead of every 1.5 s.  See device_settings.py.
+
+SETTINGS_DB_PATH = _env_str(
+    "SETTINGS_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "settings.db"),
+)
+SETTINGS_CACHE_SIZE = _env_int("SETTINGS_CACHE_SIZE", 4096)
+SETTINGS_REFRESH_S = _env_float("SETTINGS_REFRESH_S", 1.0)
+BATTERY_SAVER_CHUNK_MS = _env_int("BATTERY_SAVER_CHUNK_MS", 3000)
+
+# ── Feedback ──────────────────────────────────────────────────────────────
+# Each connection keeps the audio behind its detections for FEEDBACK_BUFFER_S
+# so user feedback can store the labelled clip.  Clips are appended to the
+# segment log in FEEDBACK_LOG_DIR by a background writer, in batches of up to
+# FEEDBACK_BATCH_SIZE gathered over FEEDBACK_FLUSH_S; beyond
+# FEEDBACK_QUEUE_SIZE waiting entries, feedback is dropped rather than
+# blocking.  `python train.py --feedback` trains on the log (see feedback.py).
+# POST /api/v1/feedback reaching another worker is relayed to the one that
+# issued the detection over its Unix socket in FEEDBACK_SOCKET_DIR.
+
+FEEDBACK_LOG_DIR = _env_str(
+    "FEEDBACK_LOG_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "state", "feedback"),
+)
+FEEDBACK_BUFFER_S = _env_float("FEEDBACK_BUFFER_S", 60.0)
+FEEDBACK_QUEUE_SIZE = _env_int("FEEDBACK_QUEUE_SIZE", 256)
+FEEDBACK_BATCH_SIZE = _env_int("FEEDBACK_BATCH_SIZE", 32)
+FEEDBACK_FLUSH_S = _env_float("FEEDBACK_FLUSH_S", 0.5)
+FEEDBACK_SOCKET_DIR = _env_str("FEEDBACK_SOCKET_DIR", "/tmp/shadowsound-feedback")
+
+# ── Logging ───────────────────────────────────────────────────────────────
+# Server logs go through log.py, which writes from a background thread so
+# the event loop never blocks on stdout.  Per-chunk diagnostics (YAMNet
+# top-3, decoded sizes, every detection) are logged at DEBUG.
+
+LOG_LEVEL = _env_str("LOG_LEVEL", "INFO").upper()
+
+# ── Activity gate ─────────────────────────────────────────────────────────
+# Chunks that are silent (peak below GATE_SILENCE_DBFS) or indistinguishable
+# from the session's background noise skip YAMNet entirely.  Loud onsets and
+# sudden spectral changes always pass; after a pass the gate stays open for
+# GATE_HOLD_CHUNKS, and it never skips more than GATE_MAX_SKIP_CHUNKS in a
+# row.  Per-profile sensitivities live in gate.PROFILES.
+
+GATE_ENABLED = _env_bool("GATE_ENABLED", True)
+GATE_SILENCE_DBFS = _env_float("GATE_SILENCE_DBFS", -65.0)
+GATE_HOLD_CHUNKS = _env_int("GATE_HOLD_CHUNKS", 2)
+GATE_MAX_SKIP_CHUNKS = _env_int("GATE_MAX_SKIP_CHUNKS", 4)
+GATE_WARMUP_CHUNKS = _env_int("GATE_WARMUP_CHUNKS", 3)
+
+# ── Out-of-process inference ──────────────────────────────────────────────
+# With INFERENCE_SERVER set (comma-separated Unix socket paths), uvicorn
+# workers don't load YAMNet themselves: waveforms go through shared-memory
+# slots to inference_server.py processes that own the model and batch
+# across every worker.  launch.py starts MODEL_REPLICAS such servers plus
+# uvicorn with WEB_WORKERS workers and wires this up automatically.
+# INFERENCE_SLOTS shared-memory slots of INFERENCE_SLOT_SECONDS audio are
+# allocated per worker and server (~6.5 MB of /dev/shm each by default);
+# longer waveforms are sent inline over the socket.
+# With several workers, each keeps its own metrics; launch.py points them
+# at a fresh METRICS_DIR so GET /metrics adds them all up (see metrics.py).
+# Empty means /metrics shows only the worker that answers.
+
+INFERENCE_SERVER = _env_str("INFERENCE_SERVER", "")
+INFERENCE_SOCKET_DIR = _env_str("INFERENCE_SOCKET_DIR", "/tmp/shadowsound")
+INFERENCE_SLOTS = _env_int("INFERENCE_SLOTS", 32)
+INFERENCE_SLOT_SECONDS = _env_float("INFERENCE_SLOT_SECONDS", 3.0)
+MODEL_REPLICAS = _env_int("MODEL_REPLICAS", 1)
+WEB_WORKERS = _env_int("WEB_WORKERS", 2)
+METRICS_DIR = _env_str("METRICS_DIR", "")
+
+# ── Subscriber fan-out ────────────────────────────────────────────────────
+# /ws/subscribe/{device_id} streams a device's detections and events to
+# other devices (family, support workers).  Each uvicorn worker binds a Unix
+# datagram socket in FANOUT_SOCKET_DIR and forwards each message to the
+# other workers that have subscribers for its device (see fanout.py).  A subscriber more than
+# FANOUT_QUEUE_SIZE messages behind is disconnected.  Subscribers must send
+# FANOUT_TOKEN in an auth message within FANOUT_AUTH_TIMEOUT_S of connecting
+# (not in the URL, which access logs record); while it is empty (the
+# default) fan-out is off and every subscriber is refused.
+
+FANOUT_SOCKET_DIR = _env_str("FANOUT_SOCKET_DIR", "/tmp/shadowsound-fanout")
+FANOUT_QUEUE_SIZE = _env_int("FANOUT_QUEUE_SIZE", 64)
+FANOUT_TOKEN = _env_str("FANOUT_TOKEN", "")
+FANOUT_AUTH_TIMEOUT_S = _env_float("FANOUT_AUTH_TIMEOUT_S", 5.0)
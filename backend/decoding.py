@@ -0,0 +1,457 @@
+"""
+Shadow-Sound — Audio decoding
+
+Turns the bytes a phone sends (AAC/M4A, WAV, OGG, raw PCM, …) into the
+16 kHz mono float32 waveform YAMNet expects.
+
+Each payload is sniffed by its magic bytes and dispatched straight to the
+cheapest decoder that understands it:
+
+    RIFF/WAVE          in-process RIFF parser (np.frombuffer, no subprocess)
+    OggS, fLaC         libsndfile via soundfile
+    ftyp, caff, ADTS,  pydub + ffmpeg (the only option for AAC)
+    ID3, EBML
+    anything else      headerless int16 PCM at the client's sample rate
+
+If the chosen decoder fails, ffmpeg and then raw PCM are tried, so odd
+payloads still decode the way they did before.  Decoders hand back samples
+at their native rate and channel count; channels are mixed down before
+resampling, with a polyphase filter whose taps are designed once per
+common source rate and cached.  Rates outside MIN_SAMPLE_RATE–
+MAX_SAMPLE_RATE are rejected: the filter grows with the rate's up/down
+factors, so unusual rates are also rounded to a ratio with at most
+MAX_RATE_FACTOR steps down (well under 0.1 % off in pitch).  When asked to, the first two channels of a stereo
+payload are also kept, resampled, for direction finding (direction.py).
+
+Kept free of TensorFlow imports so decoding can run in worker processes
+without each one loading the model stack.
+"""
+
+import io
+import struct
+import threading
+import time
+from dataclasses import dataclass
+from fractions import Fraction
+from functools import lru_cache
+from math import gcd
+from typing import Callable
+
+import numpy as np
+
+from log import get_logger
+
+log = get_logger("decoder")
+
+TARGET_SR = 16000          # YAMNet requires 16 kHz mono
+
+# ── YAMNet framing (see yamnet/params.py) ────────────────────────────────
+# One frame ("patch") spans 96 STFT hops of 10 ms plus one 25 ms window, and
+# consecutive frames start 0.48 s apart.  Waveforms shorter than one patch
+# are zero-padded by YAMNet itself; longer ones are padded up to a whole
+# number of hops.  Kept here, free of model imports, so every module that
+# frames audio shares one definition.
+
+PATCH_SAMPLES = 15600      # 0.975 s
+PATCH_HOP_SAMPLES = 7680   # 0.48 s
+
+
+def num_frames(num_samples: int) -> int:
+    """Number of YAMNet frames produced for a waveform of this length."""
+    extra = max(0, num_samples - PATCH_SAMPLES)
+    return 1 + -(-extra // PATCH_HOP_SAMPLES)
+
+
+# Sample rates accepted from clients and file headers
+MIN_SAMPLE_RATE = 8000
+MAX_SAMPLE_RATE = 96000
+MAX_RATE_FACTOR = 1000     # bounds the resampling filter at ~40k taps
+# Rates whose filters are kept; others are designed per call
+COMMON_SAMPLE_RATES = frozenset({8000, 11025, 12000, 22050, 24000, 32000, 44100, 48000, 88200, 96000})
+
+# File extensions the corpus tools pick up when walking a directory
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".ogg", ".flac", ".m4a", ".aac")
+
+DecoderFn = Callable[[bytes, int], tuple[np.ndarray, int]]
+
+_DECODERS: dict[str, DecoderFn] = {}
+
+# Resampling time accumulated by the current decode, per thread/process
+_clock = threading.local()
+
+
+def register_decoder(fmt: str) -> Callable[[DecoderFn], DecoderFn]:
+    """
+    Register ``fn(audio_bytes, client_sample_rate) -> (samples, rate)`` for
+    a sniffed format, where ``samples`` is a (frames, channels) array.
+    """
+    def wrap(fn: DecoderFn) -> DecoderFn:
+        _DECODERS[fmt] = fn
+        return fn
+    return wrap
+
+
+# ── Format sniffing ───────────────────────────────────────────────────────
+
+def sniff_format(audio_bytes: bytes) -> str:
+    """Identify a payload's container from its first bytes."""
+    head = audio_bytes[:12]
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "wav"
+    if head[:4] == b"OggS":
+        return "ogg"
+    if head[:4] == b"fLaC":
+        return "flac"
+    if head[4:8] == b"ftyp":
+        return "m4a"
+    if head[:4] == b"caff":
+        return "caf"
+    if head[:4] == b"\x1a\x45\xdf\xa3":
+        return "webm"
+    if head[:3] == b"ID3":
+        return "mp3"
+    if len(head) >= 2 and head[0] == 0xFF and (head[1] & 0xF6) == 0xF0:
+        return "aac"       # ADTS sync word, layer 0
+    return "pcm"
+
+
+# ── Resampling ────────────────────────────────────────────────────────────
+
+def valid_sample_rate(rate: object) -> bool:
+    """Whether a client- or header-declared rate is one we resample from."""
+    return isinstance(rate, (int, float)) and not isinstance(rate, bool) and MIN_SAMPLE_RATE <= rate <= MAX_SAMPLE_RATE
+
+
+@lru_cache(maxsize=len(COMMON_SAMPLE_RATES))
+def _common_filter(source_sr: int) -> tuple[int, int, np.ndarray]:
+    return _design_filter(source_sr)
+
+
+def _design_filter(source_sr: int) -> tuple[int, int, np.ndarray]:
+    from scipy.signal import firwin
+
+    g = gcd(source_sr, TARGET_SR)
+    up, down = TARGET_SR // g, source_sr // g
+    if down > MAX_RATE_FACTOR:
+        ratio = Fraction(up, down).limit_denominator(MAX_RATE_FACTOR)
+        up, down = ratio.numerator, ratio.denominator
+    max_rate = max(up, down)
+    taps = firwin(2 * 10 * max_rate + 1, 1.0 / max_rate, window=("kaiser", 5.0))
+    return up, down, taps
+
+
+def _polyphase_filter(source_sr: int) -> tuple[int, int, np.ndarray]:
+    """Up/down factors and low-pass taps for source_sr → TARGET_SR."""
+    if not valid_sample_rate(source_sr):
+        raise ValueError(f"Unsupported sample rate {source_sr} Hz")
+    if source_sr in COMMON_SAMPLE_RATES:
+        return _common_filter(source_sr)
+    return _design_filter(source_sr)
+
+
+def resample(waveform: np.ndarray, source_sr: int) -> np.ndarray:
+    """Resample a float32 waveform (mono, or (samples, channels)) to TARGET_SR."""
+    if source_sr == TARGET_SR:
+        return waveform
+    from scipy.signal import resample_poly
+
+    started = time.perf_counter()
+    up, down, taps = _polyphase_filter(int(source_sr))
+    resampled = resample_poly(waveform, up, down, window=taps).astype(np.float32, copy=False)
+    _clock.resample_ms = getattr(_clock, "resample_ms", 0.0) + (time.perf_counter() - started) * 1000
+    return resampled
+
+
+class StreamResampler:
+    """
+    Resample an unbounded mono stream block by block.
+
+    Each block is filtered together with ``margin`` samples of context on
+    either side (a whole number of ``down`` periods, longer than the filter's
+    half-length), so joining the outputs gives the same signal as
+    resampling everything at once — without holding everything at once.
+    """
+
+    def __init__(self, source_sr: int) -> None:
+        self.source_sr = int(source_sr)
+        self._pending = np.zeros(0, dtype=np.float32)
+        if self.source_sr == TARGET_SR:
+            return
+        self.up, self.down, self._taps = _polyphase_filter(self.source_sr)
+        half = (len(self._taps) // 2) / self.up
+        self.margin = self.down * int(np.ceil(half / self.down))
+        # Context before the first block is silence, as in resample()
+        self._pending = np.zeros(self.margin, dtype=np.float32)
+
+    def push(self, samples: np.ndarray) -> np.ndarray:
+        """Resampled output for as much of the stream as can be finished."""
+        if self.source_sr == TARGET_SR:
+            return samples.astype(np.float32, copy=False)
+        self._pending = np.concatenate([self._pending, samples.astype(np.float32, copy=False)])
+        ready = len(self._pending) - 2 * self.margin
+        ready -= ready % self.down
+        if ready <= 0:
+            return np.zeros(0, dtype=np.float32)
+        out = self._run(self._pending[:ready + 2 * self.margin], ready)
+        self._pending = self._pending[ready:]
+        return out
+
+    def flush(self) -> np.ndarray:
+        """The rest of the stream, with silence as trailing context."""
+        if self.source_sr == TARGET_SR:
+            return np.zeros(0, dtype=np.float32)
+        remaining = len(self._pending) - self.margin
+        if remaining <= 0:
+            return np.zeros(0, dtype=np.float32)
+        padded = remaining + (-remaining % self.down)
+        window = np.zeros(padded + 2 * self.margin, dtype=np.float32)
+        window[:len(self._pending)] = self._pending
+        self._pending = np.zeros(0, dtype=np.float32)
+        out_len = -(-remaining * self.up // self.down)   # ceil, as resample_poly
+        return self._run(window, padded)[:out_len]
+
+    def _run(self, window: np.ndarray, length: int) -> np.ndarray:
+        from scipy.signal import resample_poly
+
+        started = time.perf_counter()
+        out = resample_poly(window, self.up, self.down, window=self._taps).astype(np.float32, copy=False)
+        skip = self.margin * self.up // self.down
+        out = out[skip:skip + length * self.up // self.down]
+        _clock.resample_ms = getattr(_clock, "resample_ms", 0.0) + (time.perf_counter() - started) * 1000
+        return out
+
+
+def pcm_to_waveform(samples: np.ndarray, sample_rate: int) -> np.ndarray:
+    """
+    Convert mono int16/float32 PCM samples to a 16 kHz float32 waveform.
+
+    float32 input at 16 kHz is returned as-is (no copy); int16 input costs a
+    single conversion into a fresh float32 buffer.
+    """
+    if samples.dtype.kind == "i":
+        waveform = samples.astype(np.float32)
+        waveform *= 1.0 / 32768.0
+    else:
+        waveform = samples.astype(np.float32, copy=False)
+    return resample(waveform, sample_rate)
+
+
+def _to_float(samples: np.ndarray) -> np.ndarray:
+    """(frames, channels) integer/float samples → float32 in [-1, 1]."""
+    if samples.dtype == np.uint8:
+        return (samples.astype(np.float32) - 128.0) * (1.0 / 128.0)
+    if samples.dtype.kind == "i":
+        scale = 1.0 / float(1 << (8 * samples.dtype.itemsize - 1))
+        return samples.astype(np.float32) * scale
+    return samples.astype(np.float32, copy=False)
+
+
+def _to_mono_float(samples: np.ndarray) -> np.ndarray:
+    """(frames, channels) integer/float samples → mono float32 in [-1, 1]."""
+    samples = _to_float(samples)
+    if samples.shape[1] == 1:
+        return samples[:, 0]
+    return samples.mean(axis=1, dtype=np.float32)
+
+
+def split_channels(
+    samples: np.ndarray, sample_rate: int, keep_pair: bool = False,
+) -> tuple[np.ndarray, np.ndarray | None]:
+    """
+    (frames, channels) samples → the 16 kHz mono mix, plus the first two
+    channels as a 16 kHz (samples, 2) pair if ``keep_pair`` and there are
+    at least two (None otherwise).
+    """
+    floats = _to_float(samples)
+    mono = floats[:, 0] if floats.shape[1] == 1 else floats.mean(axis=1, dtype=np.float32)
+    pair = None
+    if keep_pair and floats.shape[1] >= 2:
+        pair = resample(np.ascontiguousarray(floats[:, :2]), sample_rate)
+    return resample(mono, sample_rate), pair
+
+
+# ── Decoders ──────────────────────────────────────────────────────────────
+
+_WAV_DTYPES: dict[tuple[int, int], str] = {
+    (1, 8): "u1",
+    (1, 16): "<i2",
+    (1, 32): "<i4",
+    (3, 32): "<f4",
+}
+
+
+@dataclass(frozen=True)
+class WavFormat:
+    tag: int            # 1 = integer PCM, 3 = IEEE float
+    channels: int
+    rate: int
+    bits: int
+    data_offset: int    # where the sample data starts
+    data_size: int      # as declared (0 or 0xFFFFFFFF when the writer didn't know)
+
+    @property
+    def dtype(self) -> str | None:
+        """numpy dtype for the samples, None for encodings left to libsndfile."""
+        return _WAV_DTYPES.get((self.tag, self.bits)) if self.channels >= 1 else None
+
+
+def parse_wav_header(head: bytes) -> WavFormat | None:
+    """
+    Walk the RIFF chunks up to the start of the sample data.
+
+    Returns None if ``head`` ends before the data chunk starts; raises
+    ValueError if the data chunk comes without a fmt chunk.
+    """
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(head):
+        chunk_id = head[pos:pos + 4]
+        (size,) = struct.unpack_from("<I", head, pos + 4)
+        body = pos + 8
+        if chunk_id == b"fmt ":
+            if body + 16 > len(head):
+                return None
+            tag, channels, rate, _byte_rate, _align, bits = struct.unpack_from("<HHIIHH", head, body)
+            if tag == 0xFFFE and size >= 26:  # WAVE_FORMAT_EXTENSIBLE → real tag in sub-format GUID
+                if body + 26 > len(head):
+                    return None
+                (tag,) = struct.unpack_from("<H", head, body + 24)
+            fmt = (tag, channels, rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None:
+                raise ValueError("WAV is missing its fmt chunk")
+            return WavFormat(*fmt, data_offset=body, data_size=size)
+        pos = body + size + (size & 1)
+    return None
+
+
+@register_decoder("wav")
+def _decode_wav(audio_bytes: bytes, _client_sr: int) -> tuple[np.ndarray, int]:
+    """Parse RIFF chunks directly and view the sample data in place."""
+    wav = parse_wav_header(audio_bytes)
+    if wav is None:
+        raise ValueError("WAV is missing its fmt or data chunk")
+
+    dtype = wav.dtype
+    if dtype is None:
+        # 24-bit, A-law, ADPCM, … — leave those to libsndfile
+        return _decode_soundfile(audio_bytes, _client_sr)
+
+    # Streaming writers often leave the size as 0 or 0xFFFFFFFF
+    body, size = wav.data_offset, wav.data_size
+    end = len(audio_bytes) if size in (0, 0xFFFFFFFF) else min(body + size, len(audio_bytes))
+    data = memoryview(audio_bytes)[body:end]
+    if not valid_sample_rate(wav.rate):
+        raise ValueError(f"Unsupported WAV sample rate {wav.rate} Hz")
+    frame_bytes = np.dtype(dtype).itemsize * wav.channels
+    data = data[:len(data) - len(data) % frame_bytes]
+    return np.frombuffer(data, dtype=dtype).reshape(-1, wav.channels), wav.rate
+
+
+@register_decoder("ogg")
+@register_decoder("flac")
+def _decode_soundfile(audio_bytes: bytes, _client_sr: int) -> tuple[np.ndarray, int]:
+    import soundfile as sf
+
+    return sf.read(io.BytesIO(audio_bytes), dtype="float32", always_2d=True)
+
+
+@register_decoder("m4a")
+@register_decoder("caf")
+@register_decoder("webm")
+@register_decoder("mp3")
+@register_decoder("aac")
+def _decode_ffmpeg(audio_bytes: bytes, _client_sr: int) -> tuple[np.ndarray, int]:
+    from pydub import AudioSegment
+
+    audio = AudioSegment.from_file(io.BytesIO(audio_bytes))
+    # Let ffmpeg hand back 16-bit PCM at its native rate and channel count;
+    # mixing and resampling then go through the same cached path as every
+    # other format.
+    audio = audio.set_sample_width(2)
+    return np.frombuffer(audio.raw_data, dtype=np.int16).reshape(-1, audio.channels), audio.frame_rate
+
+
+@register_decoder("pcm")
+def _decode_pcm(audio_bytes: bytes, client_sr: int) -> tuple[np.ndarray, int]:
+    trimmed = memoryview(audio_bytes)[:len(audio_bytes) - (len(audio_bytes) % 2)]
+    if len(trimmed) < 2:
+        raise ValueError("Audio data too short for PCM int16")
+    return np.frombuffer(trimmed, dtype=np.int16).reshape(-1, 1), client_sr
+
+
+# ── Public entry points ───────────────────────────────────────────────────
+
+@dataclass
+class DecodeResult:
+    waveform: np.ndarray | None
+    fmt: str            # sniffed format
+    decoder: str | None # format whose decoder succeeded, None on failure
+    elapsed_ms: float   # total, including resampling
+    resample_ms: float = 0.0
+    pair: np.ndarray | None = None  # first two channels, (samples, 2), if asked for and stereo
+
+
+def decode_with_info(audio_bytes: bytes, original_sr: int, keep_pair: bool = False) -> DecodeResult:
+    """
+    Decode a payload and report which decoder handled it and how long it
+    took.  With ``keep_pair``, a stereo payload's first two channels are
+    returned too (see split_channels).
+    """
+    started = time.perf_counter()
+    _clock.resample_ms = 0.0
+    fmt = sniff_format(audio_bytes)
+
+    # Fall back to ffmpeg, then headerless PCM, skipping decoders already tried
+    attempts = [fmt] + [f for f in ("m4a", "pcm") if _DECODERS[f] is not _DECODERS[fmt]]
+
+    for attempt in attempts:
+        try:
+            samples, rate = _DECODERS[attempt](audio_bytes, original_sr)
+            waveform, pair = split_channels(samples, rate, keep_pair)
+            return DecodeResult(
+                waveform, fmt, attempt, (time.perf_counter() - started) * 1000, _clock.resample_ms, pair,
+            )
+        except Exception as e:
+            log.debug("%s decode failed for sniffed '%s' payload: %s", attempt, fmt, e)
+
+    log.warning("All decode attempts failed for %d bytes (sniffed '%s')", len(audio_bytes), fmt)
+    return DecodeResult(None, fmt, None, (time.perf_counter() - started) * 1000, _clock.resample_ms)
+
+
+def decode_audio(audio_bytes: bytes, original_sr: int) -> np.ndarray | None:
+    """Decode audio bytes → 16 kHz mono float32 waveform in [-1, 1]."""
+    return decode_with_info(audio_bytes, original_sr).waveform
+
+
+@dataclass
+class _FormatTiming:
+    count: int = 0
+    failures: int = 0
+    total_ms: float = 0.0
+    max_ms: float = 0.0
+
+
+class DecodeTimings:
+    """Per-format decode counts and latency, aggregated in the server process."""
+
+    def __init__(self) -> None:
+        self._by_format: dict[str, _FormatTiming] = {}
+
+    def record(self, result: DecodeResult) -> None:
+        timing = self._by_format.setdefault(result.fmt, _FormatTiming())
+        timing.count += 1
+        timing.failures += result.decoder is None
+        timing.total_ms += result.elapsed_ms
+        timing.max_ms = max(timing.max_ms, result.elapsed_ms)
+
+    def snapshot(self) -> dict:
+        return {
+            fmt: {
+                "count": t.count,
+                "failures": t.failures,
+                "mean_ms": round(t.total_ms / t.count, 2) if t.count else 0.0,
+                "max_ms": round(t.max_ms, 2),
+            }
+            for fmt, t in sorted(self._by_format.items())
+        }
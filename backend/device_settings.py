@@ -0,0 +1,247 @@
+"""
+Shadow-Sound — Device settings
+
+Settings from PUT /api/v1/settings/{device_id} are kept in an SQLite
+database at SETTINGS_DB_PATH, in WAL mode so every uvicorn worker can read
+while one writes.  Each write bumps a store-wide revision; every worker
+polls for rows above the last revision it saw every SETTINGS_REFRESH_S, so
+a change made through any worker reaches open connections everywhere
+without reconnecting.
+
+Connections don't look at the raw settings.  ProfileCache keeps an LRU of
+SETTINGS_CACHE_SIZE compiled DeviceProfiles, which hold what the hot path
+needs:
+
+  * ``threshold_scales`` — one multiplier per classifier category for
+    detect_all() / triage(): the environment profile's scale, or ``inf``
+    for a sound the user switched off, so masked categories never fire,
+  * ``environment_profile`` for the activity gate,
+  * ``chunk_interval_ms`` — with battery saver on, the chunk interval the
+    server asks the phone to record at (a "cadence" message).
+
+A connection compares its profile's revision with the cache's on every
+chunk, which is a dict lookup.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+
+import numpy as np
+
+import config
+
+# Threshold multiplier per environment profile (unknown profiles use 1.0).
+# Quiet places have less masking noise, so weaker scores are more credible.
+PROFILE_THRESHOLD_SCALES: dict[str, float] = {
+    "urban": 1.0,
+    "suburban": 0.95,
+    "indoor": 0.9,
+    "quiet": 0.85,
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS device_settings (
+    device_id TEXT PRIMARY KEY,
+    settings TEXT NOT NULL,
+    revision INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS device_settings_revision ON device_settings (revision);
+"""
+
+
+class SettingsStore:
+    """Settings JSON per device in SQLite (WAL), shared by every worker process."""
+
+    def __init__(self, path: str = config.SETTINGS_DB_PATH) -> None:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.path = path
+        # One connection, used from the event loop and worker threads alike
+        self._db = sqlite3.connect(path, timeout=5.0, isolation_level=None, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock:
+            self._db.execute("PRAGMA journal_mode=WAL")
+            # WAL + NORMAL: commits don't fsync; a power cut may lose the last few
+            self._db.execute("PRAGMA synchronous=NORMAL")
+            self._db.executescript(_SCHEMA)
+
+    def get(self, device_id: str) -> tuple[dict, int] | None:
+        """A device's stored settings and their revision, or None."""
+        with self._lock:
+            row = self._db.execute(
+                "SELECT settings, revision FROM device_settings WHERE device_id = ?", (device_id,),
+            ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def put(self, device_id: str, settings: dict) -> int:
+        """Store a device's settings; returns their new revision."""
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                (revision,) = self._db.execute(
+                    "SELECT COALESCE(MAX(revision), 0) + 1 FROM device_settings",
+                ).fetchone()
+                self._db.execute(
+                    "INSERT INTO device_settings (device_id, settings, revision) VALUES (?, ?, ?) "
+                    "ON CONFLICT (device_id) DO UPDATE SET settings = excluded.settings, revision = excluded.revision",
+                    (device_id, json.dumps(settings), revision),
+                )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return revision
+
+    def changed_since(self, revision: int) -> list[tuple[str, dict, int]]:
+        """(device_id, settings, revision) for every write after ``revision``, oldest first."""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT device_id, settings, revision FROM device_settings WHERE revision > ? ORDER BY revision",
+                (revision,),
+            ).fetchall()
+        return [(device_id, json.loads(settings), rev) for device_id, settings, rev in rows]
+
+    def revision(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COALESCE(MAX(revision), 0) FROM device_settings").fetchone()[0]
+
+    def close(self) -> None:
+        with self._lock:
+            self._db.close()
+
+
+@dataclass(frozen=True)
+class DeviceProfile:
+    """A device's settings, compiled for the chunk path."""
+
+    device_id: str
+    revision: int                      # 0 = defaults, never stored
+    settings: dict
+    environment_profile: str
+    threshold_scales: np.ndarray       # per classifier category; inf = switched off
+    chunk_interval_ms: int | None      # requested chunk interval (battery saver), else None
+
+    def cadence(self) -> dict:
+        """The "cadence" message telling the phone how often to send chunks."""
+        return {
+            "type": "cadence",
+            "battery_saver": self.chunk_interval_ms is not None,
+            "chunk_interval_ms": self.chunk_interval_ms,
+        }
+
+
+def compile_profile(
+    device_id: str,
+    settings: dict,
+    revision: int,
+    categories: list[str],
+    switchable: frozenset[str],
+) -> DeviceProfile:
+    """
+    Compile settings against the classifier's ``categories``.  Only
+    ``switchable`` sounds (those the app lists) can be switched off, so a
+    category the app doesn't know yet, such as a new embedding-head one,
+    stays on.
+    """
+    environment = settings.get("environment_profile") or "urban"
+    disabled = switchable - set(settings.get("enabled_sounds") or ())
+    scale = PROFILE_THRESHOLD_SCALES.get(environment, 1.0)
+    scales = np.array([np.inf if category in disabled else scale for category in categories], dtype=np.float32)
+    return DeviceProfile(
+        device_id=device_id,
+        revision=revision,
+        settings=settings,
+        environment_profile=environment,
+        threshold_scales=scales,
+        chunk_interval_ms=config.BATTERY_SAVER_CHUNK_MS if settings.get("battery_saver") else None,
+    )
+
+
+class ProfileCache:
+    """
+    LRU of compiled profiles in front of a SettingsStore.
+
+    ``defaults`` fill in settings a device never stored, and their
+    ``enabled_sounds`` are the sounds that can be switched off;
+    ``categories`` is the classifier's category order (empty in mock mode).
+    """
+
+    def __init__(
+        self,
+        store: SettingsStore,
+        defaults: dict,
+        categories: list[str],
+        capacity: int = config.SETTINGS_CACHE_SIZE,
+    ) -> None:
+        self.store = store
+        self.defaults = defaults
+        self.categories = categories
+        self._switchable = frozenset(defaults.get("enabled_sounds", ()))
+        self.capacity = capacity
+        self._profiles: OrderedDict[str, DeviceProfile] = OrderedDict()
+        self._lock = threading.Lock()
+        self._revision = store.revision()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, device_id: str) -> DeviceProfile:
+        """A device's profile, read from the store on a miss (blocking; call off the loop)."""
+        profile = self.current(device_id)
+        if profile is not None:
+            return profile
+        self.misses += 1
+        stored = self.store.get(device_id)
+        settings, revision = stored if stored else ({}, 0)
+        return self._insert(device_id, settings, revision)
+
+    def current(self, device_id: str) -> DeviceProfile | None:
+        """The cached profile, or None if it isn't cached (never touches the store)."""
+        with self._lock:
+            profile = self._profiles.get(device_id)
+            if profile is not None:
+                self._profiles.move_to_end(device_id)
+                self.hits += 1
+            return profile
+
+    def update(self, device_id: str, settings: dict) -> DeviceProfile:
+        """Persist new settings and swap in their compiled profile (blocking)."""
+        return self._insert(device_id, settings, self.store.put(device_id, settings))
+
+    def refresh(self) -> int:
+        """Pick up writes made through other workers; returns how many cached profiles changed."""
+        changed = 0
+        for device_id, settings, revision in self.store.changed_since(self._revision):
+            self._revision = max(self._revision, revision)
+            with self._lock:
+                cached = self._profiles.get(device_id)
+            if cached is not None and cached.revision < revision:
+                self._insert(device_id, settings, revision, touch=False)
+                changed += 1
+        return changed
+
+    def stats(self) -> dict:
+        return {
+            "cached": len(self._profiles),
+            "capacity": self.capacity,
+            "hits": self.hits,
+            "misses": self.misses,
+            "revision": self._revision,
+        }
+
+    def _insert(self, device_id: str, settings: dict, revision: int, touch: bool = True) -> DeviceProfile:
+        profile = compile_profile(
+            device_id, {**self.defaults, **settings}, revision, self.categories, self._switchable,
+        )
+        with self._lock:
+            current = self._profiles.get(device_id)
+            if current is not None and current.revision > revision:
+                return current          # a newer write got here first
+            self._profiles[device_id] = profile
+            if touch:
+                self._profiles.move_to_end(device_id)
+            while len(self._profiles) > self.capacity:
+                self._profiles.popitem(last=False)
+        return profile
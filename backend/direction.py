@@ -0,0 +1,140 @@
+"""
+Shadow-Sound — Direction of arrival
+
+Phones with two microphones can send stereo chunks.  The decoders keep the
+first two channels next to the mono mix YAMNet scores (a "pair"), and the
+delay between them says which side a sound came from.  It is estimated
+with GCC-PHAT, framed exactly like YAMNet (0.975 s windows, 0.48 s hop):
+
+  * every frame of both channels is windowed and transformed in one
+    batched rfft,
+  * the cross-spectrum is whitened (PHAT), so every frequency votes
+    equally on the delay whatever its loudness, and transformed back;
+    only the lags a sound can produce across DOA_MIC_SPACING_M are kept,
+  * for each detection, the frames where its category is active are
+    averaged, weighted by their scores, and the highest lag (refined by
+    parabolic interpolation) gives the bearing.
+
+gcc_phat() runs in the decode pool while YAMNet scores the same frames,
+so only annotate(), a small weighted average per detection, follows
+inference.
+
+Channel 0 is taken as the left microphone and channel 1 as the right.
+Two microphones can't tell front from back, so bearings are reported in
+the front half-plane: 0° straight ahead, 90° right, 270° left.  The
+averaged correlation's peak (1 for a single clean source, near 0 for
+diffuse noise) is reported as ``direction_confidence``; below
+DOA_MIN_CONFIDENCE no direction is reported.
+"""
+
+from functools import lru_cache
+
+import numpy as np
+
+import config
+from decoding import PATCH_HOP_SAMPLES, PATCH_SAMPLES, TARGET_SR, num_frames
+
+SPEED_OF_SOUND_M_S = 343.0
+FFT_SIZE = 16384            # ≥ one frame; the lags kept are tiny, so circular wrap-around is harmless
+MIN_FREQUENCY_HZ = 100.0    # handling noise and wind live below this
+ACTIVE_RATIO = 0.5          # a category is active in frames scoring ≥ this × its best frame
+
+SECTORS = ["N", "NE", "E", "SE", "S", "SW", "W", "NW"]
+
+
+def max_lag(spacing_m: float = config.DOA_MIC_SPACING_M) -> int:
+    """Largest delay, in samples, a sound can have across the microphones."""
+    return int(np.ceil(spacing_m / SPEED_OF_SOUND_M_S * TARGET_SR))
+
+
+@lru_cache(maxsize=1)
+def _window() -> np.ndarray:
+    return np.hanning(PATCH_SAMPLES).astype(np.float32)
+
+
+def frame_pair(pair: np.ndarray, frames: int) -> np.ndarray:
+    """``(frames, 2, PATCH_SAMPLES)`` YAMNet-aligned frames of a (samples, 2) pair, zero-padded."""
+    needed = PATCH_SAMPLES + (frames - 1) * PATCH_HOP_SAMPLES
+    if len(pair) < needed:
+        pair = np.concatenate([pair, np.zeros((needed - len(pair), 2), dtype=pair.dtype)])
+    windows = np.lib.stride_tricks.sliding_window_view(pair, PATCH_SAMPLES, axis=0)
+    return windows[::PATCH_HOP_SAMPLES][:frames]
+
+
+def gcc_phat(pair: np.ndarray, spacing_m: float = config.DOA_MIC_SPACING_M) -> np.ndarray:
+    """
+    Whitened cross-correlation of the two channels in each YAMNet frame.
+
+    Returns a ``(frames, 2 * max_lag + 1)`` float32 array for lags
+    ``-max_lag … max_lag``; a positive lag means the sound reached the
+    right microphone first.  Rows are scaled so a single clean source
+    peaks at 1, and silent frames are all zero.
+    """
+    frames = frame_pair(pair, num_frames(len(pair))) * _window()
+    spectra = np.fft.rfft(frames, n=FFT_SIZE, axis=-1)
+    cross = spectra[:, 0] * np.conj(spectra[:, 1])
+    cross[:, :int(MIN_FREQUENCY_HZ * FFT_SIZE / TARGET_SR)] = 0
+
+    magnitude = np.abs(cross)
+    used = magnitude > 1e-12
+    cross = np.divide(cross, magnitude, out=np.zeros_like(cross), where=used)
+    correlation = np.fft.irfft(cross, n=FFT_SIZE, axis=-1)
+    # A unit-magnitude spectrum over every bin gives a peak of 1
+    correlation /= np.maximum(2 * used.sum(axis=1, keepdims=True) / FFT_SIZE, 1e-12)
+
+    lag = max_lag(spacing_m)
+    return np.concatenate([correlation[:, -lag:], correlation[:, :lag + 1]], axis=1).astype(np.float32)
+
+
+def bearing(correlation: np.ndarray, spacing_m: float = config.DOA_MIC_SPACING_M) -> tuple[float, float]:
+    """(bearing in degrees, peak height) of one ``gcc_phat()`` row."""
+    lag = (len(correlation) - 1) // 2
+    peak = int(np.argmax(correlation))
+    offset = 0.0
+    if 0 < peak < len(correlation) - 1:
+        before, top, after = correlation[peak - 1:peak + 2]
+        curvature = before - 2 * top + after
+        if curvature < 0:
+            offset = 0.5 * (before - after) / curvature
+    delay_s = (peak - lag + offset) / TARGET_SR
+    sine = np.clip(delay_s * SPEED_OF_SOUND_M_S / spacing_m, -1.0, 1.0)
+    return float(np.degrees(np.arcsin(sine)) % 360), float(correlation[peak])
+
+
+def annotate(
+    detections: list[dict],
+    correlations: np.ndarray,
+    categories: list[str],
+    category_frames: np.ndarray | None = None,
+    spacing_m: float = config.DOA_MIC_SPACING_M,
+    min_confidence: float = config.DOA_MIN_CONFIDENCE,
+) -> None:
+    """
+    Add ``direction_degrees``, ``direction_label`` and
+    ``direction_confidence`` to detections, in place.
+
+    ``category_frames`` are the ``(frames, categories)`` scores of the same
+    frames (classifier.frame_category_scores); without them (the student
+    model answered) every frame counts equally.
+    """
+    frames = len(correlations) if category_frames is None else min(len(correlations), len(category_frames))
+    if not frames:
+        return
+    columns = {category: i for i, category in enumerate(categories)}
+    for detection in detections:
+        if category_frames is None:
+            weights = np.ones(frames, dtype=np.float32)
+        else:
+            column = columns.get(detection["sound_type"])
+            if column is None:
+                continue
+            scores = category_frames[:frames, column]
+            weights = np.where(scores >= ACTIVE_RATIO * scores.max(), scores, 0.0)
+        if weights.sum() <= 0:
+            continue
+        degrees, confidence = bearing(weights @ correlations[:frames] / weights.sum(), spacing_m)
+        if confidence < min_confidence:
+            continue
+        detection["direction_degrees"] = round(degrees) % 360
+        detection["direction_label"] = SECTORS[int((degrees + 22.5) % 360 // 45)]
+        detection["direction_confidence"] = round(min(confidence, 1.0), 3)
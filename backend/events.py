@@ -0,0 +1,150 @@
+"""
+Shadow-Sound — Sound events
+
+Per-chunk detections repeat for as long as a sound lasts: a 30 s siren is
+twenty identical "detection" messages and twenty buzzes.  Clients that
+authenticate with ``"events": true`` get sound events instead, tracked per
+category with hysteresis:
+
+  * ``event_start`` as soon as a category reaches its usual threshold, so
+    the first alert is no later than a plain detection would be,
+  * ``event_update`` at most every EVENT_UPDATE_INTERVAL_S while it lasts
+    (0 turns updates off),
+  * ``event_end`` once its confidence has stayed below EVENT_OFFSET_RATIO ×
+    threshold for EVENT_RELEASE_S, and never before it has lasted
+    EVENT_MIN_DURATION_S.
+
+Every message of one event carries the same ``event_id``.  A category that
+comes back within EVENT_COOLDOWN_S of its end reopens the previous event
+with an ``event_update`` (the old id and ``"resumed": true``) rather than
+alerting as something new: ``event_start`` only ever means a new sound.
+"""
+
+import time
+import uuid
+from dataclasses import dataclass
+
+import config
+import metrics
+from classifier import category_threshold
+
+
+@dataclass
+class _Event:
+    event_id: str
+    detection: dict                  # latest detection of the category
+    started_at: float
+    last_seen: float
+    peak_confidence: float
+    last_update: float
+    ended_at: float | None = None
+    resumed: int = 0
+
+    def summary(self, now: float) -> dict:
+        return {
+            "event_id": self.event_id,
+            "sound_type": self.detection["sound_type"],
+            "duration_s": round(now - self.started_at, 2),
+            "peak_confidence": round(self.peak_confidence, 3),
+        }
+
+
+class EventTracker:
+    """Turns a connection's per-chunk detections into start/update/end events."""
+
+    def __init__(self) -> None:
+        # detect_all() scale that also reports categories down to the offset threshold
+        self.threshold_scale = config.EVENT_OFFSET_RATIO
+        # Per-category threshold multipliers from the device's settings profile
+        self.category_scales: dict[str, float] = {}
+        self.release_s = config.EVENT_RELEASE_S
+        self.min_duration_s = config.EVENT_MIN_DURATION_S
+        self.cooldown_s = config.EVENT_COOLDOWN_S
+        self.update_interval_s = config.EVENT_UPDATE_INTERVAL_S
+
+        self.active: dict[str, _Event] = {}    # open events by category
+        self._ended: dict[str, _Event] = {}    # ended within the cooldown, by category
+
+    def update(self, detections: list[dict], now: float | None = None) -> list[dict]:
+        """
+        Feed one chunk's detections (found at ``threshold_scale``) and
+        return the event messages it causes, starts first.
+        """
+        now = time.monotonic() if now is None else now
+        messages: list[dict] = []
+
+        seen = set()
+        for detection in detections:
+            category = detection["sound_type"]
+            threshold = category_threshold(category) * self.category_scales.get(category, 1.0)
+            if detection["confidence"] < threshold * self.threshold_scale:
+                continue
+            seen.add(category)
+            event = self.active.get(category)
+            if event is None:
+                if detection["confidence"] >= threshold:
+                    messages.append(self._start(detection, now))
+                continue
+            event.detection = detection
+            event.last_seen = now
+            event.peak_confidence = max(event.peak_confidence, detection["confidence"])
+            if self.update_interval_s > 0 and now - event.last_update >= self.update_interval_s:
+                event.last_update = now
+                metrics.EVENTS.labels(category, "update").inc()
+                messages.append({
+                    "type": "event_update",
+                    **event.summary(now),
+                    "confidence": detection["confidence"],
+                })
+
+        for category, event in list(self.active.items()):
+            if category in seen:
+                continue
+            if now - event.last_seen >= self.release_s and now - event.started_at >= self.min_duration_s:
+                messages.append(self._end(event, now))
+
+        for category, event in list(self._ended.items()):
+            if now - event.ended_at > self.cooldown_s:
+                del self._ended[category]
+        return messages
+
+    # ── internals ──────────────────────────────────────────────────────
+
+    def _start(self, detection: dict, now: float) -> dict:
+        category = detection["sound_type"]
+        event = self._ended.pop(category, None)
+        if event is not None:
+            # Back within the cooldown: the same event goes on, without a new alert
+            event.resumed += 1
+            event.ended_at = None
+            event.detection = detection
+            event.last_seen = event.last_update = now
+            event.peak_confidence = max(event.peak_confidence, detection["confidence"])
+            self.active[category] = event
+            metrics.EVENTS.labels(category, "resume").inc()
+            return {
+                "type": "event_update",
+                **event.summary(now),
+                "confidence": detection["confidence"],
+                "resumed": True,
+            }
+        event = _Event(
+            event_id=uuid.uuid4().hex[:12],
+            detection=detection,
+            started_at=now,
+            last_seen=now,
+            peak_confidence=detection["confidence"],
+            last_update=now,
+        )
+        self.active[category] = event
+        metrics.EVENTS.labels(category, "start").inc()
+        return {"type": "event_start", "event_id": event.event_id, **detection}
+
+    def _end(self, event: _Event, now: float) -> dict:
+        category = event.detection["sound_type"]
+        del self.active[category]
+        event.ended_at = now
+        self._ended[category] = event
+        metrics.EVENTS.labels(category, "end").inc()
+        # The sound was last heard at last_seen; the release wait isn't part of it
+        return {"type": "event_end", **event.summary(event.last_seen)}
@@ -0,0 +1,262 @@
+"""
+Shadow-Sound — YAMNet export, quantization and backend comparison
+
+Usage
+-----
+1. Export TFLite / ONNX variants of the pinned SavedModel:
+
+    python export_model.py export [--corpus data/] [--out model/exported]
+
+   Produces yamnet_{float32,float16,int8}.tflite and, when tf2onnx is
+   installed, yamnet_{float32,float16,int8}.onnx, plus the class map and a
+   SHA256SUMS file the backends verify at load time.  With --corpus, int8
+   TFLite uses clips from the corpus as its calibration set (full-integer
+   quantization of everything except the FFT front end); without one it
+   falls back to dynamic-range int8 weights.
+
+2. Compare every available backend against the TensorFlow reference:
+
+    python export_model.py report --corpus data/ [--json report.json]
+
+   Reports load time, resident memory growth, per-clip latency and top-1
+   agreement (YAMNet class and app category) with the reference model.
+
+3. Serve with INFERENCE_BACKEND=tflite|onnx and INFERENCE_MODEL_VARIANT.
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import config
+import model_store
+from backends import CLASS_MAP_FILE, OnnxBackend, TensorFlowBackend, TFLiteBackend
+from classifier import SoundClassifier, _bucket_samples
+from decoding import AUDIO_EXTENSIONS, TARGET_SR, decode_audio
+
+VARIANTS = ("float32", "float16", "int8")
+
+CALIBRATION_CLIPS = 100
+
+
+# ── Corpus ────────────────────────────────────────────────────────────────
+
+def load_corpus(corpus_dir: str, max_seconds: float) -> list[tuple[str, np.ndarray]]:
+    """Decode every audio file under corpus_dir (trimmed to max_seconds)."""
+    clips = []
+    max_samples = int(max_seconds * TARGET_SR)
+    for root, _dirs, files in os.walk(corpus_dir):
+        for name in sorted(files):
+            if not name.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                waveform = decode_audio(f.read(), TARGET_SR)
+            if waveform is not None and len(waveform):
+                clips.append((os.path.relpath(path, corpus_dir), waveform[:max_samples]))
+    return clips
+
+
+# ── Export ────────────────────────────────────────────────────────────────
+
+def export(out_dir: str, corpus_dir: str | None = None) -> list[str]:
+    import tensorflow as tf
+
+    model = model_store.load_yamnet().model
+    os.makedirs(out_dir, exist_ok=True)
+
+    @tf.function(input_signature=[tf.TensorSpec([None], tf.float32, name="waveform")])
+    def serve(waveform):
+        scores, embeddings, _spectrogram = model(waveform)
+        return {"scores": scores, "embeddings": embeddings}
+
+    concrete = serve.get_concrete_function()
+    class_map_path = model.class_map_path().numpy().decode("utf-8")
+    tf.io.gfile.copy(class_map_path, os.path.join(out_dir, CLASS_MAP_FILE), overwrite=True)
+
+    calibration: list[np.ndarray] = []
+    if corpus_dir:
+        length = _bucket_samples(4)
+        for _name, waveform in load_corpus(corpus_dir, max_seconds=10.0)[:CALIBRATION_CLIPS]:
+            clip = np.zeros(length, dtype=np.float32)
+            clip[:min(length, len(waveform))] = waveform[:length]
+            calibration.append(clip)
+
+    written = []
+    for variant in VARIANTS:
+        converter = tf.lite.TFLiteConverter.from_concrete_functions([concrete], model)
+        if variant == "float16":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            converter.target_spec.supported_types = [tf.float16]
+        elif variant == "int8":
+            converter.optimizations = [tf.lite.Optimize.DEFAULT]
+            if calibration:
+                converter.representative_dataset = lambda: ([clip] for clip in calibration)
+        path = os.path.join(out_dir, f"yamnet_{variant}.tflite")
+        with open(path, "wb") as f:
+            f.write(converter.convert())
+        written.append(path)
+        print(f"  ✓ {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+
+    written += _export_onnx(serve, out_dir)
+    model_store.record_exported(written)
+    return written
+
+
+def _export_onnx(serve, out_dir: str) -> list[str]:
+    try:
+        import onnx
+        import tf2onnx
+        from onnxconverter_common import float16
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+    except ImportError as exc:
+        print(f"  ⚠  Skipping ONNX export ({exc}) — pip install tf2onnx onnxconverter-common onnxruntime")
+        return []
+
+    import tensorflow as tf
+
+    paths = {variant: os.path.join(out_dir, f"yamnet_{variant}.onnx") for variant in VARIANTS}
+    tf2onnx.convert.from_function(
+        serve,
+        input_signature=[tf.TensorSpec([None], tf.float32, name="waveform")],
+        opset=17,
+        output_path=paths["float32"],
+    )
+    onnx.save(
+        float16.convert_float_to_float16(onnx.load(paths["float32"]), keep_io_types=True),
+        paths["float16"],
+    )
+    quantize_dynamic(paths["float32"], paths["int8"], weight_type=QuantType.QInt8)
+
+    for path in paths.values():
+        print(f"  ✓ {path} ({os.path.getsize(path) / 1e6:.1f} MB)")
+    return list(paths.values())
+
+
+# ── Report ────────────────────────────────────────────────────────────────
+
+def _rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _load(bucket_lengths: list[int], name: str, variant: str | None):
+    if name == "tensorflow":
+        return TensorFlowBackend(bucket_lengths)
+    backend_cls = TFLiteBackend if name == "tflite" else OnnxBackend
+    return backend_cls(bucket_lengths, variant)
+
+
+def _evaluate(classifier: SoundClassifier, clips: list[tuple[str, np.ndarray]]) -> tuple[list[float], list[np.ndarray]]:
+    latencies, scores = [], []
+    for _name, waveform in clips:
+        started = time.perf_counter()
+        frame_scores = classifier.score_waveforms([waveform])[0]
+        latencies.append((time.perf_counter() - started) * 1000)
+        scores.append(frame_scores)
+    return latencies, scores
+
+
+def report(corpus_dir: str, max_seconds: float) -> dict:
+    clips = load_corpus(corpus_dir, max_seconds)
+    if not clips:
+        raise SystemExit(f"No audio files found under {corpus_dir}")
+    audio_seconds = sum(len(w) for _n, w in clips) / TARGET_SR
+    print(f"Corpus: {len(clips)} clips, {audio_seconds:.0f} s of audio")
+
+    bucket_lengths = sorted({_bucket_samples(f) for f in config.INFERENCE_FRAME_BUCKETS})
+    candidates = [("tensorflow", None)] + [
+        (name, variant) for name in ("tflite", "onnx") for variant in VARIANTS
+    ]
+
+    results = []
+    reference = None
+    for name, variant in candidates:
+        label = name if variant is None else f"{name}/{variant}"
+        rss_before = _rss_mb()
+        try:
+            started = time.perf_counter()
+            backend = _load(bucket_lengths, name, variant)
+            load_ms = (time.perf_counter() - started) * 1000
+        except (ImportError, FileNotFoundError, model_store.ModelArtifactError) as exc:
+            print(f"  ⚠  {label}: unavailable ({exc})")
+            continue
+
+        classifier = SoundClassifier(backend)
+        classifier.warm_up()
+        latencies, scores = _evaluate(classifier, clips)
+        mean_scores = [s.mean(axis=0) for s in scores]
+        top1 = [int(np.argmax(m)) for m in mean_scores]
+        categories = [(classifier.detect(s) or {}).get("sound_type") for s in scores]
+
+        if reference is None:
+            reference = {"top1": top1, "categories": categories, "mean_scores": mean_scores}
+
+        entry = {
+            "backend": label,
+            "load_ms": round(load_ms, 1),
+            "rss_growth_mb": round(_rss_mb() - rss_before, 1),
+            "latency_ms_mean": round(float(np.mean(latencies)), 2),
+            "latency_ms_p95": round(float(np.percentile(latencies, 95)), 2),
+            "realtime_factor": round(audio_seconds * 1000 / sum(latencies), 1),
+            "top1_agreement": round(float(np.mean(np.array(top1) == np.array(reference["top1"]))), 4),
+            "category_agreement": round(
+                float(np.mean([a == b for a, b in zip(categories, reference["categories"])])), 4,
+            ),
+            "max_abs_score_diff": round(float(max(
+                np.abs(m - r).max() for m, r in zip(mean_scores, reference["mean_scores"])
+            )), 4),
+        }
+        if variant is not None:
+            entry["model_mb"] = round(os.path.getsize(backend.artifact.location) / 1e6, 2)
+        results.append(entry)
+        del classifier, backend
+
+    print()
+    print(f"{'backend':<18}{'load ms':>9}{'+RSS MB':>9}{'mean ms':>9}{'p95 ms':>9}{'xRT':>7}{'top-1':>8}{'category':>10}")
+    for r in results:
+        print(
+            f"{r['backend']:<18}{r['load_ms']:>9.0f}{r['rss_growth_mb']:>9.0f}{r['latency_ms_mean']:>9.1f}"
+            f"{r['latency_ms_p95']:>9.1f}{r['realtime_factor']:>7.0f}{r['top1_agreement']:>8.1%}{r['category_agreement']:>10.1%}"
+        )
+    print("\n(+RSS is measured in one process, so later rows exclude libraries already loaded.)")
+    return {"clips": len(clips), "audio_seconds": round(audio_seconds, 1), "results": results}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Export, quantize and compare YAMNet backends.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export_cmd = sub.add_parser("export", help="write TFLite/ONNX float32, float16 and int8 models")
+    export_cmd.add_argument("--out", default=config.EXPORT_DIR)
+    export_cmd.add_argument("--corpus", help="audio directory used to calibrate int8")
+
+    report_cmd = sub.add_parser("report", help="compare backends against TensorFlow on a corpus")
+    report_cmd.add_argument("--corpus", required=True)
+    report_cmd.add_argument("--max-seconds", type=float, default=10.0, help="trim each clip to this length")
+    report_cmd.add_argument("--json", help="also write the report to this file")
+
+    args = parser.parse_args(argv)
+
+    if args.command == "export":
+        print(f"Exporting YAMNet → {args.out}")
+        export(args.out, args.corpus)
+        return 0
+
+    result = report(args.corpus, args.max_seconds)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Report saved → {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,320 @@
+"""
+Shadow-Sound — Detection fan-out
+
+Detections go back to the socket that sent the audio.  Family members and
+support workers can also follow a user's alerts from another phone or a
+dashboard by opening /ws/subscribe/{device_id}.
+
+Each uvicorn worker runs one FanoutHub.  publish() serialises a message
+once.  The same string goes into the queue of every local subscriber of
+that device, and one datagram carries it to each other worker that has a
+subscriber for the device.  Workers find each other through Unix datagram
+sockets in FANOUT_SOCKET_DIR, one per worker, named by pid.  A subscriber
+therefore sees a device whichever workers serve the two, without a broker.
+
+Each hub tells the others which devices it has subscribers for: at once
+when a device gains its first or loses its last subscriber, and every
+PEER_REFRESH_S for all of them.  Interest that is not refreshed within
+INTEREST_TTL_S (a worker that died) lapses.  A message for a device that
+nobody follows is dropped where it is published.
+
+Publishing never waits:
+
+  * each subscriber has a queue of FANOUT_QUEUE_SIZE messages; one that
+    falls that far behind is ended with ``dropped`` set (the endpoint
+    closes it, and it may reconnect) instead of slowing down the device's
+    connection,
+  * a worker whose socket buffer is full misses the message.
+"""
+
+import asyncio
+import json
+import os
+import socket
+import struct
+
+import config
+import metrics
+from log import get_logger
+
+log = get_logger("fanout")
+
+# Datagram: u8 kind, then
+#   MESSAGE:      u16 device_id length, device_id, JSON message
+#   SUBSCRIBED:   device_ids, newline-separated (the sender follows them)
+#   UNSUBSCRIBED: device_ids, newline-separated (the sender no longer does)
+KIND = struct.Struct("<B")
+DEVICE = struct.Struct("<H")
+MESSAGE, SUBSCRIBED, UNSUBSCRIBED = 0, 1, 2
+MAX_DATAGRAM_BYTES = 64 * 1024
+PEER_REFRESH_S = 1.0     # how often workers are rescanned and interest re-announced
+INTEREST_TTL_S = 3 * PEER_REFRESH_S
+
+
+class Subscription:
+    """One subscriber's bounded queue of serialised messages."""
+
+    def __init__(self, device_id: str, size: int) -> None:
+        self.device_id = device_id
+        self.queue: asyncio.Queue[str | None] = asyncio.Queue(size)
+        self.dropped = False
+
+    async def get(self) -> str | None:
+        """Next message, or None once the subscription has ended."""
+        return await self.queue.get()
+
+    def offer(self, data: str) -> bool:
+        try:
+            self.queue.put_nowait(data)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    def end(self, dropped: bool = False) -> None:
+        """Discard pending messages and wake get() with None."""
+        self.dropped = self.dropped or dropped
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class FanoutHub:
+    """Per-worker pub/sub of live messages by device_id, bridged to the other workers."""
+
+    def __init__(
+        self,
+        socket_dir: str = config.FANOUT_SOCKET_DIR,
+        queue_size: int = config.FANOUT_QUEUE_SIZE,
+    ) -> None:
+        self.socket_dir = socket_dir
+        self.queue_size = queue_size
+        self.path: str | None = None
+        self._subscriptions: dict[str, set[Subscription]] = {}
+        self._sock: socket.socket | None = None
+        self._peers: list[str] = []
+        self._scanned = float("-inf")
+        # peer socket → device_id → when the peer last said it follows it
+        self._interest: dict[str, dict[str, float]] = {}
+        self._announcer: asyncio.Task | None = None
+        self.published = 0
+        self.received = 0
+        self.dropped_subscribers = 0
+        self.peer_failures = 0
+
+    async def start(self) -> None:
+        """Bind this worker's socket; on failure the hub only serves local subscribers."""
+        path = os.path.join(self.socket_dir, f"fanout-{os.getpid()}.sock")
+        try:
+            os.makedirs(self.socket_dir, exist_ok=True)
+            if os.path.exists(path):
+                os.unlink(path)
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            sock.setblocking(False)
+            sock.bind(path)
+        except OSError as exc:
+            log.warning("Fan-out limited to this worker (cannot bind %s: %s)", path, exc)
+            return
+        self._sock, self.path = sock, path
+        asyncio.get_running_loop().add_reader(sock.fileno(), self._receive)
+        self._announcer = asyncio.create_task(self._announce())
+
+    def close(self) -> None:
+        for subscriptions in self._subscriptions.values():
+            for subscription in subscriptions:
+                subscription.end()
+        self._subscriptions.clear()
+        metrics.FANOUT_SUBSCRIBERS.set(0)
+        sock, self._sock = self._sock, None
+        if sock is None:
+            return
+        self._announcer.cancel()
+        asyncio.get_running_loop().remove_reader(sock.fileno())
+        sock.close()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    def subscribe(self, device_id: str) -> Subscription:
+        subscription = Subscription(device_id, self.queue_size)
+        if device_id not in self._subscriptions:
+            self._subscriptions[device_id] = set()
+            self._control(SUBSCRIBED, [device_id], self._current_peers())
+        self._subscriptions[device_id].add(subscription)
+        metrics.FANOUT_SUBSCRIBERS.inc()
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription) -> None:
+        subscriptions = self._subscriptions.get(subscription.device_id)
+        if subscriptions is None or subscription not in subscriptions:
+            return
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.device_id]
+            self._control(UNSUBSCRIBED, [subscription.device_id], self._current_peers())
+        metrics.FANOUT_SUBSCRIBERS.dec()
+
+    def publish(self, device_id: str, message: dict) -> None:
+        """Send ``message``, tagged with ``device_id``, to the device's subscribers in every worker."""
+        peers = self._interested_peers(device_id)
+        if not peers and device_id not in self._subscriptions:
+            return
+        data = json.dumps({**message, "device_id": device_id}, separators=(",", ":"))
+        self.published += 1
+        self._deliver(device_id, data)
+        if peers:
+            key = device_id.encode()
+            self._forward(KIND.pack(MESSAGE) + DEVICE.pack(len(key)) + key + data.encode(), peers)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": sum(len(subscriptions) for subscriptions in self._subscriptions.values()),
+            "devices": len(self._subscriptions),
+            "peers": len(self._peers),
+            "remote_subscriptions": sum(len(devices) for devices in self._interest.values()),
+            "published": self.published,
+            "received": self.received,
+            "dropped_subscribers": self.dropped_subscribers,
+            "peer_failures": self.peer_failures,
+        }
+
+    # ── internals ──────────────────────────────────────────────────────
+
+    def _deliver(self, device_id: str, data: str) -> None:
+        subscriptions = self._subscriptions.get(device_id)
+        if not subscriptions:
+            return
+        delivered = 0
+        for subscription in list(subscriptions):
+            if subscription.offer(data):
+                delivered += 1
+                continue
+            self.unsubscribe(subscription)
+            subscription.end(dropped=True)
+            self.dropped_subscribers += 1
+            metrics.FANOUT_MESSAGES.labels("subscriber_dropped").inc()
+            log.info("Dropped a slow subscriber of device %s", device_id)
+        metrics.FANOUT_MESSAGES.labels("delivered").inc(delivered)
+
+    def _current_peers(self) -> list[str]:
+        if self._sock is None:
+            return []
+        now = asyncio.get_running_loop().time()
+        if now - self._scanned >= PEER_REFRESH_S:
+            self._scanned = now
+            try:
+                names = os.listdir(self.socket_dir)
+            except OSError:
+                names = []
+            self._peers = [
+                os.path.join(self.socket_dir, name) for name in names
+                if name.startswith("fanout-") and name.endswith(".sock")
+                and os.path.join(self.socket_dir, name) != self.path
+            ]
+        return self._peers
+
+    def _interested_peers(self, device_id: str) -> list[str]:
+        """Workers that have recently said they have subscribers for ``device_id``."""
+        if not self._interest:
+            return []
+        expired = asyncio.get_running_loop().time() - INTEREST_TTL_S
+        return [
+            peer for peer, devices in self._interest.items()
+            if devices.get(device_id, expired) > expired
+        ]
+
+    async def _announce(self) -> None:
+        """Every PEER_REFRESH_S, re-announce this worker's devices and forget lapsed interest."""
+        while True:
+            await asyncio.sleep(PEER_REFRESH_S)
+            peers = self._current_peers()
+            if self._subscriptions:
+                self._control(SUBSCRIBED, list(self._subscriptions), peers)
+            expired = asyncio.get_running_loop().time() - INTEREST_TTL_S
+            for peer in list(self._interest):
+                devices = self._interest[peer]
+                for device_id in [d for d, seen in devices.items() if seen <= expired]:
+                    del devices[device_id]
+                if not devices:
+                    del self._interest[peer]
+
+    def _control(self, kind: int, device_ids: list[str], peers: list[str]) -> None:
+        """Tell ``peers`` about ``device_ids``, in as many datagrams as it takes."""
+        if not peers:
+            return
+        batch, size = [], KIND.size
+        for device_id in device_ids:
+            key = device_id.encode()
+            if batch and size + len(key) + 1 > MAX_DATAGRAM_BYTES:
+                self._send(KIND.pack(kind) + b"\n".join(batch), peers, "control")
+                batch, size = [], KIND.size
+            batch.append(key)
+            size += len(key) + 1
+        if batch:
+            self._send(KIND.pack(kind) + b"\n".join(batch), peers, "control")
+
+    def _forward(self, datagram: bytes, peers: list[str]) -> None:
+        if len(datagram) > MAX_DATAGRAM_BYTES:
+            self.peer_failures += len(peers)
+            metrics.FANOUT_MESSAGES.labels("peer_failed").inc(len(peers))
+            log.warning("Fan-out message of %d bytes is too large for other workers", len(datagram))
+            return
+        self._send(datagram, peers, "forwarded")
+
+    def _send(self, datagram: bytes, peers: list[str], outcome: str) -> None:
+        for peer in list(peers):
+            try:
+                self._sock.sendto(datagram, peer)
+                metrics.FANOUT_MESSAGES.labels(outcome).inc()
+            except (ConnectionRefusedError, FileNotFoundError):
+                # A worker that exited without removing its socket
+                if peer in self._peers:
+                    self._peers.remove(peer)
+                self._interest.pop(peer, None)
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+            except OSError as exc:
+                # Buffer full (the peer isn't reading) or message too large
+                self.peer_failures += 1
+                metrics.FANOUT_MESSAGES.labels("peer_failed").inc()
+                log.debug("Fan-out to %s failed: %s", peer, exc)
+
+    def _receive(self) -> None:
+        while True:
+            try:
+                datagram, sender = self._sock.recvfrom(MAX_DATAGRAM_BYTES)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as exc:
+                log.warning("Fan-out receive failed: %s", exc)
+                return
+            if len(datagram) < KIND.size:
+                continue
+            (kind,) = KIND.unpack_from(datagram)
+            if kind == MESSAGE and len(datagram) >= KIND.size + DEVICE.size:
+                start = KIND.size + DEVICE.size
+                (length,) = DEVICE.unpack_from(datagram, KIND.size)
+                device_id = datagram[start:start + length].decode(errors="replace")
+                self.received += 1
+                if device_id in self._subscriptions:
+                    self._deliver(device_id, datagram[start + length:].decode())
+            elif kind in (SUBSCRIBED, UNSUBSCRIBED) and sender:
+                device_ids = datagram[KIND.size:].decode(errors="replace").split("\n")
+                self._note_interest(sender, kind == SUBSCRIBED, device_ids)
+
+    def _note_interest(self, peer: str, subscribed: bool, device_ids: list[str]) -> None:
+        if subscribed:
+            now = asyncio.get_running_loop().time()
+            devices = self._interest.setdefault(peer, {})
+            for device_id in device_ids:
+                devices[device_id] = now
+            return
+        devices = self._interest.get(peer)
+        if devices is None:
+            return
+        for device_id in device_ids:
+            devices.pop(device_id, None)
+        if not devices:
+            del self._interest[peer]
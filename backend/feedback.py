@@ -0,0 +1,479 @@
+"""
+Shadow-Sound — Feedback capture
+
+Every detection sent on /ws/audio carries a ``detection_id``.  The
+connection keeps the audio and category scores behind its recent
+detections (FEEDBACK_BUFFER_S of clips, as int16) in a RecentDetections
+buffer, so when the user says an alert was right or wrong — a "feedback"
+message on the socket, or POST /api/v1/feedback — the labelled clip can be
+kept for retraining.
+
+A detection_id starts with the pid of the uvicorn worker that issued it.
+POST /api/v1/feedback may land on any worker, so a FeedbackRelay hands it
+to the issuing worker over that worker's Unix socket in
+FEEDBACK_SOCKET_DIR (framed as in ipc.py) and returns its answer.
+
+Clips go to an append-only segment log under FEEDBACK_LOG_DIR, one
+directory per category list (scores are stored in that order):
+
+    meta.json       categories, sample rate, format version
+    audio.i16       int16 PCM of every clip, back to back
+    scores.f16      one float16 row of category scores per clip
+                    (NaN when the student model answered, not YAMNet)
+    details.jsonl   detection id, device, labels and comment per clip
+    index.bin       one RECORD_DTYPE row per clip, written last
+
+All files are memory-mappable (FeedbackLog reads them with np.memmap).
+A FeedbackWriter thread appends in batches, so the event loop only ever
+puts an entry on a queue; when the queue is full the entry is dropped
+and counted.  Writers in different uvicorn workers take an flock on the
+directory per batch.  A clip counts once its index row is on disk: on
+open, anything appended past the last complete row (a crash mid-batch)
+is truncated away.
+"""
+
+import asyncio
+import fcntl
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+import uuid
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+
+import config
+import metrics
+from decoding import TARGET_SR
+from head import BACKGROUND
+from ipc import pack_message, read_message
+from log import get_logger
+
+log = get_logger("feedback")
+
+LOG_VERSION = 1
+NO_LABEL = 0xFFFF           # label or prediction outside the log's categories (text in details.jsonl)
+
+SOURCE_YAMNET = 0
+SOURCE_STUDENT = 1
+
+RELAY_TIMEOUT_S = 2.0
+
+RECORD_DTYPE = np.dtype([
+    ("audio_offset", "<u8"),    # in samples
+    ("samples", "<u4"),
+    ("details_offset", "<u8"),  # in bytes
+    ("details_length", "<u4"),
+    ("created", "<f8"),         # unix time of the feedback
+    ("label", "<u2"),           # category index, len(categories) = background, NO_LABEL = other
+    ("predicted", "<u2"),
+    ("confidence", "<f4"),
+    ("correct", "u1"),
+    ("source", "u1"),
+])
+
+
+# ── Per-connection buffer ─────────────────────────────────────────────────
+
+@dataclass
+class _Clip:
+    audio: np.ndarray | None            # int16, None in mock mode
+    scores: np.ndarray | None           # pooled category scores, None if not from YAMNet
+    detections: dict[str, dict]         # by detection_id
+
+
+class RecentDetections:
+    """A connection's recent detections, with the audio and scores behind them."""
+
+    def __init__(self, connection_id: str, max_seconds: float = config.FEEDBACK_BUFFER_S) -> None:
+        self.connection_id = connection_id
+        self.device_id: str | None = None
+        self.max_samples = int(max_seconds * TARGET_SR)
+        self._clips: deque[_Clip] = deque()
+        self._samples = 0
+        self._next = 0
+
+    def add(self, audio: np.ndarray | None, scores: np.ndarray | None, detections: list[dict]) -> None:
+        """Give each detection a ``detection_id`` and keep the clip it came from."""
+        clip = _Clip(
+            None if audio is None else (np.clip(audio, -1.0, 1.0) * 32767).astype(np.int16),
+            scores,
+            {},
+        )
+        for detection in detections:
+            detection_id = f"{self.connection_id}-{self._next}"
+            self._next += 1
+            detection["detection_id"] = detection_id
+            clip.detections[detection_id] = detection
+
+        self._clips.append(clip)
+        if clip.audio is not None:
+            self._samples += len(clip.audio)
+        while len(self._clips) > 1 and self._samples > self.max_samples:
+            dropped = self._clips.popleft()
+            if dropped.audio is not None:
+                self._samples -= len(dropped.audio)
+
+    def find(self, detection_id: str) -> tuple[_Clip, dict] | None:
+        for clip in reversed(self._clips):
+            detection = clip.detections.get(detection_id)
+            if detection is not None:
+                return clip, detection
+        return None
+
+
+def new_connection_id() -> str:
+    """A connection id, prefixed with this worker's pid (see worker_of)."""
+    return f"{os.getpid()}-{uuid.uuid4().hex[:12]}"
+
+
+def connection_of(detection_id: str) -> str:
+    """The connection id a detection id was issued by."""
+    return detection_id.rsplit("-", 1)[0]
+
+
+def worker_of(detection_id: str) -> str:
+    """The pid of the worker a detection id was issued by."""
+    return detection_id.split("-", 1)[0]
+
+
+# ── Cross-worker relay ────────────────────────────────────────────────────
+
+class FeedbackRelay:
+    """Routes feedback requests to the worker that holds the detection's clip."""
+
+    def __init__(
+        self,
+        handler: Callable[[dict], dict | None],
+        socket_dir: str = config.FEEDBACK_SOCKET_DIR,
+    ) -> None:
+        self.handler = handler
+        self.socket_dir = socket_dir
+        self.worker = str(os.getpid())
+        self.path: str | None = None
+        self._server: asyncio.AbstractServer | None = None
+
+    async def start(self) -> None:
+        """Listen for relayed feedback; on failure only this worker's detections are found."""
+        path = os.path.join(self.socket_dir, f"feedback-{self.worker}.sock")
+        try:
+            os.makedirs(self.socket_dir, exist_ok=True)
+            if os.path.exists(path):
+                os.unlink(path)
+            self._server = await asyncio.start_unix_server(self._serve, path)
+        except OSError as exc:
+            log.warning("Feedback relay disabled (cannot listen on %s: %s)", path, exc)
+            return
+        self.path = path
+
+    async def close(self) -> None:
+        server, self._server = self._server, None
+        if server is None:
+            return
+        server.close()
+        await server.wait_closed()
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+    async def submit(self, request: dict) -> dict | None:
+        """The handler's answer for ``request`` from the worker that issued its detection_id."""
+        worker = worker_of(request["detection_id"])
+        if worker == self.worker:
+            return self.handler(request)
+        if not worker.isdigit():
+            return None
+        path = os.path.join(self.socket_dir, f"feedback-{worker}.sock")
+        try:
+            return await asyncio.wait_for(self._forward(path, request), RELAY_TIMEOUT_S)
+        except (OSError, asyncio.IncompleteReadError, asyncio.TimeoutError) as exc:
+            # The worker is gone (its connections, and their clips, with it)
+            log.debug("Feedback relay to %s failed: %s", path, exc)
+            return None
+
+    async def _forward(self, path: str, request: dict) -> dict | None:
+        reader, writer = await asyncio.open_unix_connection(path)
+        try:
+            writer.write(pack_message(request))
+            await writer.drain()
+            reply, _ = await read_message(reader)
+            return reply.get("result")
+        finally:
+            writer.close()
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                request, _ = await read_message(reader)
+                try:
+                    result = self.handler(request)
+                except (TypeError, ValueError) as exc:
+                    log.warning("Invalid relayed feedback: %s", exc)
+                    result = None
+                writer.write(pack_message({"result": result}))
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+# ── Segment log ───────────────────────────────────────────────────────────
+
+@dataclass
+class FeedbackEntry:
+    detection_id: str
+    device_id: str | None
+    audio: np.ndarray                   # int16
+    scores: np.ndarray | None
+    predicted: str
+    confidence: float
+    correct: bool
+    actual_sound: str | None
+    comment: str | None
+    created: float
+
+    @property
+    def label(self) -> str:
+        """What the clip actually is: the user's answer, else the confirmed prediction, else background."""
+        if self.actual_sound:
+            return self.actual_sound
+        return self.predicted if self.correct else BACKGROUND
+
+
+def log_dir(root: str, categories: list[str]) -> str:
+    """The log directory for one category list."""
+    return os.path.join(root, hashlib.sha1(",".join(categories).encode()).hexdigest()[:8])
+
+
+class _LogFiles:
+    """Paths of one log directory, and crash recovery."""
+
+    def __init__(self, path: str) -> None:
+        self.dir = path
+        self.meta = os.path.join(path, "meta.json")
+        self.audio = os.path.join(path, "audio.i16")
+        self.scores = os.path.join(path, "scores.f16")
+        self.details = os.path.join(path, "details.jsonl")
+        self.index = os.path.join(path, "index.bin")
+        self.lock = os.path.join(path, ".lock")
+
+    def recover(self, score_width: int) -> int:
+        """Drop anything past the last complete index row; returns the number of records."""
+        for path in (self.audio, self.scores, self.details, self.index):
+            if not os.path.exists(path):
+                open(path, "ab").close()
+        count = os.path.getsize(self.index) // RECORD_DTYPE.itemsize
+        sizes = {self.index: count * RECORD_DTYPE.itemsize, self.scores: count * score_width * 2}
+        if count:
+            with open(self.index, "rb") as f:
+                f.seek((count - 1) * RECORD_DTYPE.itemsize)
+                last = np.frombuffer(f.read(RECORD_DTYPE.itemsize), dtype=RECORD_DTYPE)[0]
+            sizes[self.audio] = (int(last["audio_offset"]) + int(last["samples"])) * 2
+            sizes[self.details] = int(last["details_offset"]) + int(last["details_length"])
+        else:
+            sizes[self.audio] = sizes[self.details] = 0
+        for path, size in sizes.items():
+            if os.path.getsize(path) > size:
+                log.warning("Truncating %s to %d bytes (incomplete write)", path, size)
+                os.truncate(path, size)
+        return count
+
+
+class FeedbackWriter:
+    """Appends feedback entries to the segment log from a background thread."""
+
+    def __init__(
+        self,
+        categories: list[str],
+        root: str = config.FEEDBACK_LOG_DIR,
+        queue_size: int = config.FEEDBACK_QUEUE_SIZE,
+        batch_size: int = config.FEEDBACK_BATCH_SIZE,
+        flush_s: float = config.FEEDBACK_FLUSH_S,
+    ) -> None:
+        self.categories = categories
+        self.labels = categories + [BACKGROUND]
+        self.files = _LogFiles(log_dir(root, categories))
+        os.makedirs(self.files.dir, exist_ok=True)
+        if not os.path.exists(self.files.meta):
+            tmp = self.files.meta + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"version": LOG_VERSION, "sample_rate": TARGET_SR, "categories": categories}, f)
+            os.replace(tmp, self.files.meta)
+
+        self.batch_size = batch_size
+        self.flush_s = flush_s
+        self._queue: queue.Queue[FeedbackEntry | None] = queue.Queue(maxsize=queue_size)
+        self.written = self.dropped = self.failed = self.batches = 0
+        self._thread = threading.Thread(target=self._run, name="feedback-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, entry: FeedbackEntry) -> bool:
+        """Queue an entry without blocking; False (and counted) if the queue is full."""
+        try:
+            self._queue.put_nowait(entry)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            metrics.FEEDBACK.labels("dropped").inc()
+            return False
+
+    def close(self, timeout_s: float = 10.0) -> None:
+        """Write out what is queued, then stop."""
+        self._queue.put(None)
+        self._thread.join(timeout_s)
+
+    def stats(self) -> dict:
+        return {
+            "log_dir": self.files.dir,
+            "queued": self._queue.qsize(),
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "batches": self.batches,
+        }
+
+    # ── internals ──────────────────────────────────────────────────────
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is None:
+                return
+            batch = [first]
+            # Linger briefly so a burst of feedback shares one fsync
+            deadline = time.monotonic() + self.flush_s
+            while len(batch) < self.batch_size:
+                try:
+                    entry = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    stopping = True
+                    break
+                batch.append(entry)
+            try:
+                self._write(batch)
+                self.written += len(batch)
+                self.batches += 1
+                metrics.FEEDBACK.labels("stored").inc(len(batch))
+            except Exception as exc:
+                self.failed += len(batch)
+                metrics.FEEDBACK.labels("failed").inc(len(batch))
+                log.error("Could not write %d feedback clips: %s", len(batch), exc)
+
+    def _code(self, name: str | None) -> int:
+        return self.labels.index(name) if name in self.labels else NO_LABEL
+
+    def _write(self, batch: list[FeedbackEntry]) -> None:
+        files = self.files
+        width = len(self.categories)
+        with open(files.lock, "a") as lock:
+            # Other workers append to the same log
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            files.recover(width)
+            audio_offset = os.path.getsize(files.audio) // 2
+            details_offset = os.path.getsize(files.details)
+
+            records = np.zeros(len(batch), dtype=RECORD_DTYPE)
+            scores = np.full((len(batch), width), np.nan, dtype="<f2")
+            details = []
+            for i, entry in enumerate(batch):
+                line = (json.dumps({
+                    "detection_id": entry.detection_id,
+                    "device_id": entry.device_id,
+                    "predicted": entry.predicted,
+                    "label": entry.label,
+                    "comment": entry.comment,
+                }) + "\n").encode()
+                records[i] = (
+                    audio_offset, len(entry.audio), details_offset, len(line), entry.created,
+                    self._code(entry.label), self._code(entry.predicted), entry.confidence,
+                    entry.correct, SOURCE_YAMNET if entry.scores is not None else SOURCE_STUDENT,
+                )
+                if entry.scores is not None:
+                    scores[i] = entry.scores
+                details.append(line)
+                audio_offset += len(entry.audio)
+                details_offset += len(line)
+
+            # Data first, index last: a row only exists once what it points to is durable
+            for path, data in (
+                (files.audio, b"".join(e.audio.astype("<i2").tobytes() for e in batch)),
+                (files.scores, scores.tobytes()),
+                (files.details, b"".join(details)),
+            ):
+                with open(path, "ab") as f:
+                    f.write(data)
+                    os.fsync(f.fileno())
+            with open(files.index, "ab") as f:
+                f.write(records.tobytes())
+                os.fsync(f.fileno())
+
+
+# ── Reading ───────────────────────────────────────────────────────────────
+
+class FeedbackLog:
+    """Read-only, memory-mapped view of one log directory."""
+
+    def __init__(self, path: str) -> None:
+        files = _LogFiles(path)
+        with open(files.meta) as f:
+            meta = json.load(f)
+        self.path = path
+        self.categories: list[str] = meta["categories"]
+        self.sample_rate: int = meta["sample_rate"]
+        self.labels = self.categories + [BACKGROUND]
+
+        # Only rows whose index entry is complete; a writer may be mid-batch
+        count = os.path.getsize(files.index) // RECORD_DTYPE.itemsize
+        self.index = np.memmap(files.index, dtype=RECORD_DTYPE, mode="r", shape=(count,)) if count else (
+            np.zeros(0, dtype=RECORD_DTYPE)
+        )
+        self.audio = np.memmap(files.audio, dtype="<i2", mode="r") if count else np.zeros(0, "<i2")
+        width = len(self.categories)
+        self.scores = np.memmap(files.scores, dtype="<f2", mode="r", shape=(count, width)) if count else (
+            np.zeros((0, width), "<f2")
+        )
+        self._details_path = files.details
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def clip(self, i: int) -> np.ndarray:
+        """Clip ``i`` as a float32 waveform in [-1, 1]."""
+        record = self.index[i]
+        start = int(record["audio_offset"])
+        return self.audio[start:start + int(record["samples"])].astype(np.float32) / 32768.0
+
+    def clip_bytes(self, i: int) -> bytes:
+        record = self.index[i]
+        start = int(record["audio_offset"])
+        return self.audio[start:start + int(record["samples"])].tobytes()
+
+    def details(self, i: int) -> dict:
+        record = self.index[i]
+        with open(self._details_path, "rb") as f:
+            f.seek(int(record["details_offset"]))
+            return json.loads(f.read(int(record["details_length"])))
+
+    def label(self, i: int) -> str:
+        code = int(self.index[i]["label"])
+        return self.labels[code] if code != NO_LABEL else self.details(i)["label"]
+
+
+def open_logs(root: str = config.FEEDBACK_LOG_DIR) -> list[FeedbackLog]:
+    """Every log directory under ``root`` (one per category list it has seen)."""
+    if not os.path.isdir(root):
+        return []
+    return [
+        FeedbackLog(os.path.join(root, name)) for name in sorted(os.listdir(root))
+        if os.path.exists(os.path.join(root, name, "meta.json"))
+    ]
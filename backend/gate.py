@@ -0,0 +1,225 @@
+"""
+Shadow-Sound — Activity gate
+
+Most of what a pocketed phone streams is silence or unchanging ambient
+noise that always ends in "no_detection".  An ActivityGate looks at each
+decoded chunk before it is queued for YAMNet and skips inference when
+nothing has changed:
+
+  * RMS level of 64 ms sub-frames, against an absolute silence floor,
+  * an adaptive noise floor per session, broadband and in 16 log-spaced
+    bands (follows quiet spells quickly, creeps up slowly so a long event
+    doesn't become "background"),
+  * spectral flux between consecutive sub-frames in those bands.
+
+The band test compares the chunk's average spectrum with the per-band
+floor, so a narrow-band siren well below broadband traffic noise still
+stands out; the flux test only counts the strongest-rising bands.
+Noise itself wobbles from sub-frame to sub-frame, so each test compares
+against what it measured on recent background chunks, not against zero.
+Anything louder than the noise floor by the profile's margins, or with a
+sudden spectral change, always passes — that is how a siren or horn first
+shows up.  After a pass the gate holds open for a few chunks, and it
+never skips more than GATE_MAX_SKIP_CHUNKS in a row, so steady sounds that
+started earlier (a car alarm, a held horn) are still re-checked.
+"""
+
+from collections import Counter
+from dataclasses import dataclass
+
+import numpy as np
+
+import config
+import metrics
+from decoding import TARGET_SR
+
+SUBFRAME = 1024                 # 64 ms at 16 kHz
+BANDS = 16
+TOP_BANDS = 3                   # bands averaged for the flux test
+EPS = 1e-10
+
+
+@dataclass(frozen=True)
+class GateProfile:
+    onset_db: float             # broadband peak over the noise floor, beyond background's, that passes
+    band_db: float              # chunk-average band excess over the floor, beyond background's, that passes
+    flux_db: float              # sub-frame-to-sub-frame band rise, beyond background's, that passes
+
+
+# Tuned per SettingsPayload.environment_profile; unknown profiles use "urban".
+PROFILES: dict[str, GateProfile] = {
+    "urban": GateProfile(onset_db=8.0, band_db=4.0, flux_db=6.0),      # loud, busy background
+    "suburban": GateProfile(onset_db=7.0, band_db=3.5, flux_db=5.0),
+    "indoor": GateProfile(onset_db=6.0, band_db=3.0, flux_db=4.0),     # doors, glass over HVAC hum
+    "quiet": GateProfile(onset_db=5.0, band_db=2.5, flux_db=3.0),      # parks, night — be eager
+}
+DEFAULT_PROFILE = "urban"
+
+
+def _band_edges() -> np.ndarray:
+    """rfft bin indices splitting 60 Hz – 8 kHz into log-spaced bands."""
+    hz = np.geomspace(60.0, TARGET_SR / 2, BANDS + 1)[:-1]
+    return np.unique(np.round(hz * SUBFRAME / TARGET_SR).astype(int))
+
+
+def _top_mean(values: np.ndarray) -> np.ndarray:
+    """Mean of the TOP_BANDS largest values in each row."""
+    k = min(TOP_BANDS, values.shape[1])
+    return np.partition(values, -k, axis=1)[:, -k:].mean(axis=1)
+
+
+_EDGES = _band_edges()
+_WINDOW = np.hanning(SUBFRAME).astype(np.float32)
+
+
+def chunk_features(waveform: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Per-sub-frame RMS level (dBFS) and band energies (dB) of a waveform."""
+    n = len(waveform) // SUBFRAME
+    if n == 0:
+        frames = np.zeros((1, SUBFRAME), dtype=np.float32)
+        frames[0, :len(waveform)] = waveform
+    else:
+        frames = waveform[:n * SUBFRAME].reshape(n, SUBFRAME)
+    level_db = 10.0 * np.log10(np.mean(frames * frames, axis=1) + EPS)
+    power = np.abs(np.fft.rfft(frames * _WINDOW, axis=1)) ** 2
+    bands_db = 10.0 * np.log10(np.add.reduceat(power, _EDGES, axis=1) + EPS)
+    return level_db, bands_db
+
+
+class GateStats:
+    """Skipped vs scored chunk counts per environment profile, server-wide."""
+
+    def __init__(self) -> None:
+        self.chunks: Counter[str] = Counter()
+        self.skipped: Counter[str] = Counter()
+
+    def record(self, profile: str, skipped: bool) -> None:
+        self.chunks[profile] += 1
+        self.skipped[profile] += skipped
+
+    def snapshot(self) -> dict:
+        return {
+            profile: {
+                "chunks": count,
+                "skipped": self.skipped[profile],
+                "hit_rate": round(self.skipped[profile] / count, 3) if count else 0.0,
+            }
+            for profile, count in sorted(self.chunks.items())
+        }
+
+
+gate_stats = GateStats()
+
+
+class ActivityGate:
+    """Per-connection pre-inference gate with an adaptive noise floor."""
+
+    def __init__(self, profile: str = DEFAULT_PROFILE) -> None:
+        self.set_profile(profile)
+        self.silence_dbfs = config.GATE_SILENCE_DBFS
+        self.max_skip = config.GATE_MAX_SKIP_CHUNKS
+        self.hold_chunks = config.GATE_HOLD_CHUNKS
+        self.warmup_chunks = config.GATE_WARMUP_CHUNKS
+
+        self.floor_db: float | None = None          # broadband noise floor, dBFS
+        self.floor_bands: np.ndarray | None = None  # per-band noise floor, dB
+        self._background: dict[str, float] = {}    # typical test values on background chunks
+        self._last_bands: np.ndarray | None = None  # last sub-frame of the previous chunk
+        self._hold = 0
+        self._skipped_in_row = 0
+
+        self.chunks = 0
+        self.skipped = 0
+        self.reasons: Counter[str] = Counter()
+        self.last_skipped = False
+
+    def set_profile(self, profile: str) -> None:
+        self.profile = profile if profile in PROFILES else DEFAULT_PROFILE
+        self._params = PROFILES[self.profile]
+
+    def check(self, waveform: np.ndarray) -> bool:
+        """True if the chunk should go to YAMNet, False to skip it."""
+        reason = self._decide(waveform)
+        skip = reason in ("silence", "steady")
+        self.chunks += 1
+        self.skipped += skip
+        self.reasons[reason] += 1
+        self.last_skipped = skip
+        self._skipped_in_row = self._skipped_in_row + 1 if skip else 0
+        gate_stats.record(self.profile, skip)
+        metrics.GATE_CHUNKS.labels(self.profile, "skipped" if skip else "passed").inc()
+        return not skip
+
+    def stats(self) -> dict:
+        return {
+            "profile": self.profile,
+            "chunks": self.chunks,
+            "skipped": self.skipped,
+            "hit_rate": round(self.skipped / self.chunks, 3) if self.chunks else 0.0,
+            "noise_floor_dbfs": round(self.floor_db, 1) if self.floor_db is not None else None,
+            "reasons": dict(self.reasons),
+        }
+
+    # ── internals ──────────────────────────────────────────────────────
+
+    def _decide(self, waveform: np.ndarray) -> str:
+        if len(waveform) == 0:
+            return "silence"
+        level_db, bands_db = chunk_features(waveform)
+        peak_db = float(level_db.max())
+        flux = self._flux(bands_db)
+        self._last_bands = bands_db[-1]
+
+        if peak_db < self.silence_dbfs:
+            self._update_floor(level_db, bands_db, None)
+            return "silence"
+
+        if self.floor_db is None:
+            self._update_floor(level_db, bands_db, None)
+            return "warmup"
+        tests = {
+            "onset": peak_db - self.floor_db,
+            "band": float((bands_db.mean(axis=0) - self.floor_bands).max()),
+            "flux": flux,
+        }
+        if self.chunks < self.warmup_chunks:
+            self._update_floor(level_db, bands_db, tests)
+            return "warmup"
+
+        margins = {"onset": self._params.onset_db, "band": self._params.band_db, "flux": self._params.flux_db}
+        for name, value in tests.items():
+            if value > self._background[name] + margins[name]:
+                self._hold = self.hold_chunks
+                return name
+
+        # Only event-free chunks teach the gate what "background" is
+        self._update_floor(level_db, bands_db, tests)
+        if self._hold > 0:
+            self._hold -= 1
+            return "hold"
+        if self._skipped_in_row >= self.max_skip:
+            return "refresh"
+        return "steady"
+
+    def _flux(self, bands_db: np.ndarray) -> float:
+        """Largest rise in the strongest-rising bands between consecutive sub-frames."""
+        if self._last_bands is not None:
+            bands_db = np.vstack([self._last_bands, bands_db])
+        if len(bands_db) < 2:
+            return 0.0
+        return float(_top_mean(np.diff(bands_db, axis=0)).max())
+
+    def _update_floor(self, level_db: np.ndarray, bands_db: np.ndarray, tests: dict | None) -> None:
+        level = float(np.median(level_db))
+        bands = bands_db.mean(axis=0)
+        if self.floor_db is None:
+            self.floor_db, self.floor_bands = level, bands
+            return
+        # Fall fast into quiet spells, rise slowly with background noise
+        self.floor_db += (0.5 if level < self.floor_db else 0.05) * (level - self.floor_db)
+        rate = np.where(bands < self.floor_bands, 0.5, 0.05)
+        self.floor_bands = self.floor_bands + rate * (bands - self.floor_bands)
+        if tests is not None:
+            for name, value in tests.items():
+                baseline = self._background.setdefault(name, value)
+                self._background[name] = baseline + 0.2 * (value - baseline)
@@ -0,0 +1,78 @@
+"""
+Shadow-Sound — YAMNet embedding head
+
+On its way to the 521 AudioSet scores, YAMNet computes a 1024-d embedding
+for every frame.  ``python train.py --head`` trains a small dense network
+on those embeddings for the categories under data/ and saves its weights
+to EMBEDDING_HEAD_PATH as a plain .npz, so serving needs only numpy.
+
+When the file exists, load_backend() wraps the runtime in an
+EmbeddingHeadBackend: each frame's head probabilities are appended to
+YAMNet's scores as extra ``head:<category>`` columns, and SoundClassifier
+scores those categories from their column instead of by class-name
+mapping.  The head runs on embeddings the model computes anyway, so it
+adds one small matrix product per batch.
+
+A head class named ``background`` (trained on ordinary street noise) is
+never reported.
+"""
+
+import os
+
+import numpy as np
+
+import config
+
+HEAD_PREFIX = "head:"
+BACKGROUND = "background"
+
+EMBEDDING_SIZE = 1024
+
+
+class EmbeddingHead:
+    """Dense ReLU layers ending in a softmax over ``categories``."""
+
+    def __init__(self, categories: list[str], layers: list[tuple[np.ndarray, np.ndarray]]) -> None:
+        self.categories = categories
+        self.layers = [(w.astype(np.float32), b.astype(np.float32)) for w, b in layers]
+
+    @classmethod
+    def load(cls, path: str) -> "EmbeddingHead":
+        with np.load(path) as data:
+            categories = [str(c) for c in data["categories"]]
+            layers = [(data[f"w{i}"], data[f"b{i}"]) for i in range(int(data["num_layers"]))]
+        return cls(categories, layers)
+
+    def save(self, path: str) -> None:
+        weights = {}
+        for i, (w, b) in enumerate(self.layers):
+            weights[f"w{i}"], weights[f"b{i}"] = w, b
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "wb") as f:
+            np.savez(f, categories=np.array(self.categories), num_layers=len(self.layers), **weights)
+
+    def predict(self, embeddings: np.ndarray) -> np.ndarray:
+        """``(frames, len(categories))`` probabilities for ``(frames, 1024)`` embeddings."""
+        x = embeddings.astype(np.float32, copy=False)
+        for w, b in self.layers[:-1]:
+            x = np.maximum(x @ w + b, 0.0)
+        w, b = self.layers[-1]
+        logits = x @ w + b
+        logits -= logits.max(axis=-1, keepdims=True)
+        exp = np.exp(logits)
+        return exp / exp.sum(axis=-1, keepdims=True)
+
+
+def load_head(path: str = config.EMBEDDING_HEAD_PATH) -> EmbeddingHead | None:
+    """The configured head, or None when there isn't one."""
+    if not path or not os.path.exists(path):
+        return None
+    return EmbeddingHead.load(path)
+
+
+def head_categories(path: str = config.EMBEDDING_HEAD_PATH) -> list[str]:
+    """Categories of the configured head (empty without one), without loading its weights."""
+    if not path or not os.path.exists(path):
+        return []
+    with np.load(path) as data:
+        return [str(c) for c in data["categories"]]
@@ -0,0 +1,307 @@
+"""
+Shadow-Sound — Client side of the local inference server
+
+In a uvicorn worker started with INFERENCE_SERVER set, RemoteInference
+stands in for InferenceScheduler: ``await score(waveform)`` writes the
+waveform into a free shared-memory slot, sends a few bytes of JSON over the
+server's Unix socket and awaits the frame scores written back into the
+same slot.  With several servers (MODEL_REPLICAS) each request goes to the
+one with the fewest outstanding requests.
+
+Category mapping stays in the worker: the server's class names are sent at
+connect time and wrapped in a RemoteBackend, so SoundClassifier.detect_all
+and streaming sessions work exactly as with an in-process model.
+"""
+
+import asyncio
+import itertools
+import os
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import config
+import model_store
+from backends import NUM_CLASSES, InferenceBackend
+from decoding import TARGET_SR
+from head import head_categories
+from ipc import PROTOCOL_VERSION, SlotLayout, pack_message, read_message, untrack
+from log import get_logger
+
+log = get_logger("inference")
+
+RECONNECT_INTERVAL_S = 1.0
+
+
+class RemoteBackend(InferenceBackend):
+    """Class names and artifact details of the model an inference server owns."""
+
+    name = "remote"
+
+    def __init__(self, hello: dict) -> None:
+        info = hello["artifact"]
+        artifact = model_store.ModelArtifact(
+            None, info["source"], info["location"], info["checksum"], info["load_ms"],
+        )
+        super().__init__(artifact, hello["class_names"])
+        self.server_backend = hello["backend"]
+
+    def run(self, waveform: np.ndarray) -> np.ndarray:
+        raise RuntimeError("Remote models are scored through RemoteInference.score()")
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "server_backend": self.server_backend}
+
+
+class _Connection:
+    """One worker ↔ server link: control socket plus shared-memory slots."""
+
+    def __init__(self, socket_path: str, layout: SlotLayout) -> None:
+        self.socket_path = socket_path
+        self.layout = layout
+        self.alive = False
+        self._ids = itertools.count()
+        self._pending: dict[int, tuple[asyncio.Future, int | None]] = {}
+        self._free: asyncio.Queue[int] = asyncio.Queue()
+        self._reader_task: asyncio.Task | None = None
+
+    @property
+    def outstanding(self) -> int:
+        return len(self._pending)
+
+    async def open(self) -> dict:
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+        shm = shared_memory.SharedMemory(create=True, size=self.layout.nbytes)
+        try:
+            writer.write(pack_message({
+                "op": "hello",
+                "version": PROTOCOL_VERSION,
+                "shm": shm.name,
+                "slots": self.layout.slots,
+                "slot_samples": self.layout.slot_samples,
+                "columns": self.layout.columns,
+            }))
+            hello, _ = await read_message(reader)
+        except BaseException:
+            shm.close()
+            shm.unlink()
+            writer.close()
+            raise
+        if hello.get("op") != "hello":
+            # Refused before attaching, so the name is still ours to unlink
+            shm.close()
+            shm.unlink()
+            writer.close()
+            raise ConnectionError(f"{self.socket_path}: {hello.get('error', 'bad handshake')}")
+        # The server unlinked the name once attached (see ipc.untrack)
+        untrack(shm)
+
+        self._shm = shm
+        self._requests, self._responses = self.layout.views(shm)
+        self._writer = writer
+        for slot in range(self.layout.slots):
+            self._free.put_nowait(slot)
+        self.alive = True
+        self._reader_task = asyncio.create_task(self._read_replies(reader))
+        return hello
+
+    async def score(self, waveform: np.ndarray, background: bool = False) -> np.ndarray:
+        self._check_alive()
+        header: dict = {"op": "score", "id": next(self._ids), "samples": len(waveform)}
+        if background:
+            header["background"] = True
+        payload = b""
+        slot = None
+        if len(waveform) <= self.layout.slot_samples:
+            slot = await self._free.get()
+            try:
+                self._check_alive()     # the connection may have dropped while we waited
+                self._requests[slot, :len(waveform)] = waveform
+                header["slot"] = slot
+                future = self._send(header, payload, slot)
+            except BaseException:
+                # Never handed to the server, so nothing else will free it
+                self._free.put_nowait(slot)
+                raise
+        else:
+            payload = np.ascontiguousarray(waveform, dtype=np.float32).tobytes()
+            future = self._send(header, payload)
+
+        reply, data = await future
+        if "error" in reply:
+            raise RuntimeError(f"Inference server: {reply['error']}")
+        return data
+
+    async def stats(self) -> dict:
+        reply, _ = await self._send({"op": "stats", "id": next(self._ids)})
+        return reply["stats"]
+
+    async def close(self) -> None:
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+            try:
+                await self._reader_task
+            except asyncio.CancelledError:
+                pass
+
+    # ── internals ──────────────────────────────────────────────────────
+
+    def _check_alive(self) -> None:
+        if not self.alive:
+            raise ConnectionError(f"Inference server {self.socket_path} is not connected")
+
+    def _send(self, header: dict, payload: bytes = b"", slot: int | None = None) -> asyncio.Future:
+        self._check_alive()
+        future = asyncio.get_running_loop().create_future()
+        # The slot stays reserved until the reply arrives, even if the
+        # caller times out, because the server may still be reading it.
+        self._pending[header["id"]] = (future, slot)
+        try:
+            self._writer.write(pack_message(header, payload))
+        except BaseException:
+            del self._pending[header["id"]]
+            raise
+        return future
+
+    async def _read_replies(self, reader: asyncio.StreamReader) -> None:
+        try:
+            while True:
+                reply, payload = await read_message(reader)
+                future, slot = self._pending.pop(reply["id"], (None, None))
+                scores = None
+                if reply.get("op") == "result" and "error" not in reply:
+                    if reply.get("inline"):
+                        scores = np.frombuffer(payload, dtype=np.float32).reshape(-1, self.layout.columns)
+                    else:
+                        scores = self._responses[slot, :reply["frames"]].copy()
+                if slot is not None:
+                    self._free.put_nowait(slot)
+                if future is not None and not future.done():
+                    future.set_result((reply, scores))
+        except (asyncio.IncompleteReadError, ConnectionError) as exc:
+            log.warning("Lost inference server %s: %s", self.socket_path, exc or "EOF")
+        finally:
+            self.alive = False
+            for future, slot in self._pending.values():
+                if slot is not None:
+                    self._free.put_nowait(slot)
+                if not future.done():
+                    future.set_exception(ConnectionError(f"Inference server {self.socket_path} went away"))
+            self._pending.clear()
+            self._writer.close()
+            del self._requests, self._responses
+            self._shm.close()
+
+
+class RemoteInference:
+    """InferenceScheduler stand-in that scores through local inference servers."""
+
+    def __init__(
+        self,
+        socket_paths: list[str],
+        slots: int = config.INFERENCE_SLOTS,
+        slot_seconds: float = config.INFERENCE_SLOT_SECONDS,
+    ) -> None:
+        self.socket_paths = [path.strip() for path in socket_paths if path.strip()]
+        # Servers append a score column per embedding-head category; both
+        # sides read the same EMBEDDING_HEAD_PATH
+        columns = NUM_CLASSES + len(head_categories())
+        self.layout = SlotLayout(max(1, slots), int(slot_seconds * TARGET_SR), columns)
+        self._connections: dict[str, _Connection] = {}
+        self._reconnect_task: asyncio.Task | None = None
+        self.requests = 0
+        self.inline_requests = 0
+
+    async def connect(self) -> dict:
+        """Connect to every server; returns the first handshake.  Raises if none answer."""
+        hello = None
+        errors = []
+        for path in self.socket_paths:
+            try:
+                reply = await self._open(path)
+                hello = hello or reply
+            except (OSError, ConnectionError) as exc:
+                errors.append(f"{path}: {exc}")
+        if hello is None:
+            raise ConnectionError("No inference server reachable — " + "; ".join(errors))
+        return hello
+
+    def start(self) -> None:
+        if self._reconnect_task is None:
+            self._reconnect_task = asyncio.create_task(self._reconnect())
+
+    async def stop(self) -> None:
+        if self._reconnect_task is not None:
+            self._reconnect_task.cancel()
+            try:
+                await self._reconnect_task
+            except asyncio.CancelledError:
+                pass
+            self._reconnect_task = None
+        for connection in self._connections.values():
+            await connection.close()
+        self._connections.clear()
+
+    async def score(self, waveform: np.ndarray, background: bool = False) -> np.ndarray:
+        """Frame scores for one waveform from the least busy server (see InferenceScheduler.score)."""
+        live = [c for c in self._connections.values() if c.alive]
+        if not live:
+            raise ConnectionError("No inference server connected")
+        connection = min(live, key=lambda c: c.outstanding)
+        self.requests += 1
+        self.inline_requests += len(waveform) > self.layout.slot_samples
+        return await connection.score(waveform, background)
+
+    @property
+    def queue_depth(self) -> int:
+        return sum(c.outstanding for c in self._connections.values())
+
+    def stats(self) -> dict:
+        return {
+            "remote": True,
+            "requests": self.requests,
+            "inline_requests": self.inline_requests,
+            "slots": self.layout.slots,
+            "slot_seconds": round(self.layout.slot_samples / TARGET_SR, 2),
+            "queue_depth": self.queue_depth,
+            "servers": [
+                {
+                    "socket": path,
+                    "connected": path in self._connections and self._connections[path].alive,
+                    "outstanding": self._connections[path].outstanding if path in self._connections else 0,
+                }
+                for path in self.socket_paths
+            ],
+        }
+
+    async def server_stats(self) -> dict:
+        """Batching and model stats reported by each connected server."""
+        results = {}
+        for path, connection in self._connections.items():
+            if connection.alive:
+                try:
+                    results[path] = await asyncio.wait_for(connection.stats(), 2.0)
+                except (asyncio.TimeoutError, ConnectionError) as exc:
+                    results[path] = {"error": str(exc) or "timeout"}
+        return results
+
+    # ── internals ──────────────────────────────────────────────────────
+
+    async def _open(self, path: str) -> dict:
+        connection = _Connection(path, self.layout)
+        hello = await connection.open()
+        self._connections[path] = connection
+        log.info("Connected to inference server %s (%s, pid %d)", path, hello["backend"], os.getpid())
+        return hello
+
+    async def _reconnect(self) -> None:
+        while True:
+            await asyncio.sleep(RECONNECT_INTERVAL_S)
+            for path in self.socket_paths:
+                connection = self._connections.get(path)
+                if connection is not None and connection.alive:
+                    continue
+                try:
+                    await self._open(path)
+                except (OSError, ConnectionError):
+                    pass
@@ -0,0 +1,213 @@
+"""
+Shadow-Sound — Local inference server
+
+Owns one YAMNet replica and serves frame scores to any number of uvicorn
+workers over a Unix socket, so socket handling can scale across cores
+without every worker loading the model.  Requests from all workers go
+through one InferenceScheduler, so they are micro-batched together.
+
+Each connecting worker hands over a shared-memory segment (see ipc.py);
+waveforms are read from it in place and scores written straight back.
+
+    python inference_server.py --socket /tmp/shadowsound/inference-0.sock
+
+launch.py starts MODEL_REPLICAS of these next to uvicorn.
+"""
+
+import argparse
+import asyncio
+import os
+import signal
+import sys
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import config
+from classifier import SoundClassifier
+from ipc import PROTOCOL_VERSION, SlotLayout, pack_message, read_message
+from log import get_logger
+from scheduler import InferenceScheduler
+from workers import WorkerPool
+
+log = get_logger("inference")
+
+
+class InferenceServer:
+    """Serves InferenceScheduler.score() to uvicorn workers over IPC."""
+
+    def __init__(self, classifier: SoundClassifier, socket_path: str) -> None:
+        self.classifier = classifier
+        self.socket_path = socket_path
+        self.workers = WorkerPool(decode_mode="thread")
+        self.scheduler = InferenceScheduler(classifier, self.workers)
+        self._server: asyncio.base_events.Server | None = None
+        self._connections: dict[asyncio.Task, asyncio.StreamWriter] = {}
+        self.clients = 0
+        self.requests = 0
+        self.inline_requests = 0
+
+    async def start(self) -> None:
+        os.makedirs(os.path.dirname(self.socket_path) or ".", exist_ok=True)
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+        self.scheduler.start()
+        self._server = await asyncio.start_unix_server(self._handle, path=self.socket_path)
+        os.chmod(self.socket_path, 0o600)
+        log.info("Serving %s on %s", self.classifier.backend.name, self.socket_path)
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+        # Closing each socket ends its handler through the normal EOF path
+        for writer in self._connections.values():
+            writer.close()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        await self.scheduler.stop()
+        self.workers.shutdown()
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
+
+    def stats(self) -> dict:
+        return {
+            **self.scheduler.stats(),
+            "clients": self.clients,
+            "requests": self.requests,
+            "inline_requests": self.inline_requests,
+            "model": self.classifier.trace_stats(),
+        }
+
+    # ── per-worker connection ──────────────────────────────────────────
+
+    def _hello(self) -> dict:
+        artifact = self.classifier.artifact
+        return {
+            "op": "hello",
+            "version": PROTOCOL_VERSION,
+            "backend": self.classifier.backend.name,
+            "class_names": self.classifier.class_names,
+            "artifact": {
+                "source": artifact.source,
+                "location": artifact.location,
+                "checksum": artifact.checksum,
+                "load_ms": artifact.load_ms,
+            },
+            "warmup_ms": self.classifier.warmup_ms,
+        }
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        shm = None
+        requests = responses = None
+        tasks: set[asyncio.Task] = set()
+        self._connections[asyncio.current_task()] = writer
+        try:
+            hello, _ = await read_message(reader)
+            if hello.get("version") != PROTOCOL_VERSION:
+                writer.write(pack_message({"op": "error", "error": "protocol version mismatch"}))
+                return
+            if hello["columns"] != len(self.classifier.class_names):
+                # The worker sized its slots for a different embedding head
+                writer.write(pack_message({"op": "error", "error": "score columns mismatch (embedding head)"}))
+                return
+            layout = SlotLayout(hello["slots"], hello["slot_samples"], hello["columns"])
+            shm = shared_memory.SharedMemory(name=hello["shm"])
+            # Both sides are attached now; the name is no longer needed
+            # (unlink() also drops this process's resource-tracker entry)
+            shm.unlink()
+            requests, responses = layout.views(shm)
+            writer.write(pack_message(self._hello()))
+            self.clients += 1
+
+            while True:
+                header, payload = await read_message(reader)
+                if header["op"] == "score":
+                    task = asyncio.create_task(
+                        self._score(writer, header, payload, requests, responses, layout)
+                    )
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+                elif header["op"] == "stats":
+                    writer.write(pack_message({"op": "stats", "id": header["id"], "stats": self.stats()}))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            self._connections.pop(asyncio.current_task(), None)
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+            if shm is not None:
+                self.clients -= 1
+                del requests, responses
+                try:
+                    shm.close()
+                except BufferError:
+                    # A batch still holds a view into the segment; the
+                    # mapping is released once that batch finishes.
+                    pass
+            writer.close()
+
+    async def _score(
+        self,
+        writer: asyncio.StreamWriter,
+        header: dict,
+        payload: bytes,
+        requests: np.ndarray,
+        responses: np.ndarray,
+        layout: SlotLayout,
+    ) -> None:
+        slot = header.get("slot")
+        self.requests += 1
+        if payload:
+            self.inline_requests += 1
+            waveform = np.frombuffer(payload, dtype=np.float32)
+        else:
+            waveform = requests[slot, :header["samples"]]
+
+        try:
+            scores = await self.scheduler.score(waveform, header.get("background", False))
+        except Exception as exc:
+            writer.write(pack_message({"op": "result", "id": header["id"], "error": str(exc)}))
+            return
+
+        frames = len(scores)
+        if slot is not None and frames <= layout.slot_frames:
+            responses[slot, :frames] = scores
+            writer.write(pack_message({"op": "result", "id": header["id"], "frames": frames}))
+        else:
+            writer.write(pack_message(
+                {"op": "result", "id": header["id"], "frames": frames, "inline": True},
+                np.ascontiguousarray(scores, dtype=np.float32).tobytes(),
+            ))
+
+
+async def serve(socket_path: str) -> None:
+    # Workers run the student cascade themselves; this process only scores
+    classifier = SoundClassifier(cascade=False)
+    if config.MODEL_WARMUP:
+        classifier.warm_up()
+
+    server = InferenceServer(classifier, socket_path)
+    await server.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, stop.set)
+    await stop.wait()
+    log.info("Shutting down %s", socket_path)
+    await server.stop()
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Serve YAMNet frame scores to uvicorn workers.")
+    parser.add_argument(
+        "--socket", default=os.path.join(config.INFERENCE_SOCKET_DIR, "inference-0.sock"),
+    )
+    args = parser.parse_args(argv)
+    asyncio.run(serve(args.socket))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
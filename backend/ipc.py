@@ -0,0 +1,90 @@
+"""
+Shadow-Sound — Inference IPC primitives
+
+Shared by inference_server.py and inference_client.py.
+
+Control channel: a Unix stream socket carrying length-prefixed messages,
+
+    <uint32 header_len><uint32 payload_len><JSON header><raw payload>
+
+where the payload is empty unless a waveform or score block is too large
+for its shared-memory slot.
+
+Data channel: one shared-memory segment per (uvicorn worker, inference
+server) pair, created by the worker and split into fixed slots:
+
+    requests   [slots, slot_samples]        float32 waveforms
+    responses  [slots, slot_frames, columns] float32 YAMNet frame scores
+
+(columns is 521 plus one per embedding-head category, see head.py.)
+
+A slot belongs to the worker until it sends a request naming it, then to
+the server until the matching reply arrives, so neither side ever locks.
+"""
+
+import asyncio
+import json
+import struct
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+from backends import NUM_CLASSES
+from decoding import num_frames
+
+PROTOCOL_VERSION = 2
+
+_PREFIX = struct.Struct("<II")
+
+
+def pack_message(header: dict, payload: bytes = b"") -> bytes:
+    body = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return _PREFIX.pack(len(body), len(payload)) + body + payload
+
+
+async def read_message(reader: asyncio.StreamReader) -> tuple[dict, bytes]:
+    """Read one message; raises asyncio.IncompleteReadError on EOF."""
+    header_len, payload_len = _PREFIX.unpack(await reader.readexactly(_PREFIX.size))
+    header = json.loads(await reader.readexactly(header_len))
+    payload = await reader.readexactly(payload_len) if payload_len else b""
+    return header, payload
+
+
+@dataclass(frozen=True)
+class SlotLayout:
+    slots: int
+    slot_samples: int
+    columns: int = NUM_CLASSES
+
+    @property
+    def slot_frames(self) -> int:
+        return num_frames(self.slot_samples)
+
+    @property
+    def request_bytes(self) -> int:
+        return self.slots * self.slot_samples * 4
+
+    @property
+    def nbytes(self) -> int:
+        return self.request_bytes + self.slots * self.slot_frames * self.columns * 4
+
+    def views(self, shm: shared_memory.SharedMemory) -> tuple[np.ndarray, np.ndarray]:
+        """(requests, responses) arrays backed by the segment."""
+        requests = np.ndarray((self.slots, self.slot_samples), np.float32, shm.buf, 0)
+        responses = np.ndarray(
+            (self.slots, self.slot_frames, self.columns), np.float32, shm.buf, self.request_bytes,
+        )
+        return requests, responses
+
+
+def untrack(shm: shared_memory.SharedMemory) -> None:
+    """
+    Stop the creating worker's resource tracker from unlinking (or warning
+    about) a segment whose name the server unlinks as soon as both sides
+    are attached — so a crash on either side can't leak it.
+    """
+    try:
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
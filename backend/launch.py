@@ -0,0 +1,120 @@
+"""
+Shadow-Sound — Process launcher
+
+Starts MODEL_REPLICAS inference servers (each loads YAMNet once), waits for
+their sockets, then runs uvicorn with WEB_WORKERS workers pointed at them
+via INFERENCE_SERVER.  Socket handling and model replicas scale
+independently, all on one host with no broker.  The workers share an
+emptied METRICS_DIR (default <socket dir>/metrics), so /metrics reports
+all of them.
+
+    python launch.py [--web-workers 4] [--replicas 2] [--port 8000]
+
+If any child exits the others are stopped and the launcher exits with that
+child's status, so the container restarts as a whole.
+"""
+
+import argparse
+import os
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import time
+
+import config
+from log import get_logger
+
+log = get_logger("launch")
+
+STARTUP_TIMEOUT_S = 180.0
+
+
+def _wait_for_socket(path: str, process: subprocess.Popen, timeout_s: float, stopping: list) -> None:
+    deadline = time.monotonic() + timeout_s
+    while time.monotonic() < deadline:
+        if stopping:
+            raise RuntimeError("Stopped during start-up")
+        if process.poll() is not None:
+            raise RuntimeError(f"Inference server for {path} exited with status {process.returncode}")
+        if os.path.exists(path):
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+                try:
+                    probe.connect(path)
+                    return
+                except OSError:
+                    pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Inference server for {path} did not start within {timeout_s:.0f} s")
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Run inference servers and uvicorn workers together.")
+    parser.add_argument("--web-workers", type=int, default=config.WEB_WORKERS)
+    parser.add_argument("--replicas", type=int, default=config.MODEL_REPLICAS)
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--socket-dir", default=config.INFERENCE_SOCKET_DIR)
+    args = parser.parse_args(argv)
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    sockets = [os.path.join(args.socket_dir, f"inference-{i}.sock") for i in range(max(1, args.replicas))]
+    children: list[subprocess.Popen] = []
+    stopping: list[int] = []
+
+    def request_stop(signum, _frame) -> None:
+        stopping.append(signum)
+
+    def shutdown() -> None:
+        # uvicorn first, so its workers don't see the inference servers vanish
+        for child in reversed(children):
+            if child.poll() is None:
+                child.terminate()
+                try:
+                    child.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    child.kill()
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    try:
+        for path in sockets:
+            children.append(subprocess.Popen(
+                [sys.executable, os.path.join(here, "inference_server.py"), "--socket", path], cwd=here,
+            ))
+        for path, child in zip(sockets, children):
+            _wait_for_socket(path, child, STARTUP_TIMEOUT_S, stopping)
+        log.info("%d inference server(s) ready — starting %d web worker(s)", len(sockets), args.web_workers)
+
+        # Counters start from zero with the new workers, as they would with one process
+        metrics_dir = config.METRICS_DIR or os.path.join(args.socket_dir, "metrics")
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        env = {**os.environ, "INFERENCE_SERVER": ",".join(sockets), "METRICS_DIR": metrics_dir}
+        children.append(subprocess.Popen(
+            [
+                sys.executable, "-m", "uvicorn", "main:app",
+                "--host", args.host, "--port", str(args.port), "--workers", str(max(1, args.web_workers)),
+            ],
+            cwd=here,
+            env=env,
+        ))
+    except RuntimeError as exc:
+        log.error("%s", exc)
+        shutdown()
+        return 0 if stopping else 1
+
+    # Supervise: the first child to exit takes the rest down with it
+    status = 0
+    while not stopping and all(child.poll() is None for child in children):
+        time.sleep(0.5)
+    if not stopping:
+        status = next(child.returncode for child in children if child.poll() is not None) or 1
+        log.error("A child process exited (status %s) — stopping the rest", status)
+    shutdown()
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,93 @@
+"""
+Shadow-Sound — Logging
+
+Leveled logging that never blocks the caller on stdout.  Records are put on
+a bounded in-memory queue and a background listener thread writes them
+out; if the queue is full the record is dropped rather than stalling the
+event loop.  A disabled level (LOG_LEVEL, default INFO) costs a single
+level check, and %-style arguments are only formatted for records that are
+actually emitted — so hot-path calls should look like
+
+    log.debug("decoded %d bytes", len(audio_bytes))
+
+and anything expensive to compute belongs behind ``log.isEnabledFor``.
+"""
+
+import atexit
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+
+import config
+
+QUEUE_SIZE = 10_000
+
+_lock = threading.Lock()
+_configured_pid: int | None = None
+_listener: logging.handlers.QueueListener | None = None
+
+dropped = 0
+
+
+class _Formatter(logging.Formatter):
+    """``LEVEL [component] message`` — the bracketed prefix the prints used."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        record.component = record.name.rpartition(".")[2]
+        return super().format(record)
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    def enqueue(self, record: logging.LogRecord) -> None:
+        global dropped
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            dropped += 1
+
+
+def _configure() -> None:
+    global _configured_pid, _listener
+    with _lock:
+        if _configured_pid == os.getpid():
+            return
+        root = logging.getLogger("shadowsound")
+        # After a fork the parent's handler is inherited but its listener
+        # thread is not — replace both.
+        root.handlers.clear()
+        root.setLevel(config.LOG_LEVEL)
+        root.propagate = False
+
+        records: queue.Queue = queue.Queue(maxsize=QUEUE_SIZE)
+        root.addHandler(_DroppingQueueHandler(records))
+
+        stream = logging.StreamHandler(sys.stdout)
+        stream.setFormatter(_Formatter("%(levelname)s [%(component)s] %(message)s"))
+        _listener = logging.handlers.QueueListener(records, stream)
+        _listener.start()
+        _configured_pid = os.getpid()
+
+
+def _reset_after_fork() -> None:
+    global _configured_pid, _listener
+    _configured_pid = None
+    _listener = None
+    _configure()
+
+
+@atexit.register
+def _flush() -> None:
+    if _listener is not None and _configured_pid == os.getpid():
+        _listener.stop()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def get_logger(component: str) -> logging.Logger:
+    """Logger whose records are prefixed with ``[component]``."""
+    _configure()
+    return logging.getLogger(f"shadowsound.{component}")
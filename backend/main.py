@@ -3,34 +3,153 @@ Shadow-Sound Backend — FastAPI Application
 Audio classification service powered by YAMNet.
 """
 
+import asyncio
 import base64
+import hmac
 import time
 import json
-import uuid
+import os
 import random
+import numpy as np
 from contextlib import asynccontextmanager
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Query
+from fastapi import FastAPI, Query, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import Optional
+from starlette.background import BackgroundTask
+from starlette.requests import ClientDisconnect
+from typing import Awaitable, Callable, Optional
 
+import config
+import metrics
+import offline
 from classifier import SoundClassifier
+from decoding import MAX_SAMPLE_RATE, MIN_SAMPLE_RATE, valid_sample_rate
+from device_settings import DeviceProfile, ProfileCache, SettingsStore
+from direction import annotate, gcc_phat
+from events import EventTracker
+from fanout import FanoutHub, Subscription
+from feedback import FeedbackEntry, FeedbackRelay, FeedbackWriter, RecentDetections, connection_of, new_connection_id
+from gate import ActivityGate, gate_stats
+from inference_client import RemoteBackend, RemoteInference
+from log import get_logger
+from protocol import FrameError, parse_frame, supports_binary
+from scheduler import InferenceScheduler
+from shedding import ChunkInbox, Inbound
+from stream_decoder import StreamDecodeError, StreamDecoder
+from streaming import StreamingSession
+from workers import PoolSaturated, WorkerPool
+
+log = get_logger("server")
 
 # ── Load classifier on startup ────────────────────────────────────────────
 
 classifier: SoundClassifier | None = None
+scheduler: InferenceScheduler | RemoteInference | None = None
+workers: WorkerPool | None = None
+profiles: ProfileCache | None = None
+feedback_writer: FeedbackWriter | None = None
+feedback_relay: FeedbackRelay | None = None
+hub: FanoutHub | None = None
+
+
+model_error: str | None = None
+
+# Activity gates of open live connections, by connection id
+active_gates: dict[str, tuple[str | None, ActivityGate]] = {}
+
+# Recent detections (with their audio) of open connections, by connection id
+recent_detections: dict[str, RecentDetections] = {}
+
+# Stream decoders of open connections, by connection id
+active_decoders: dict[str, StreamDecoder] = {}
+
+
+def _update_load_gauges() -> None:
+    if scheduler is not None:
+        metrics.QUEUE_DEPTH.set(scheduler.queue_depth)
+        metrics.PENDING_CHUNKS.set(workers.pending)
+
+
+async def _write_metrics() -> None:
+    """Keep this worker's share of /metrics current for the other workers (see metrics.py)."""
+    while True:
+        await asyncio.sleep(metrics.SNAPSHOT_S)
+        _update_load_gauges()
+        metrics.write_snapshot(config.METRICS_DIR)
+
+
+async def _refresh_profiles() -> None:
+    """Pick up settings written through other workers."""
+    while True:
+        await asyncio.sleep(config.SETTINGS_REFRESH_S)
+        try:
+            changed = await asyncio.to_thread(profiles.refresh)
+            if changed:
+                log.debug("Settings changed for %d cached devices", changed)
+        except Exception as exc:
+            log.warning("Settings refresh failed: %s", exc)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global classifier
+    global classifier, scheduler, workers, profiles, feedback_writer, feedback_relay, hub, model_error
+    remote = None
     try:
-        classifier = SoundClassifier()
+        if config.INFERENCE_SERVER:
+            # The model lives in inference_server.py; this worker only keeps
+            # the class names needed for category mapping.
+            remote = RemoteInference(config.INFERENCE_SERVER.split(","))
+            hello = await remote.connect()
+            classifier = SoundClassifier(RemoteBackend(hello))
+            classifier.warmup_ms = hello["warmup_ms"]
+        else:
+            classifier = SoundClassifier()
+            if config.MODEL_WARMUP:
+                classifier.warm_up()
     except Exception as exc:
-        print(f"[server] Could not load YAMNet model: {exc}")
-        print("[server] Running in MOCK mode — connect to /ws/audio?mock=true or any request will use mock.")
+        log.warning("Could not load YAMNet model: %s", exc)
+        log.warning("Running in MOCK mode — connect to /ws/audio?mock=true or any request will use mock.")
+        model_error = str(exc)
         classifier = None
+    if classifier is not None:
+        workers = WorkerPool()
+        scheduler = remote or InferenceScheduler(classifier, workers)
+        scheduler.start()
+        feedback_writer = FeedbackWriter(classifier.categories)
+    profiles = ProfileCache(
+        SettingsStore(), SettingsPayload().model_dump(), classifier.categories if classifier else [],
+    )
+    refresher = asyncio.create_task(_refresh_profiles())
+    metrics_writer = asyncio.create_task(_write_metrics()) if config.METRICS_DIR else None
+    feedback_relay = FeedbackRelay(lambda request: _store_feedback(FeedbackRequest(**request)))
+    await feedback_relay.start()
+    if config.FANOUT_TOKEN:
+        hub = FanoutHub()
+        await hub.start()
+    else:
+        log.warning("FANOUT_TOKEN is not set; /ws/subscribe is disabled")
     yield
+    refresher.cancel()
+    if metrics_writer is not None:
+        metrics_writer.cancel()
+        metrics.write_snapshot(config.METRICS_DIR)
+    await feedback_relay.close()
+    feedback_relay = None
+    if hub is not None:
+        hub.close()
+        hub = None
+    profiles.store.close()
+    profiles = None
+    if scheduler is not None:
+        await scheduler.stop()
+    if workers is not None:
+        workers.shutdown()
+    if feedback_writer is not None:
+        feedback_writer.close()
+        feedback_writer = None
+    scheduler = None
+    workers = None
     classifier = None
 
 
@@ -130,6 +249,7 @@ def _mock_detection():
         "confidence": round(random.uniform(0.75, 0.99), 2),
         "direction_degrees": direction["degrees"],
         "direction_label": direction["label"],
+        "direction_confidence": round(random.uniform(0.5, 0.95), 2),
         "urgency": URGENCY_MAP.get(sound, "low"),
         "estimated_distance": random.choice(["close", "medium", "far"]),
         "haptic_pattern": HAPTIC_PATTERNS.get(sound, "single_tap"),
@@ -140,6 +260,260 @@ def _mock_detection():
 # WebSocket endpoint  —  /ws/audio
 # ---------------------------------------------------------------------------
 
+async def _send_error(ws: WebSocket, code: str, message: str, **extra) -> None:
+    metrics.ERRORS.labels(code).inc()
+    await ws.send_json({"type": "error", "code": code, "message": message, **extra})
+
+
+async def _classify_live(
+    ws: WebSocket,
+    decode: Callable[[], Awaitable],
+    session: StreamingSession | None,
+    gate: ActivityGate | None,
+    threshold_scale: float | np.ndarray = 1.0,
+    recent: RecentDetections | None = None,
+) -> list[dict] | None:
+    """
+    Admit one chunk to the worker pools, decode it and classify it.
+
+    With a streaming session only the YAMNet frames completed by this chunk
+    are scored; otherwise the chunk is classified on its own.  Chunks the
+    activity gate considers silent or unchanged background are not scored
+    (a streaming session still buffers them to keep the stream contiguous),
+    and with a student cascade YAMNet only sees the chunks the student
+    model can't settle on its own.  Stereo chunks' detections get a
+    direction, from correlations computed while YAMNet runs.
+    ``threshold_scale`` scales category thresholds: lower for an event
+    tracker, per category for the device's settings profile.  Detections
+    get their ``detection_id`` from ``recent``, which keeps the audio they
+    were found in for feedback.
+
+    Returns the detections, or None when an error has already been sent to
+    the client (pool saturated or a step timed out).
+    """
+    try:
+        workers.admit()
+    except PoolSaturated as exc:
+        await _send_error(ws, "overloaded", str(exc), retry_after_ms=workers.retry_after_ms())
+        return None
+
+    locating = None
+    try:
+        waveform, pair = await decode()
+        if waveform is None:
+            return []
+
+        with metrics.stage("gate"):
+            active = gate is None or gate.check(waveform)
+
+        scores = None
+        if session is not None:
+            pending = session.push(waveform, pair)
+            if pending is None or not active:
+                return []
+            first_frame, audio = pending
+            pair = session.pair
+            locating = _locate(pair)
+            detections = await _triage(audio, threshold_scale)
+            if detections is None:
+                with metrics.stage("inference"):
+                    scores = await workers.with_timeout(
+                        scheduler.score(audio), workers.inference_timeout_s,
+                    )
+                with metrics.stage("category_mapping"):
+                    detections = session.detections(classifier, first_frame, scores, threshold_scale)
+        else:
+            if not active:
+                return []
+            audio = waveform
+            locating = _locate(pair)
+            detections = await _triage(audio, threshold_scale)
+            if detections is None:
+                with metrics.stage("inference"):
+                    scores = await workers.with_timeout(
+                        scheduler.score(audio), workers.inference_timeout_s,
+                    )
+                with metrics.stage("category_mapping"):
+                    detections = classifier.detect_all(scores, threshold_scale)
+
+        correlations = await locating if locating is not None and detections else None
+        if correlations is not None:
+            with metrics.stage("direction"):
+                annotate(
+                    detections, correlations, classifier.categories,
+                    None if scores is None else classifier.frame_category_scores(scores),
+                )
+        if recent is not None and detections:
+            recent.add(audio, None if scores is None else classifier.category_scores(scores), detections)
+        return detections
+    except asyncio.TimeoutError:
+        await _send_error(ws, "timeout", "Audio chunk took too long to process and was dropped.")
+        return None
+    except ConnectionError as exc:
+        # Inference server restarting; the client keeps streaming
+        await _send_error(ws, "unavailable", str(exc))
+        return None
+    except StreamDecodeError as exc:
+        if session is not None:
+            session.gap()
+        await _send_error(ws, "stream_decode_failed", str(exc))
+        return None
+    finally:
+        if locating is not None and not locating.done():
+            locating.cancel()
+        workers.release()
+
+
+def _stream_decode(decoder: StreamDecoder, data: bytes) -> Callable[[], Awaitable]:
+    """The decode step for the next bytes of a connection's compressed stream."""
+    return lambda: workers.with_timeout(decoder.decode(data), workers.decode_timeout_s)
+
+
+def _locate(pair: np.ndarray | None) -> asyncio.Task | None:
+    """Start the direction correlations of a stereo pair in the decode pool, alongside inference."""
+    if pair is None:
+        return None
+
+    async def correlate() -> np.ndarray | None:
+        # A failure here only costs the direction, never the detections
+        try:
+            return await workers.offload(gcc_phat, pair)
+        except Exception as exc:
+            log.warning("Direction finding failed: %s", exc)
+            return None
+
+    return asyncio.create_task(correlate())
+
+
+async def _triage(waveform: np.ndarray, threshold_scale: float | np.ndarray) -> list[dict] | None:
+    """The student model's detections, or None when YAMNet has to score the audio."""
+    if classifier.cascade is None:
+        return None
+    with metrics.stage("student"):
+        return await workers.with_timeout(
+            workers.infer(classifier.triage, waveform, threshold_scale), workers.inference_timeout_s,
+        )
+
+
+async def _send_detections(
+    ws: WebSocket,
+    detections: list[dict],
+    processing_start: float,
+    transport: str,
+    sequence: int | None = None,
+    gated: bool = False,
+    device_id: str | None = None,
+) -> None:
+    processing_ms = round((time.time() - processing_start) * 1000, 1)
+
+    if detections:
+        response = {
+            "type": "detection",
+            "timestamp": int(time.time()),
+            "detections": detections,
+            "processing_time_ms": processing_ms,
+        }
+    else:
+        response = {
+            "type": "no_detection",
+            "timestamp": int(time.time()),
+            "detections": None,
+            "processing_time_ms": processing_ms,
+            "message": "No sounds detected above confidence threshold.",
+        }
+        if gated:
+            response["gated"] = True
+            response["message"] = "Nothing above background noise; inference skipped."
+    if sequence is not None:
+        response["sequence"] = sequence
+    with metrics.stage("send"):
+        await ws.send_json(response)
+    if detections:
+        _publish(device_id, response)
+
+    metrics.CHUNK_SECONDS.labels(transport).observe(processing_ms / 1000)
+    for detection in detections:
+        metrics.DETECTIONS.labels(detection["sound_type"]).inc()
+
+
+async def _send_events(
+    ws: WebSocket,
+    tracker: EventTracker,
+    detections: list[dict],
+    processing_start: float,
+    transport: str,
+    sequence: int | None = None,
+    device_id: str | None = None,
+) -> None:
+    """Send only the event changes a chunk causes — nothing while they persist."""
+    processing_ms = round((time.time() - processing_start) * 1000, 1)
+    for message in tracker.update(detections):
+        if message["type"] == "event_start":
+            message["processing_time_ms"] = processing_ms
+            if sequence is not None:
+                message["sequence"] = sequence
+        with metrics.stage("send"):
+            await ws.send_json(message)
+        _publish(device_id, message)
+    metrics.CHUNK_SECONDS.labels(transport).observe(processing_ms / 1000)
+
+
+def _publish(device_id: str | None, message: dict) -> None:
+    """Forward a message to the device's subscribers (see fanout.py)."""
+    if hub is not None and device_id is not None:
+        hub.publish(device_id, message)
+
+
+def _threshold_scale(profile: DeviceProfile | None, tracker: EventTracker | None) -> float | np.ndarray:
+    """Per-category threshold scales for a connection's next chunk."""
+    scale = tracker.threshold_scale if tracker else 1.0
+    return scale if profile is None else profile.threshold_scales * scale
+
+
+async def _apply_profile(
+    ws: WebSocket,
+    profile: DeviceProfile,
+    previous: DeviceProfile | None,
+    gate: ActivityGate | None,
+    tracker: EventTracker | None,
+    environment_override: str | None,
+) -> None:
+    """Point a connection's gate and event tracker at new settings; ask for a new cadence if it changed."""
+    if gate is not None:
+        gate.set_profile(environment_override or profile.environment_profile)
+    if tracker is not None:
+        tracker.category_scales = dict(zip(profiles.categories, profile.threshold_scales.tolist()))
+    if profile.chunk_interval_ms != (previous.chunk_interval_ms if previous else None):
+        await ws.send_json(profile.cadence())
+
+
+async def _read_socket(ws: WebSocket, inbox: ChunkInbox) -> None:
+    """
+    Move messages from the socket into the connection's inbox as they
+    arrive, so their age is known even while the handler is busy.
+    """
+    try:
+        while True:
+            message = await ws.receive()
+            if message["type"] == "websocket.disconnect":
+                inbox.close(WebSocketDisconnect(message.get("code", 1000)), discard=True)
+                return
+            received_at = time.monotonic()
+
+            if message.get("bytes") is not None:
+                try:
+                    inbox.put(Inbound(received_at, frame=parse_frame(message["bytes"])))
+                except FrameError as exc:
+                    inbox.put(Inbound(received_at, frame_error=str(exc)))
+                continue
+
+            with metrics.stage("json_parse"):
+                msg = json.loads(message["text"])
+            inbox.put(Inbound(received_at, msg=msg))
+    except Exception as exc:
+        inbox.close(exc)
+
+
 @app.websocket("/ws/audio")
 async def websocket_audio(ws: WebSocket, mock: bool = Query(False)):
     """
@@ -152,81 +526,307 @@ async def websocket_audio(ws: WebSocket, mock: bool = Query(False)):
       1. Client sends an auth message:  {"type": "auth", "device_id": "...", "api_version": "1.0"}
       2. Client sends audio chunks:     {"type": "audio_chunk", "audio_data": "<base64>", "sample_rate": 16000}
       3. Server responds with detections after each chunk.
+
+    Clients authenticating with api_version >= 2.0 may instead send each
+    chunk as a binary frame (see protocol.py); responses then echo the
+    frame's sequence number.
+
+    Clients authenticating with "events": true get event_start /
+    event_update / event_end messages instead of one response per chunk
+    (see events.py).
+
+    Chunks that went stale while the server was busy are dropped in favour
+    of newer ones, and the client is sent "throttle" messages meanwhile
+    (see shedding.py).
+
+    The device's stored settings apply from auth onwards and follow
+    updates without reconnecting: switched-off sounds are never reported,
+    the environment profile sets the gate and thresholds, and battery
+    saver sends a "cadence" message asking for longer chunks (see
+    device_settings.py).
+
+    Every detection carries a ``detection_id``; a {"type": "feedback",
+    "detection_id": ..., "correct": ...} message stores the clip it came
+    from for retraining (see feedback.py) and is answered with a
+    "feedback_ack".
+
+    Clients that authenticate with a "stream_format" ("aac", "ogg" or
+    "webm") may send one continuous compressed stream across their chunks,
+    decoded by one ffmpeg process per connection (see stream_decoder.py);
+    auth_ok echoes the format, or null if stream decoding isn't available.
+
+    Detections and event messages are also forwarded to the device's
+    subscribers on /ws/subscribe/{device_id}.
     """
     await ws.accept()
     device_id: Optional[str] = None
     use_mock = mock or classifier is None
+    mode_label = "mock" if use_mock else "live"
+    binary_mode = False
+    session = StreamingSession() if config.STREAMING_INFERENCE and not use_mock else None
+    gate = ActivityGate() if config.GATE_ENABLED and not use_mock else None
+    connection_id = new_connection_id()
+    if gate is not None:
+        active_gates[connection_id] = (device_id, gate)
+    recent = RecentDetections(connection_id)
+    recent_detections[connection_id] = recent
+    open_sockets = metrics.OPEN_SOCKETS.labels(mode_label)
+    open_sockets.inc()
+    inbox = ChunkInbox()
+    tracker: EventTracker | None = None
+    profile: DeviceProfile | None = None
+    environment_override: str | None = None
+    decoder: StreamDecoder | None = None
+    reader = asyncio.create_task(_read_socket(ws, inbox))
 
     try:
         while True:
-            raw = await ws.receive_text()
-            msg = json.loads(raw)
-
-            # --- Auth handshake ---
-            if msg.get("type") == "auth":
-                device_id = msg.get("device_id", "unknown")
-                mode_label = "mock" if use_mock else "live"
-                await ws.send_json({
-                    "type": "auth_ok",
-                    "message": f"Device {device_id} authenticated ({mode_label}).",
-                })
-                continue
+            notice = inbox.notice()
+            if notice is not None:
+                await ws.send_json(notice)
+            item = await inbox.get()
+            try:
+                if item.dropped_before and session is not None:
+                    session.gap(item.dropped_seconds)
+                if profile is not None:
+                    latest = profiles.current(device_id)
+                    if latest is not None and latest.revision != profile.revision:
+                        await _apply_profile(ws, latest, profile, gate, tracker, environment_override)
+                        profile = latest
 
-            # --- Audio chunk processing ---
-            if msg.get("type") == "audio_chunk":
-                processing_start = time.time()
-
-                if use_mock:
-                    # Mock path — random detections for frontend testing
-                    num_detections = random.randint(1, 3)
-                    detections = [_mock_detection() for _ in range(num_detections)]
-                else:
-                    # Real path — decode base64 audio and classify
-                    audio_b64 = msg.get("audio_data", "")
-                    sample_rate = msg.get("sample_rate", 16000)
+                # --- Binary audio frame (api_version >= 2.0) ---
+                if item.msg is None:
+                    if not binary_mode:
+                        await _send_error(
+                            ws, "binary_not_negotiated",
+                            "Binary audio frames require auth with api_version 2.0 or later",
+                        )
+                        continue
 
-                    try:
-                        audio_bytes = base64.b64decode(audio_b64)
-                        print(f"[server] Audio chunk: {len(audio_b64)} b64 chars → {len(audio_bytes)} bytes, header: {audio_bytes[:4].hex() if len(audio_bytes) >= 4 else 'too short'}")
-                    except Exception:
-                        await ws.send_json({
-                            "type": "error",
-                            "message": "Invalid base64 audio_data",
-                        })
+                    processing_start = time.time()
+                    metrics.CHUNKS.labels("binary", mode_label).inc()
+                    if item.frame_error is not None:
+                        await _send_error(ws, "invalid_frame", f"Invalid audio frame: {item.frame_error}")
+                        continue
+                    frame = item.frame
+                    if frame.encoded and decoder is None and not use_mock:
+                        await _send_error(
+                            ws, "stream_not_negotiated",
+                            "Stream frames require auth with a supported stream_format",
+                        )
                         continue
 
-                    result = classifier.classify(audio_bytes, sample_rate)
-                    detections = [result] if result else []
+                    if use_mock:
+                        detections = [_mock_detection() for _ in range(random.randint(1, 3))]
+                        recent.add(None, None, detections)
+                    else:
+                        decode = (
+                            _stream_decode(decoder, frame.samples.tobytes()) if frame.encoded
+                            else lambda: workers.decode_pcm(frame.samples, frame.sample_rate)
+                        )
+                        detections = await _classify_live(
+                            ws, decode, session, gate, _threshold_scale(profile, tracker), recent,
+                        )
+                        if detections is None:
+                            continue
 
-                processing_ms = round((time.time() - processing_start) * 1000, 1)
+                    if tracker is not None:
+                        await _send_events(
+                            ws, tracker, detections, processing_start, "binary", frame.sequence, device_id,
+                        )
+                    else:
+                        await _send_detections(
+                            ws, detections, processing_start, "binary", sequence=frame.sequence,
+                            gated=gate is not None and gate.last_skipped, device_id=device_id,
+                        )
+                    continue
 
-                if detections:
-                    await ws.send_json({
-                        "type": "detection",
-                        "timestamp": int(time.time()),
-                        "detections": detections,
-                        "processing_time_ms": processing_ms,
-                    })
-                else:
+                msg = item.msg
+
+                # --- Auth handshake ---
+                if msg.get("type") == "auth":
+                    device_id = msg.get("device_id", "unknown")
+                    recent.device_id = device_id
+                    binary_mode = supports_binary(msg.get("api_version"))
+                    tracker = EventTracker() if msg.get("events") else None
+                    environment_override = msg.get("environment_profile")
+                    if gate is not None:
+                        active_gates[connection_id] = (device_id, gate)
+                    if decoder is not None:
+                        await decoder.close()
+                        decoder = None
+                        active_decoders.pop(connection_id, None)
+                    stream_format = msg.get("stream_format")
+                    if stream_format and not use_mock:
+                        if StreamDecoder.available(stream_format):
+                            decoder = active_decoders[connection_id] = StreamDecoder(stream_format)
+                        else:
+                            log.info("Device %s: no %s stream decoder available", device_id, stream_format)
                     await ws.send_json({
-                        "type": "no_detection",
-                        "timestamp": int(time.time()),
-                        "detections": None,
-                        "processing_time_ms": processing_ms,
-                        "message": "No sounds detected above confidence threshold.",
+                        "type": "auth_ok",
+                        "message": f"Device {device_id} authenticated ({mode_label}).",
+                        "audio_transport": "binary" if binary_mode else "json",
+                        "events": tracker is not None,
+                        "stream_format": decoder.fmt if decoder is not None else None,
                     })
-                continue
+                    latest = await asyncio.to_thread(profiles.load, device_id)
+                    await _apply_profile(ws, latest, None, gate, tracker, environment_override)
+                    profile = latest
+                    continue
+
+                # --- Audio chunk processing ---
+                if msg.get("type") == "audio_chunk":
+                    processing_start = time.time()
+                    metrics.CHUNKS.labels("json", mode_label).inc()
 
-            # --- Unknown message type ---
-            await ws.send_json({
-                "type": "error",
-                "message": f"Unknown message type: {msg.get('type')}",
-            })
+                    if use_mock:
+                        # Mock path — random detections for frontend testing
+                        num_detections = random.randint(1, 3)
+                        detections = [_mock_detection() for _ in range(num_detections)]
+                        recent.add(None, None, detections)
+                    else:
+                        # Real path — decode base64 audio and classify
+                        audio_b64 = msg.get("audio_data", "")
+                        sample_rate = msg.get("sample_rate", 16000)
+                        if not valid_sample_rate(sample_rate):
+                            await _send_error(
+                                ws, "invalid_sample_rate",
+                                f"sample_rate must be {MIN_SAMPLE_RATE}–{MAX_SAMPLE_RATE} Hz",
+                            )
+                            continue
+
+                        try:
+                            with metrics.stage("base64_decode"):
+                                audio_bytes = base64.b64decode(audio_b64)
+                        except Exception:
+                            await _send_error(ws, "invalid_audio_data", "Invalid base64 audio_data")
+                            continue
+                        log.debug(
+                            "Audio chunk: %d b64 chars → %d bytes, header: %s",
+                            len(audio_b64), len(audio_bytes), audio_bytes[:4].hex(),
+                        )
+
+                        decode = (
+                            _stream_decode(decoder, audio_bytes) if decoder is not None
+                            else lambda: workers.decode(audio_bytes, sample_rate)
+                        )
+                        detections = await _classify_live(
+                            ws, decode, session, gate, _threshold_scale(profile, tracker), recent,
+                        )
+                        if detections is None:
+                            continue
+
+                    if tracker is not None:
+                        await _send_events(
+                            ws, tracker, detections, processing_start, "json", msg.get("sequence"), device_id,
+                        )
+                    else:
+                        await _send_detections(
+                            ws, detections, processing_start, "json", sequence=msg.get("sequence"),
+                            gated=gate is not None and gate.last_skipped, device_id=device_id,
+                        )
+                    continue
+
+                # --- Feedback on a detection of this connection ---
+                if msg.get("type") == "feedback":
+                    try:
+                        feedback = FeedbackRequest(**{k: v for k, v in msg.items() if k != "type"})
+                    except ValueError as exc:
+                        await _send_error(ws, "invalid_feedback", str(exc))
+                        continue
+                    result = _store_feedback(feedback)
+                    if result is None:
+                        await _send_error(ws, "unknown_detection", f"No recent detection {feedback.detection_id}")
+                    else:
+                        await ws.send_json({"type": "feedback_ack", **result})
+                    continue
+
+                # --- Unknown message type ---
+                await _send_error(ws, "unknown_type", f"Unknown message type: {msg.get('type')}")
+            finally:
+                if item.is_audio:
+                    # Failed chunks count towards queue age and load too
+                    inbox.done(item)
 
     except WebSocketDisconnect:
-        print(f"Device {device_id} disconnected.")
+        if gate is not None and gate.chunks:
+            log.info(
+                "Device %s disconnected — gate skipped %d/%d chunks (%s profile).",
+                device_id, gate.skipped, gate.chunks, gate.profile,
+            )
+        else:
+            log.info("Device %s disconnected.", device_id)
+        if inbox.dropped:
+            log.info(
+                "Device %s: dropped %d/%d stale chunks.",
+                device_id, sum(inbox.dropped.values()), inbox.received,
+            )
     except json.JSONDecodeError:
-        await ws.send_json({"type": "error", "message": "Invalid JSON"})
+        await _send_error(ws, "invalid_json", "Invalid JSON")
+    finally:
+        reader.cancel()
+        open_sockets.dec()
+        active_gates.pop(connection_id, None)
+        recent_detections.pop(connection_id, None)
+        active_decoders.pop(connection_id, None)
+        if decoder is not None:
+            await decoder.close()
+
+
+async def _watch_subscriber(ws: WebSocket, subscription: Subscription) -> None:
+    """End a subscription when its client disconnects; anything it sends is ignored."""
+    try:
+        while (await ws.receive())["type"] != "websocket.disconnect":
+            pass
+    finally:
+        subscription.end()
+
+
+@app.websocket("/ws/subscribe/{device_id}")
+async def websocket_subscribe(ws: WebSocket, device_id: str):
+    """
+    Follow another device's live alerts (caregivers, companions, dashboards).
+
+    The first message must be {"type": "auth", "token": FANOUT_TOKEN},
+    sent within FANOUT_AUTH_TIMEOUT_S; the token never goes in the URL,
+    which access logs record.  Without a configured token, or with a wrong
+    one, the socket is closed with code 1008.
+
+    After a {"type": "subscribed"} message, every "detection" and
+    event_start / event_update / event_end message sent to ``device_id``'s
+    connections is forwarded here, with "device_id" added, whichever
+    worker serves that device.  A subscriber that falls FANOUT_QUEUE_SIZE
+    messages behind is closed with code 1013 and may reconnect.
+    """
+    if hub is None:
+        await ws.close(code=1008)
+        return
+    await ws.accept()
+    try:
+        msg = await asyncio.wait_for(ws.receive_json(), config.FANOUT_AUTH_TIMEOUT_S)
+    except WebSocketDisconnect:
+        return
+    except (asyncio.TimeoutError, ValueError, KeyError):
+        msg = None      # too slow, not JSON, or a binary frame
+    token = msg.get("token") if isinstance(msg, dict) and msg.get("type") == "auth" else None
+    if not isinstance(token, str) or not hmac.compare_digest(token.encode(), config.FANOUT_TOKEN.encode()):
+        await ws.close(code=1008, reason="Invalid token")
+        return
+    subscription = hub.subscribe(device_id)
+    watcher = asyncio.create_task(_watch_subscriber(ws, subscription))
+    try:
+        await ws.send_json({"type": "subscribed", "device_id": device_id})
+        while (data := await subscription.get()) is not None:
+            await ws.send_text(data)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        watcher.cancel()
+        if hub is not None:
+            hub.unsubscribe(subscription)
+    if subscription.dropped:
+        log.info("Subscriber of device %s fell behind; closing.", device_id)
+        await ws.close(code=1013, reason="Subscriber too slow")
 
 
 # ---------------------------------------------------------------------------
@@ -239,6 +839,154 @@ async def health():
     return {"status": "ok", "version": "0.1.0"}
 
 
+# -- Readiness (model loaded and warmed up) --
+@app.get("/ready")
+async def ready():
+    """
+    Readiness probe, distinct from /health: 200 only when YAMNet is loaded
+    and warmed up, 503 when the server fell back to mock mode.
+    """
+    if classifier is None:
+        return JSONResponse(
+            status_code=503,
+            content={"ready": False, "mode": "mock", "error": model_error},
+        )
+    artifact = classifier.artifact
+    return {
+        "ready": True,
+        "mode": "live",
+        "backend": classifier.backend.name,
+        "model_source": artifact.source,
+        "model_location": artifact.location,
+        "model_sha256": artifact.checksum,
+        "load_ms": round(artifact.load_ms, 1),
+        "warmup_ms": round(classifier.warmup_ms, 1) if classifier.warmup_ms is not None else None,
+    }
+
+
+# -- Inference batching / worker pool stats --
+@app.get("/api/v1/inference/stats")
+async def inference_stats():
+    """
+    Achieved micro-batch sizes, inference timing and pool load (live mode
+    only).  Per-connection figures are those of the worker that answers,
+    named by ``worker`` (its pid); /metrics covers all workers.
+    """
+    if scheduler is None:
+        return {
+            "mode": "mock", "worker": os.getpid(), "scheduler": None, "workers": None, "model": None, "gate": None, "cascade": None,
+            "fanout": hub.stats() if hub is not None else None,
+        }
+    return {
+        "mode": "live",
+        "worker": os.getpid(),
+        "scheduler": scheduler.stats(),
+        "inference_servers": await scheduler.server_stats() if isinstance(scheduler, RemoteInference) else None,
+        "workers": workers.stats(),
+        "model": classifier.trace_stats(),
+        "gate": {
+            "enabled": config.GATE_ENABLED,
+            "by_profile": gate_stats.snapshot(),
+            "sessions": [
+                {"device_id": device, **gate.stats()} for device, gate in active_gates.values()
+            ],
+        },
+        "cascade": classifier.cascade.stats() if classifier.cascade is not None else None,
+        "stream_decoders": {
+            "running": StreamDecoder.running,
+            "max": config.STREAM_DECODERS_MAX,
+            "sessions": [decoder.stats() for decoder in active_decoders.values()],
+        },
+        "fanout": hub.stats() if hub is not None else None,
+    }
+
+
+# -- Offline classification of long recordings --
+# Recordings being classified by this worker, at most OFFLINE_MAX_JOBS
+_offline_jobs = 0
+
+
+def _release_offline_job() -> None:
+    global _offline_jobs
+    _offline_jobs -= 1
+
+
+class _DuplexResponse(StreamingResponse):
+    """
+    StreamingResponse that lets its body generator read the request body.
+
+    The stock one consumes ``receive`` itself to watch for disconnects, which
+    would swallow the upload; here a disconnect surfaces in the generator
+    as ClientDisconnect instead.
+    """
+
+    async def __call__(self, scope, receive, send) -> None:
+        try:
+            await self.stream_response(send)
+        finally:
+            if self.background is not None:
+                await self.background()
+
+
+@app.post("/api/v1/recordings/classify")
+async def classify_recording(
+    request: Request,
+    sample_rate: int = Query(
+        16000, ge=MIN_SAMPLE_RATE, le=MAX_SAMPLE_RATE, description="Sample rate of headerless int16 PCM bodies",
+    ),
+    segment_frames: int = Query(config.OFFLINE_SEGMENT_FRAMES, ge=1, le=128),
+):
+    """
+    Classify a whole recording sent as the request body (any format the
+    live path decodes) and stream back an NDJSON timeline of per-segment
+    category scores (see offline.py).
+    """
+    global _offline_jobs
+    if classifier is None:
+        return JSONResponse(status_code=503, content={"error": "Model not loaded (mock mode)"})
+    # Reserve the slot here: the body only starts after the handler has returned
+    if _offline_jobs >= config.OFFLINE_MAX_JOBS:
+        return JSONResponse(
+            status_code=429,
+            content={"error": f"{config.OFFLINE_MAX_JOBS} recordings are already being classified"},
+        )
+    _offline_jobs += 1
+
+    async def lines():
+        try:
+            async for line in offline.timeline(
+                request.stream(), classifier, lambda waveform: scheduler.score(waveform, background=True),
+                sample_rate, segment_frames,
+            ):
+                yield json.dumps(line, separators=(",", ":")) + "\n"
+        except ClientDisconnect:
+            log.info("Client went away during offline classification")
+        except (offline.UnsupportedAudio, ConnectionError) as exc:
+            metrics.ERRORS.labels("offline_failed").inc()
+            yield json.dumps({"type": "error", "message": str(exc)}) + "\n"
+        except Exception as exc:
+            # Inference errors and timeouts still end the body with an error line
+            log.exception("Offline classification failed")
+            metrics.ERRORS.labels("offline_failed").inc()
+            yield json.dumps({"type": "error", "message": f"Classification failed: {exc!r}"}) + "\n"
+
+    # Released once the response is over, even if the body never started
+    return _DuplexResponse(
+        lines(), media_type="application/x-ndjson", background=BackgroundTask(_release_offline_job),
+    )
+
+
+# -- Prometheus metrics --
+@app.get("/metrics")
+async def prometheus_metrics():
+    """
+    Per-stage latency histograms, counters and gauges in Prometheus text
+    format, summed over all workers when METRICS_DIR is set.
+    """
+    _update_load_gauges()
+    return Response(metrics.render(config.METRICS_DIR), media_type=metrics.CONTENT_TYPE)
+
+
 # -- Feedback --
 class FeedbackRequest(BaseModel):
     detection_id: str
@@ -247,20 +995,64 @@ class FeedbackRequest(BaseModel):
     comment: Optional[str] = None
 
 
-@app.post("/api/v1/feedback")
-async def submit_feedback(feedback: FeedbackRequest):
-    """Accept user feedback on a detection (stubbed)."""
+def _store_feedback(feedback: FeedbackRequest) -> dict | None:
+    """Queue the clip behind a detection for the feedback log; None if the detection isn't known here."""
+    recent = recent_detections.get(connection_of(feedback.detection_id))
+    found = recent.find(feedback.detection_id) if recent is not None else None
+    if found is None:
+        metrics.FEEDBACK.labels("unknown").inc()
+        return None
+    clip, detection = found
+    if clip.audio is None or feedback_writer is None:
+        return {
+            "status": "received",
+            "detection_id": feedback.detection_id,
+            "stored": False,
+            "message": "Feedback received; no audio is kept in mock mode.",
+        }
+    stored = feedback_writer.submit(FeedbackEntry(
+        detection_id=feedback.detection_id,
+        device_id=recent.device_id,
+        audio=clip.audio,
+        scores=clip.scores,
+        predicted=detection["sound_type"],
+        confidence=detection["confidence"],
+        correct=feedback.correct,
+        actual_sound=feedback.actual_sound,
+        comment=feedback.comment,
+        created=time.time(),
+    ))
     return {
         "status": "received",
         "detection_id": feedback.detection_id,
-        "message": "Feedback recorded (mock). Thank you!",
+        "stored": stored,
+        "message": "Feedback recorded. Thank you!" if stored else "Feedback received, but the server is too busy to store it.",
     }
 
 
-# -- Settings --
-MOCK_SETTINGS: dict = {}
+@app.post("/api/v1/feedback")
+async def submit_feedback(feedback: FeedbackRequest):
+    """
+    Accept user feedback on a detection and keep its labelled clip.
+
+    Detections of open connections from the last FEEDBACK_BUFFER_S are
+    known.  One issued by another worker is relayed to it (see
+    FeedbackRelay in feedback.py).
+    """
+    if feedback_relay is not None:
+        result = await feedback_relay.submit(feedback.model_dump())
+    else:
+        result = _store_feedback(feedback)
+    if result is None:
+        return JSONResponse(status_code=404, content={
+            "status": "unknown_detection",
+            "detection_id": feedback.detection_id,
+            "message": "Detection not found: too old, or its connection is closed.",
+        })
+    return result
 
 
+# -- Settings --
 class SettingsPayload(BaseModel):
     haptic_intensity: int = 5
     environment_profile: str = "urban"
@@ -270,17 +1062,18 @@ class SettingsPayload(BaseModel):
 
 @app.get("/api/v1/settings/{device_id}")
 async def get_settings(device_id: str):
-    """Retrieve settings for a device (stubbed)."""
-    settings = MOCK_SETTINGS.get(device_id, SettingsPayload().model_dump())
-    return {"device_id": device_id, "settings": settings}
+    """Retrieve settings for a device (defaults if it never stored any)."""
+    profile = await asyncio.to_thread(profiles.load, device_id)
+    return {"device_id": device_id, "settings": profile.settings, "revision": profile.revision}
 
 
 @app.put("/api/v1/settings/{device_id}")
 async def update_settings(device_id: str, payload: SettingsPayload):
-    """Update settings for a device (stubbed)."""
-    MOCK_SETTINGS[device_id] = payload.model_dump()
+    """Store settings for a device; its open connections pick them up without reconnecting."""
+    profile = await asyncio.to_thread(profiles.update, device_id, payload.model_dump())
     return {
         "device_id": device_id,
-        "settings": payload.model_dump(),
-        "message": "Settings updated (mock).",
+        "settings": profile.settings,
+        "revision": profile.revision,
+        "message": "Settings updated.",
     }
@@ -0,0 +1,378 @@
+"""
+Shadow-Sound — Metrics
+
+Counters, gauges and histograms for the audio hot path, rendered in the
+Prometheus text exposition format by GET /metrics.  Deliberately tiny (no
+prometheus_client dependency): a labelled child is looked up once per
+observation and updated under its own lock.
+
+Each audio chunk is timed per stage:
+
+    json_parse        json.loads of a text message
+    base64_decode     audio_data → bytes
+    audio_decode      container decoding (excluding resampling)
+    resample          polyphase resampling to 16 kHz
+    gate              activity gate deciding whether to run YAMNet
+    inference         wait for the micro-batch scheduler to return scores
+    category_mapping  frame scores → app detections
+    send              writing the response to the socket
+
+Each uvicorn worker has its own copy of every metric.  When METRICS_DIR is
+set (launch.py does), every worker writes a snapshot of them to
+METRICS_DIR/metrics-<pid>.json every SNAPSHOT_S, and GET /metrics on any
+worker renders the sum over all snapshots, so a scrape does not depend on
+which worker accepts it.  Counters and histograms of workers that have
+exited are kept, so the totals never go down; their gauges are dropped.
+"""
+
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+AGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 1.5, 2.0, 2.5, 3.0, 5.0, 10.0, 30.0)
+
+SNAPSHOT_S = 1.0    # how often a worker writes its snapshot to METRICS_DIR
+
+_REGISTRY: list["_Metric"] = []
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _label_text(names: tuple[str, ...], values: tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+# ── Metric types ──────────────────────────────────────────────────────────
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        _REGISTRY.append(self)
+
+    def labels(self, *values):
+        """The child for one combination of label values."""
+        key = tuple(str(v) for v in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self, children: dict | None = None) -> list[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, child in sorted((self._children if children is None else children).items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key: tuple[str, ...], child) -> list[str]:
+        return [f"{self.name}{_label_text(self.labelnames, key)} {_format_value(child.value)}"]
+
+    def _dump(self, child):
+        return child.value
+
+    def _merge(self, child, data) -> None:
+        child.inc(data)
+
+
+class _Value:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self) -> None:
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value -= amount
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def _new_child(self) -> _Value:
+        return _Value()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.labels().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.labels().dec(amount)
+
+    def set(self, value: float) -> None:
+        self.labels().set(value)
+
+
+class _Timer:
+    __slots__ = ("_histogram", "_started")
+
+    def __init__(self, histogram: "_HistogramValue") -> None:
+        self._histogram = histogram
+
+    def __enter__(self) -> "_Timer":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *_exc) -> None:
+        self._histogram.observe(time.perf_counter() - self._started)
+
+
+class _HistogramValue:
+    __slots__ = ("bounds", "counts", "sum", "count", "_lock")
+
+    def __init__(self, bounds: tuple[float, ...]) -> None:
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)   # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.sum += value
+            self.count += 1
+
+    def time(self) -> _Timer:
+        """Context manager observing the elapsed wall time in seconds."""
+        return _Timer(self)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: tuple[str, ...] = (),
+        buckets: tuple[float, ...] = LATENCY_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramValue:
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self.labels().observe(value)
+
+    def _dump(self, child: _HistogramValue):
+        with child._lock:
+            return [list(child.counts), child.sum, child.count]
+
+    def _merge(self, child: _HistogramValue, data) -> None:
+        counts, total, count = data
+        if len(counts) != len(child.counts):
+            return
+        child.counts = [a + b for a, b in zip(child.counts, counts)]
+        child.sum += total
+        child.count += count
+
+    def _render_child(self, key: tuple[str, ...], child: _HistogramValue) -> list[str]:
+        with child._lock:
+            counts, total, count = list(child.counts), child.sum, child.count
+        lines = []
+        cumulative = 0
+        for bound, n in zip(self.buckets + (float("inf"),), counts):
+            cumulative += n
+            labels = _label_text(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        plain = _label_text(self.labelnames, key)
+        lines.append(f"{self.name}_sum{plain} {_format_value(total)}")
+        lines.append(f"{self.name}_count{plain} {count}")
+        return lines
+
+
+def render(directory: str = "") -> str:
+    """Every registered metric in Prometheus text format, summed over the workers sharing ``directory``."""
+    if not directory:
+        lines: list[str] = []
+        for metric in _REGISTRY:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+    write_snapshot(directory)   # our own share is then as fresh as possible
+    merged: dict[str, dict] = {metric.name: {} for metric in _REGISTRY}
+    by_name = {metric.name: metric for metric in _REGISTRY}
+    for pid, snapshot in _read_snapshots(directory):
+        alive = _alive(pid)
+        for name, children in snapshot.items():
+            metric = by_name.get(name)
+            if metric is None or (metric.kind == "gauge" and not alive):
+                continue
+            for labels, data in children:
+                key = tuple(labels)
+                child = merged[name].get(key)
+                if child is None:
+                    child = merged[name][key] = metric._new_child()
+                metric._merge(child, data)
+    lines = []
+    for metric in _REGISTRY:
+        lines.extend(metric.render(merged[metric.name]))
+    return "\n".join(lines) + "\n"
+
+
+# ── Aggregation across workers ────────────────────────────────────────────
+
+def write_snapshot(directory: str) -> None:
+    """Write this process's metrics to ``directory`` (atomically, replacing its last snapshot)."""
+    snapshot = {
+        metric.name: [[list(key), metric._dump(child)] for key, child in list(metric._children.items())]
+        for metric in _REGISTRY
+    }
+    path = os.path.join(directory, f"metrics-{os.getpid()}.json")
+    try:
+        os.makedirs(directory, exist_ok=True)
+        with open(path + ".tmp", "w") as f:
+            json.dump(snapshot, f, separators=(",", ":"))
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass    # the scrape shows what the other snapshots hold
+
+
+def _read_snapshots(directory: str) -> list[tuple[int, dict]]:
+    snapshots = []
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return snapshots
+    for name in names:
+        if not (name.startswith("metrics-") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(directory, name)) as f:
+                snapshots.append((int(name[len("metrics-"):-len(".json")]), json.load(f)))
+        except (OSError, ValueError):
+            continue
+    return snapshots
+
+
+def _alive(pid: int) -> bool:
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+# ── Shadow-Sound metrics ──────────────────────────────────────────────────
+
+STAGE_SECONDS = Histogram(
+    "shadowsound_stage_seconds", "Time spent in each hot-path stage of an audio chunk.", ("stage",),
+)
+CHUNK_SECONDS = Histogram(
+    "shadowsound_chunk_seconds", "Receive-to-response latency of an audio chunk.", ("transport",),
+)
+BATCH_SECONDS = Histogram(
+    "shadowsound_inference_batch_seconds", "Duration of one batched YAMNet call.",
+)
+BATCH_SIZE = Histogram(
+    "shadowsound_inference_batch_size", "Waveforms scored per YAMNet call.",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+
+CHUNK_QUEUE_SECONDS = Histogram(
+    "shadowsound_chunk_queue_seconds", "Time an audio chunk waited in its connection's inbox.", ("transport",),
+)
+CHUNK_AGE_SECONDS = Histogram(
+    "shadowsound_chunk_age_seconds",
+    "End-to-end age of an audio chunk when its response was sent (from capture when the client sends it).",
+    ("transport",),
+    buckets=AGE_BUCKETS,
+)
+
+CHUNKS = Counter("shadowsound_chunks_total", "Audio chunks received.", ("transport", "mode"))
+DETECTIONS = Counter("shadowsound_detections_total", "Detections sent to clients.", ("sound_type",))
+EVENTS = Counter("shadowsound_events_total", "Sound event messages sent to clients (start, update, resume, end).", ("sound_type", "kind"))
+DECODES = Counter("shadowsound_decodes_total", "Decoded payloads by sniffed format.", ("format", "outcome"))
+GATE_CHUNKS = Counter(
+    "shadowsound_gate_chunks_total", "Chunks passed to or skipped by the activity gate.", ("profile", "decision"),
+)
+CHUNKS_DROPPED = Counter(
+    "shadowsound_chunks_dropped_total", "Audio chunks dropped unprocessed.", ("transport", "reason"),
+)
+THROTTLES = Counter("shadowsound_throttle_messages_total", "Throttle messages sent to clients.", ("action",))
+ERRORS = Counter("shadowsound_errors_total", "Error messages sent to clients.", ("code",))
+CASCADE_DECISIONS = Counter(
+    "shadowsound_cascade_decisions_total",
+    "Chunks answered by the student model, or escalated to YAMNet and why.", ("outcome",),
+)
+
+FEEDBACK = Counter(
+    "shadowsound_feedback_total",
+    "User feedback on detections: stored, dropped (writer queue full), failed or unknown detection.",
+    ("outcome",),
+)
+FANOUT_MESSAGES = Counter(
+    "shadowsound_fanout_messages_total",
+    "Subscriber fan-out: messages delivered or forwarded to other workers, subscription announcements (control), slow subscribers dropped, failed forwards.",
+    ("outcome",),
+)
+OFFLINE_AUDIO_SECONDS = Counter(
+    "shadowsound_offline_audio_seconds_total", "Seconds of recordings classified offline.",
+)
+
+OPEN_SOCKETS = Gauge("shadowsound_open_sockets", "Open /ws/audio connections.", ("mode",))
+QUEUE_DEPTH = Gauge("shadowsound_inference_queue_depth", "Waveforms waiting for the next batch.")
+PENDING_CHUNKS = Gauge("shadowsound_pending_chunks", "Chunks admitted to the worker pools and not yet finished.")
+STREAM_DECODERS = Gauge("shadowsound_stream_decoders", "Per-connection stream decoders holding a slot (at most one ffmpeg process each).")
+FANOUT_SUBSCRIBERS = Gauge("shadowsound_fanout_subscribers", "Open /ws/subscribe connections.")
+
+
+def stage(name: str) -> _Timer:
+    """``with metrics.stage("send"): ...`` — time one hot-path stage."""
+    return STAGE_SECONDS.labels(name).time()
@@ -0,0 +1,211 @@
+"""
+Shadow-Sound — YAMNet model artifacts
+
+Loads a pinned YAMNet SavedModel from a local directory so server start-up
+no longer depends on reaching tfhub.dev.  The directory's contents are
+hashed and checked against YAMNET_MODEL_SHA256 before the model is used.
+The digest is committed (the Dockerfile's build argument), never taken
+from the download: fetch refuses an artifact that does not match it, so
+a changed or corrupted upstream model fails the build.  Falling back to
+TensorFlow Hub (and its TFHUB_CACHE_DIR cache) only happens when
+YAMNET_HUB_FALLBACK is enabled.
+
+Fetch the artifact once, e.g. at image build time:
+
+    python model_store.py fetch [--dest model/yamnet] [--sha256 <digest>]
+
+To pin a new model version, fetch it into a scratch directory with the
+hub fallback, review it, and commit what ``verify --path`` prints.
+"""
+
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import time
+from dataclasses import dataclass
+from typing import Any
+
+import config
+from log import get_logger
+
+log = get_logger("model")
+
+CHECKSUM_FILE = "shadowsound.sha256"   # left by older fetches; not part of the digest
+EXPORT_CHECKSUMS = "SHA256SUMS"     # sha256sum-style list next to exported models
+
+
+class ModelArtifactError(RuntimeError):
+    """Raised when no usable YAMNet artifact can be loaded."""
+
+
+@dataclass
+class ModelArtifact:
+    model: Any
+    source: str              # "local", "hub", "tflite" or "onnx"
+    location: str            # directory, file or hub URL
+    checksum: str | None
+    load_ms: float
+
+
+def directory_checksum(path: str) -> str:
+    """SHA-256 over every file's relative path and contents, in sorted order."""
+    digest = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            if name == CHECKSUM_FILE:
+                continue
+            full = os.path.join(root, name)
+            digest.update(os.path.relpath(full, path).replace(os.sep, "/").encode("utf-8"))
+            digest.update(b"\0")
+            with open(full, "rb") as f:
+                for block in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(block)
+    return digest.hexdigest()
+
+
+def file_checksum(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def record_exported(paths: list[str]) -> None:
+    """Write SHA256SUMS for exported model files (all in the same directory)."""
+    if not paths:
+        return
+    directory = os.path.dirname(paths[0])
+    with open(os.path.join(directory, EXPORT_CHECKSUMS), "w") as f:
+        for path in sorted(paths):
+            f.write(f"{file_checksum(path)}  {os.path.basename(path)}\n")
+
+
+def verify_exported(path: str) -> str:
+    """Check an exported model file against its directory's SHA256SUMS."""
+    sums_path = os.path.join(os.path.dirname(path), EXPORT_CHECKSUMS)
+    expected = None
+    if os.path.isfile(sums_path):
+        with open(sums_path) as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 2 and parts[1] == os.path.basename(path):
+                    expected = parts[0].lower()
+    if expected is None:
+        raise ModelArtifactError(f"{path} is not listed in {sums_path} — re-run `export_model.py export`")
+    checksum = file_checksum(path)
+    if checksum != expected:
+        raise ModelArtifactError(f"Checksum mismatch for {path}: expected {expected}, got {checksum}")
+    return checksum
+
+
+def _expected_checksum() -> str | None:
+    return config.YAMNET_MODEL_SHA256.lower() or None
+
+
+def _load_local(path: str) -> ModelArtifact:
+    import tensorflow as tf
+
+    started = time.perf_counter()
+    checksum = directory_checksum(path)
+    expected = _expected_checksum()
+    if expected is None:
+        raise ModelArtifactError(f"No checksum to verify {path} against — set YAMNET_MODEL_SHA256")
+    if checksum != expected:
+        raise ModelArtifactError(f"Checksum mismatch for {path}: expected {expected}, got {checksum}")
+
+    model = tf.saved_model.load(path)
+    return ModelArtifact(model, "local", path, checksum, (time.perf_counter() - started) * 1000)
+
+
+def _load_hub() -> ModelArtifact:
+    import tensorflow_hub as hub
+
+    started = time.perf_counter()
+    model = hub.load(config.YAMNET_HUB_URL)
+    return ModelArtifact(model, "hub", config.YAMNET_HUB_URL, None, (time.perf_counter() - started) * 1000)
+
+
+def load_yamnet() -> ModelArtifact:
+    """Load the pinned local artifact, falling back to the hub only if configured."""
+    path = config.YAMNET_MODEL_DIR
+    if os.path.isfile(os.path.join(path, "saved_model.pb")):
+        try:
+            artifact = _load_local(path)
+            log.info("YAMNet loaded from %s in %.0f ms (sha256 %s…)", path, artifact.load_ms, artifact.checksum[:12])
+            return artifact
+        except ModelArtifactError as exc:
+            if not config.YAMNET_HUB_FALLBACK:
+                raise
+            log.warning("%s", exc)
+    elif not config.YAMNET_HUB_FALLBACK:
+        raise ModelArtifactError(
+            f"No YAMNet SavedModel at {path} and YAMNET_HUB_FALLBACK is off — run `python model_store.py fetch`"
+        )
+
+    log.info("Loading YAMNet from TensorFlow Hub (%s) …", config.YAMNET_HUB_URL)
+    artifact = _load_hub()
+    log.info("YAMNet loaded from hub in %.0f ms", artifact.load_ms)
+    return artifact
+
+
+def fetch(dest: str = config.YAMNET_MODEL_DIR, expected: str | None = None) -> str:
+    """Download YAMNet from the hub into ``dest``, only if it matches the pinned checksum."""
+    import tensorflow_hub as hub
+
+    expected = (expected or "").lower() or _expected_checksum()
+    if expected is None:
+        raise ModelArtifactError(
+            "No pinned checksum for YAMNet — set YAMNET_MODEL_SHA256 (or pass --sha256) to the committed digest"
+        )
+    source = hub.resolve(config.YAMNET_HUB_URL)
+    checksum = directory_checksum(source)
+    if checksum != expected:
+        raise ModelArtifactError(
+            f"{config.YAMNET_HUB_URL} does not match the pinned checksum: expected {expected}, got {checksum}"
+        )
+
+    if os.path.exists(dest):
+        shutil.rmtree(dest)
+    shutil.copytree(source, dest)
+    return checksum
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Manage the local YAMNet model artifact.")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fetch_cmd = sub.add_parser("fetch", help="download YAMNet and check it against the pinned checksum")
+    fetch_cmd.add_argument("--dest", default=config.YAMNET_MODEL_DIR)
+    fetch_cmd.add_argument("--sha256", default=None, help="expected digest (default: YAMNET_MODEL_SHA256)")
+
+    verify_cmd = sub.add_parser("verify", help="print and check a local artifact's checksum")
+    verify_cmd.add_argument("--path", default=config.YAMNET_MODEL_DIR)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "fetch":
+        try:
+            checksum = fetch(args.dest, args.sha256)
+        except ModelArtifactError as exc:
+            print(exc, file=sys.stderr)
+            return 1
+        print(f"YAMNet saved → {args.dest}\nsha256 {checksum}")
+        return 0
+
+    checksum = directory_checksum(args.path)
+    expected = _expected_checksum()
+    print(f"sha256 {checksum}")
+    if expected is None:
+        print("not pinned — YAMNET_MODEL_SHA256 is unset")
+    elif expected != checksum:
+        print(f"MISMATCH — expected {expected}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,366 @@
+"""
+Shadow-Sound — Offline classification of long recordings
+
+POST /api/v1/recordings/classify takes a whole recording (minutes to hours)
+as the request body and streams back an NDJSON timeline while the upload
+is still arriving:
+
+    {"type": "start", "categories": [...], "frame_hop_s": 0.48, "segment_s": 0.96}
+    {"type": "segment", "start_s": 0.0, "end_s": 0.96, "scores": [...], "detections": [...]}
+    …
+    {"type": "end", "duration_s": 3600.2, "segments": 3750, "elapsed_s": 41.3, "realtime_factor": 87.2}
+
+``scores`` follows the order of ``categories``; scores and ``detections``
+come from SoundClassifier.category_scores() / detect_all() on the segment's
+frames, so they match what the live path reports for the same audio.
+
+Memory stays bounded whatever the length: the body is decoded as it
+arrives (WAV and headerless PCM in-process, everything else through an
+ffmpeg pipe), audio is scored in blocks of OFFLINE_BLOCK_FRAMES frames, and
+each timeline line is sent as soon as its frames are scored.  M4A and CAF
+may keep their index at the end, so they are spooled to OFFLINE_SPOOL_DIR
+(at most OFFLINE_SPOOL_MAX_MB) before ffmpeg reads them.
+
+Blocks are scored as background work: live chunks always go first, so a
+long recording can't delay anyone's alerts by more than one block.
+"""
+
+import asyncio
+import os
+import shutil
+import tempfile
+import time
+from typing import AsyncIterator, Awaitable, Callable
+
+import numpy as np
+
+import config
+import metrics
+from classifier import SoundClassifier
+from decoding import (
+    MAX_SAMPLE_RATE, MIN_SAMPLE_RATE, PATCH_HOP_SAMPLES, TARGET_SR, StreamResampler, _to_mono_float,
+    parse_wav_header, sniff_format, valid_sample_rate,
+)
+from log import get_logger
+from streaming import FRAME_HOP_S, StreamingSession
+
+log = get_logger("offline")
+
+# Bytes read before choosing a decoder (enough for any ordinary WAV header)
+SNIFF_BYTES = 64 * 1024
+MAX_HEADER_BYTES = 1024 * 1024
+PIPE_READ_BYTES = 256 * 1024
+STDERR_TAIL_BYTES = 4096
+
+# Containers ffmpeg can't always decode from a pipe (the index may be at the end)
+_SEEKABLE_FORMATS = frozenset({"m4a", "caf"})
+
+
+Scorer = Callable[[np.ndarray], Awaitable[np.ndarray]]
+
+
+class UnsupportedAudio(ValueError):
+    """Raised when a recording can't be decoded."""
+
+
+# ── Incremental decoding ──────────────────────────────────────────────────
+
+class _PcmStream:
+    """Interleaved PCM → 16 kHz mono float32, block by block."""
+
+    def __init__(self, dtype: str, channels: int, rate: int) -> None:
+        self.dtype = np.dtype(dtype)
+        self.channels = channels
+        self.frame_bytes = self.dtype.itemsize * channels
+        self.resampler = StreamResampler(rate)
+        self._carry = b""
+
+    def push(self, data: bytes) -> np.ndarray:
+        data = self._carry + data
+        usable = len(data) - len(data) % self.frame_bytes
+        self._carry = data[usable:]
+        samples = np.frombuffer(data, dtype=self.dtype, count=usable // self.dtype.itemsize)
+        return self.resampler.push(_to_mono_float(samples.reshape(-1, self.channels)))
+
+    def flush(self) -> np.ndarray:
+        return self.resampler.flush()
+
+
+async def _read_head(chunks: AsyncIterator[bytes], size: int) -> bytes:
+    head = b""
+    async for chunk in chunks:
+        head += chunk
+        if len(head) >= size:
+            break
+    return head
+
+
+async def _prepend(head: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    yield head
+    async for chunk in chunks:
+        yield chunk
+
+
+async def _in_process(
+    stream: _PcmStream, head: bytes, chunks: AsyncIterator[bytes], limit: int | None,
+) -> AsyncIterator[np.ndarray]:
+    remaining = limit
+    async for data in _prepend(head, chunks):
+        if remaining is not None:
+            data = data[:remaining]
+            remaining -= len(data)
+        if data:
+            yield await asyncio.to_thread(stream.push, data)
+        if remaining == 0:
+            break
+    yield stream.flush()
+
+
+async def _stderr_tail(stream: asyncio.StreamReader) -> bytes:
+    """Read a subprocess's stderr to EOF, so it can never fill the pipe; return the end of it."""
+    tail = bytearray()
+    while data := await stream.read(STDERR_TAIL_BYTES):
+        tail += data
+        del tail[:-STDERR_TAIL_BYTES]
+    return bytes(tail)
+
+
+async def _spool(fmt: str, head: bytes, chunks: AsyncIterator[bytes], path: str) -> None:
+    """Write the whole body to ``path`` (on disk, not memory) so ffmpeg can seek to a trailing index."""
+    limit = config.OFFLINE_SPOOL_MAX_MB * 1024 * 1024
+    written = 0
+    with open(path, "wb") as spool:
+        async for chunk in _prepend(head, chunks):
+            written += len(chunk)
+            if written > limit:
+                raise UnsupportedAudio(
+                    f"{fmt} recordings are limited to {config.OFFLINE_SPOOL_MAX_MB} MB; "
+                    "send WAV or another streamable format"
+                )
+            await asyncio.to_thread(spool.write, chunk)
+
+
+async def _ffmpeg(fmt: str, head: bytes, chunks: AsyncIterator[bytes]) -> AsyncIterator[np.ndarray]:
+    if shutil.which("ffmpeg") is None:
+        raise UnsupportedAudio(f"Decoding {fmt} recordings needs ffmpeg, which isn't installed")
+
+    spooled = None
+    process = None
+    try:
+        if fmt in _SEEKABLE_FORMATS:
+            os.makedirs(config.OFFLINE_SPOOL_DIR, exist_ok=True)
+            fd, spooled = tempfile.mkstemp(prefix="shadowsound-", suffix=f".{fmt}", dir=config.OFFLINE_SPOOL_DIR)
+            os.close(fd)
+            await _spool(fmt, head, chunks, spooled)
+        process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error", "-i", spooled or "pipe:0",
+            "-f", "f32le", "-ac", "1", "-ar", str(TARGET_SR), "pipe:1",
+            stdin=asyncio.subprocess.PIPE if spooled is None else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        async for block in _ffmpeg_output(fmt, process, head if spooled is None else None, chunks):
+            yield block
+    finally:
+        if process is not None and process.returncode is None:
+            process.kill()
+            await process.wait()
+        if spooled is not None:
+            os.unlink(spooled)
+
+
+async def _ffmpeg_output(
+    fmt: str, process: asyncio.subprocess.Process, head: bytes | None, chunks: AsyncIterator[bytes],
+) -> AsyncIterator[np.ndarray]:
+    """Decoded blocks from a running ffmpeg, fed ``head`` and ``chunks`` over stdin unless spooled."""
+
+    async def feed() -> None:
+        try:
+            process.stdin.write(head)
+            async for chunk in chunks:
+                process.stdin.write(chunk)
+                await process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass    # ffmpeg gave up; its exit status says why
+        finally:
+            process.stdin.close()
+
+    feeder = asyncio.create_task(feed()) if head is not None else None
+    stderr = asyncio.create_task(_stderr_tail(process.stderr))
+    try:
+        carry = b""
+        while True:
+            data = await process.stdout.read(PIPE_READ_BYTES)
+            if not data:
+                break
+            data = carry + data
+            usable = len(data) - len(data) % 4
+            carry = data[usable:]
+            yield np.frombuffer(data, dtype=np.float32, count=usable // 4)
+        if feeder is not None:
+            await feeder
+        if await process.wait() != 0:
+            message = (await stderr).decode(errors="replace").strip()
+            raise UnsupportedAudio(f"ffmpeg could not decode the {fmt} recording: {message}")
+    finally:
+        if feeder is not None:
+            feeder.cancel()
+        stderr.cancel()
+
+
+async def decode_stream(chunks: AsyncIterator[bytes], sample_rate: int) -> AsyncIterator[np.ndarray]:
+    """
+    16 kHz mono float32 blocks of a recording, decoded while its bytes
+    arrive.  Headerless data is taken as int16 PCM at ``sample_rate``.
+    """
+    head = await _read_head(chunks, SNIFF_BYTES)
+    if not head:
+        raise UnsupportedAudio("Empty recording")
+    fmt = sniff_format(head)
+
+    if fmt == "wav":
+        try:
+            wav = parse_wav_header(head)
+            while wav is None and len(head) < MAX_HEADER_BYTES:
+                more = await _read_head(chunks, 1)
+                if not more:
+                    break
+                head += more
+                wav = parse_wav_header(head)
+        except ValueError as exc:
+            raise UnsupportedAudio(str(exc)) from exc
+        if wav is None:
+            raise UnsupportedAudio("WAV is missing its fmt or data chunk")
+        if not valid_sample_rate(wav.rate):
+            raise UnsupportedAudio(
+                f"WAV sample rate {wav.rate} Hz is outside {MIN_SAMPLE_RATE}–{MAX_SAMPLE_RATE} Hz"
+            )
+        if wav.dtype is not None:
+            limit = None if wav.data_size in (0, 0xFFFFFFFF) else wav.data_size
+            stream = _PcmStream(wav.dtype, wav.channels, wav.rate)
+            async for block in _in_process(stream, head[wav.data_offset:], chunks, limit):
+                yield block
+            return
+    elif fmt == "pcm":
+        if not valid_sample_rate(sample_rate):
+            raise UnsupportedAudio(f"Sample rate must be {MIN_SAMPLE_RATE}–{MAX_SAMPLE_RATE} Hz")
+        async for block in _in_process(_PcmStream("<i2", 1, sample_rate), head, chunks, None):
+            yield block
+        return
+
+    async for block in _ffmpeg(fmt, head, chunks):
+        yield block
+
+
+# ── Timeline ──────────────────────────────────────────────────────────────
+
+async def _score_blocks(
+    waveforms: AsyncIterator[np.ndarray],
+    score: Scorer,
+    block_frames: int,
+) -> AsyncIterator[tuple[int, np.ndarray]]:
+    """(first_frame, frame scores) for consecutive runs of ≤ block_frames frames."""
+    session = StreamingSession(pool_frames=1)
+    # block_frames hops of new audio never complete more than block_frames
+    # frames, so each call fits the largest length bucket
+    block_samples = block_frames * PATCH_HOP_SAMPLES
+    pending: list[np.ndarray] = []
+    pending_len = 0
+
+    async def run(audio: np.ndarray):
+        ready = session.push(audio)
+        if ready is not None:
+            first, segment = ready
+            return first, await score(segment)
+        return None
+
+    async for waveform in waveforms:
+        pending.append(waveform)
+        pending_len += len(waveform)
+        while pending_len >= block_samples:
+            audio = np.concatenate(pending)
+            pending, pending_len = [audio[block_samples:]], pending_len - block_samples
+            result = await run(audio[:block_samples])
+            if result is not None:
+                yield result
+
+    if pending_len:
+        result = await run(np.concatenate(pending))
+        if result is not None:
+            yield result
+    tail = session.flush()
+    if tail is not None:
+        first, segment = tail
+        yield first, await score(segment)
+
+
+async def timeline(
+    chunks: AsyncIterator[bytes],
+    classifier: SoundClassifier,
+    score: Scorer,
+    sample_rate: int = TARGET_SR,
+    segment_frames: int = config.OFFLINE_SEGMENT_FRAMES,
+) -> AsyncIterator[dict]:
+    """
+    The NDJSON timeline of a recording, one dict per line.
+
+    ``score`` is the awaitable frame scorer: InferenceScheduler.score or
+    RemoteInference.score with ``background=True``, so live chunks go first.
+    """
+    started = time.perf_counter()
+    segment_frames = max(1, segment_frames)
+    block_frames = max(1, min(config.OFFLINE_BLOCK_FRAMES, max(config.INFERENCE_FRAME_BUCKETS)))
+    yield {
+        "type": "start",
+        "categories": classifier.categories,
+        "frame_hop_s": round(FRAME_HOP_S, 3),
+        "segment_s": round(segment_frames * FRAME_HOP_S, 3),
+    }
+
+    def segment_line(first: int, frames: np.ndarray) -> dict:
+        scores = classifier.category_scores(frames)
+        return {
+            "type": "segment",
+            "start_s": round(first * FRAME_HOP_S, 2),
+            "end_s": round((first + len(frames)) * FRAME_HOP_S, 2),
+            "scores": [round(float(s), 4) for s in scores],
+            "detections": [
+                {key: d[key] for key in ("sound_type", "confidence", "yamnet_label")}
+                for d in classifier.detect_all(frames)
+            ],
+        }
+
+    decoded_samples = 0
+
+    async def counted() -> AsyncIterator[np.ndarray]:
+        nonlocal decoded_samples
+        async for waveform in decode_stream(chunks, sample_rate):
+            decoded_samples += len(waveform)
+            yield waveform
+
+    segments = 0
+    carry_first, carry = 0, None
+    async for first, scores in _score_blocks(counted(), score, block_frames):
+        if carry is not None:
+            scores = np.concatenate([carry, scores])
+            first = carry_first
+        whole = len(scores) - len(scores) % segment_frames
+        for offset in range(0, whole, segment_frames):
+            yield segment_line(first + offset, scores[offset:offset + segment_frames])
+            segments += 1
+        carry_first, carry = first + whole, (scores[whole:] if whole < len(scores) else None)
+
+    if carry is not None:
+        yield segment_line(carry_first, carry)
+        segments += 1
+
+    elapsed = time.perf_counter() - started
+    duration = decoded_samples / TARGET_SR
+    metrics.OFFLINE_AUDIO_SECONDS.inc(duration)
+    yield {
+        "type": "end",
+        "duration_s": round(duration, 2),
+        "segments": segments,
+        "elapsed_s": round(elapsed, 2),
+        "realtime_factor": round(duration / elapsed, 1) if elapsed else None,
+    }
@@ -0,0 +1,146 @@
+"""
+Shadow-Sound — Binary WebSocket audio frames
+
+Clients that authenticate with ``api_version`` >= 2.0 send audio as binary
+WebSocket frames instead of JSON + base64:
+
+    offset  size  field
+    0       2     magic        b"SS"
+    2       1     version      1
+    3       1     format       1 = int16 PCM, 2 = float32 PCM, 3 = stream bytes
+    4       4     sample_rate  uint32
+    8       4     sequence     uint32, echoed back in the response
+    12      …     samples      mono little-endian PCM
+
+Version 2 frames insert the capture time after the sequence number:
+
+    12      8     captured_at  uint64, client wall clock in ms since the epoch
+    20      …     samples
+
+so the server can tell how old a chunk is (see shedding.py).
+
+Version 3 frames add a channel count, for phones that record stereo:
+
+    20      1     channels     uint8, ≥ 1; samples are interleaved
+    21      3     reserved     zero
+    24      …     samples
+
+The first two channels are used to estimate where a sound came from
+(see direction.py); YAMNet scores their mix.
+
+Format 3 frames carry the next bytes of the compressed stream the client
+declared with ``stream_format`` at auth (see stream_decoder.py), not PCM;
+their sample rate is the stream's and their duration is unknown here.
+
+All header fields are little-endian.  Every header keeps the payload 4-byte
+aligned, so float32 samples can be viewed in place with np.frombuffer.
+"""
+
+import struct
+from dataclasses import dataclass
+
+import numpy as np
+
+from decoding import MAX_SAMPLE_RATE, MIN_SAMPLE_RATE, valid_sample_rate
+
+FRAME_MAGIC = b"SS"
+FRAME_VERSION = 3
+HEADER = struct.Struct("<2sBBII")
+CAPTURE_TIME = struct.Struct("<Q")
+CHANNELS = struct.Struct("<B3x")
+
+FORMAT_INT16 = 1
+FORMAT_FLOAT32 = 2
+FORMAT_STREAM = 3
+
+_DTYPES: dict[int, np.dtype] = {
+    FORMAT_INT16: np.dtype("<i2"),
+    FORMAT_FLOAT32: np.dtype("<f4"),
+    FORMAT_STREAM: np.dtype("u1"),
+}
+
+BINARY_API_VERSION = (2, 0)
+
+
+class FrameError(ValueError):
+    """Raised for a binary frame that can't be parsed."""
+
+
+@dataclass(frozen=True)
+class AudioFrame:
+    sample_rate: int
+    sequence: int
+    samples: np.ndarray  # read-only view into the received frame; (frames, channels) if stereo
+    captured_at: float | None = None  # client wall clock, seconds since the epoch
+    channels: int = 1
+    format: int = FORMAT_INT16
+
+    @property
+    def encoded(self) -> bool:
+        """True if the payload is compressed stream bytes rather than PCM."""
+        return self.format == FORMAT_STREAM
+
+    @property
+    def duration_s(self) -> float:
+        return 0.0 if self.encoded else len(self.samples) / self.sample_rate
+
+
+def supports_binary(api_version: str | None) -> bool:
+    """True if a client's auth ``api_version`` negotiates binary frames."""
+    if not api_version:
+        return False
+    try:
+        parts = tuple(int(p) for p in str(api_version).split(".")[:2])
+    except ValueError:
+        return False
+    return parts + (0,) * (2 - len(parts)) >= BINARY_API_VERSION
+
+
+def parse_frame(data: bytes) -> AudioFrame:
+    """Split a binary frame into header fields and a zero-copy sample view."""
+    if len(data) < HEADER.size:
+        raise FrameError(f"Frame too short: {len(data)} bytes")
+
+    magic, version, fmt, sample_rate, sequence = HEADER.unpack_from(data)
+    if magic != FRAME_MAGIC:
+        raise FrameError("Bad frame magic")
+    if not 1 <= version <= FRAME_VERSION:
+        raise FrameError(f"Unsupported frame version {version}")
+    dtype = _DTYPES.get(fmt)
+    if dtype is None:
+        raise FrameError(f"Unsupported sample format {fmt}")
+    if sample_rate <= 0:
+        raise FrameError("Sample rate must be positive")
+    if fmt != FORMAT_STREAM and not valid_sample_rate(sample_rate):
+        raise FrameError(f"Sample rate must be {MIN_SAMPLE_RATE}–{MAX_SAMPLE_RATE} Hz, got {sample_rate}")
+
+    offset = HEADER.size
+    captured_at = None
+    if version >= 2:
+        if len(data) < offset + CAPTURE_TIME.size:
+            raise FrameError(f"Frame too short: {len(data)} bytes")
+        (captured_ms,) = CAPTURE_TIME.unpack_from(data, offset)
+        captured_at = captured_ms / 1000 if captured_ms else None
+        offset += CAPTURE_TIME.size
+    channels = 1
+    if version >= 3:
+        if len(data) < offset + CHANNELS.size:
+            raise FrameError(f"Frame too short: {len(data)} bytes")
+        (channels,) = CHANNELS.unpack_from(data, offset)
+        if channels < 1 or (channels > 1 and fmt == FORMAT_STREAM):
+            raise FrameError(f"Unsupported channel count {channels}")
+        offset += CHANNELS.size
+
+    payload = memoryview(data)[offset:]
+    if len(payload) % (dtype.itemsize * channels):
+        raise FrameError(f"Payload of {len(payload)} bytes is not a whole number of {channels}-channel samples")
+
+    samples = np.frombuffer(payload, dtype=dtype)
+    return AudioFrame(
+        sample_rate=sample_rate,
+        sequence=sequence,
+        samples=samples if channels == 1 else samples.reshape(-1, channels),
+        captured_at=captured_at,
+        channels=channels,
+        format=fmt,
+    )
@@ -0,0 +1,402 @@
+"""
+Shadow-Sound — Corpus scanner
+
+Runs the classifier over a directory tree of recordings, e.g. for QA of a
+field-recording corpus:
+
+    python scan.py /data/recordings --out scan/ [--workers 8] [--segment-frames 2]
+
+Files are decoded in a process pool while this process batches their
+frames through YAMNet: several files share a model call, and long files
+are split on frame boundaries so every call fits a length bucket.
+Results are written to --out as they are produced:
+
+    files.csv       one row per file: id, path, duration, status, top category
+    segments.csv    one row per segment: file id, times, detections and a
+                    score column per category
+    segments.bin    the same segment scores as packed little-endian records
+                    (file id, segment, start, float16 scores); read it with
+                    load_segments()
+    scan.json       category order and the record layout of segments.bin
+    manifest.jsonl  checkpoint log: the files finished by each batch, then
+                    the output sizes once that batch was on disk
+
+Segment scores and detections come from category_scores() / detect_all(),
+as in the offline endpoint.  Running again with the same --out resumes:
+the outputs are cut back to the last checkpoint and files already in the
+manifest (same size and mtime) are skipped.  Throughput is printed at the
+end.
+"""
+
+import argparse
+import csv
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass
+
+import numpy as np
+
+import config
+from classifier import SoundClassifier, _bucket_samples
+from decoding import AUDIO_EXTENSIONS, PATCH_HOP_SAMPLES, PATCH_SAMPLES, TARGET_SR, decode_with_info
+from streaming import FRAME_HOP_S
+
+FILES_CSV = "files.csv"
+SEGMENTS_CSV = "segments.csv"
+SEGMENTS_BIN = "segments.bin"
+META_JSON = "scan.json"
+MANIFEST = "manifest.jsonl"
+
+# Frames of decoded audio collected before a batch goes through the model
+BATCH_FRAMES = 1024
+
+
+# ── Decoding (pool processes) ─────────────────────────────────────────────
+
+@dataclass
+class _Decoded:
+    path: str
+    size: int
+    mtime: float
+    waveform: np.ndarray | None
+    error: str | None = None
+
+    @property
+    def duration_s(self) -> float:
+        return 0.0 if self.waveform is None else len(self.waveform) / TARGET_SR
+
+
+def _decode_file(path: str) -> _Decoded:
+    try:
+        stat = os.stat(path)
+        with open(path, "rb") as f:
+            result = decode_with_info(f.read(), TARGET_SR)
+    except OSError as exc:
+        return _Decoded(path, 0, 0.0, None, str(exc))
+    if result.waveform is None or len(result.waveform) == 0:
+        return _Decoded(path, stat.st_size, stat.st_mtime, None, f"could not decode ({result.fmt})")
+    return _Decoded(path, stat.st_size, stat.st_mtime, result.waveform)
+
+
+def find_audio(root: str) -> list[str]:
+    """Every audio file under root, in a stable order."""
+    paths = []
+    for directory, dirs, files in os.walk(root):
+        dirs.sort()
+        paths.extend(
+            os.path.join(directory, name) for name in sorted(files)
+            if name.lower().endswith(AUDIO_EXTENSIONS)
+        )
+    return paths
+
+
+def _split(waveform: np.ndarray, max_frames: int) -> list[np.ndarray]:
+    """
+    Split a waveform into pieces of at most max_frames YAMNet frames whose
+    frame scores, concatenated, are those of the whole waveform.
+    """
+    piece_len = _bucket_samples(max_frames)
+    step = max_frames * PATCH_HOP_SAMPLES
+    pieces = [waveform[:piece_len]]
+    # Another piece is needed while audio remains that no earlier frame reached
+    for start in range(step, len(waveform) - (PATCH_SAMPLES - PATCH_HOP_SAMPLES), step):
+        pieces.append(waveform[start:start + piece_len])
+    return pieces
+
+
+def _signature(path: str) -> tuple[int, float] | None:
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime
+
+
+# ── Output ────────────────────────────────────────────────────────────────
+
+def segment_dtype(num_categories: int) -> np.dtype:
+    """Record layout of segments.bin."""
+    return np.dtype([
+        ("file_id", "<u4"),
+        ("segment", "<u4"),
+        ("start_s", "<f4"),
+        ("scores", "<f2", (num_categories,)),
+    ])
+
+
+def load_segments(out_dir: str) -> tuple[list[str], np.ndarray]:
+    """(categories, records) from a scan's segments.bin."""
+    with open(os.path.join(out_dir, META_JSON)) as f:
+        categories = json.load(f)["categories"]
+    records = np.fromfile(os.path.join(out_dir, SEGMENTS_BIN), dtype=segment_dtype(len(categories)))
+    return categories, records
+
+
+class _Outputs:
+    """Append-only result files plus the checkpoint manifest."""
+
+    def __init__(self, out_dir: str, categories: list[str], segment_frames: int) -> None:
+        os.makedirs(out_dir, exist_ok=True)
+        self.out_dir = out_dir
+        self.categories = categories
+        self.dtype = segment_dtype(len(categories))
+
+        self.done: dict[str, tuple[int, float]] = {}   # path → (size, mtime)
+        self.next_id = 0
+        self._pending: list[dict] = []
+
+        self._check_meta({
+            "categories": categories,
+            "segment_s": round(segment_frames * FRAME_HOP_S, 3),
+            "segments_bin": self.dtype.descr,
+        })
+        sizes = self._restore()
+        self._files = self._open(FILES_CSV, sizes, [
+            "file_id", "path", "duration_s", "segments", "status", "error", "top_category", "top_score",
+        ])
+        self._segments = self._open(SEGMENTS_CSV, sizes, [
+            "file_id", "segment", "start_s", "end_s", "detections", *categories,
+        ])
+        self._bin = self._open(SEGMENTS_BIN, sizes, None)
+        self._manifest = open(os.path.join(out_dir, MANIFEST), "a")
+
+    def _check_meta(self, meta: dict) -> None:
+        path = os.path.join(self.out_dir, META_JSON)
+        if os.path.exists(path):
+            with open(path) as f:
+                previous = json.load(f)
+            if previous["categories"] != meta["categories"] or previous["segment_s"] != meta["segment_s"]:
+                raise SystemExit(f"{self.out_dir} holds a scan with other categories or segment length")
+            return
+        with open(path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def _restore(self) -> dict[str, int]:
+        """Replay the manifest up to its last checkpoint and drop the rest."""
+        path = os.path.join(self.out_dir, MANIFEST)
+        if not os.path.exists(path):
+            return {}
+        sizes: dict[str, int] = {}
+        batch: list[dict] = []
+        committed = 0
+        with open(path, "rb") as f:
+            for line in iter(f.readline, b""):
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    break   # torn last line of an interrupted write
+                if "checkpoint" not in entry:
+                    batch.append(entry)
+                    continue
+                for done in batch:
+                    self.done[done["path"]] = (done["size"], done["mtime"])
+                    self.next_id = max(self.next_id, done["file_id"] + 1)
+                batch = []
+                sizes = entry["checkpoint"]
+                committed = f.tell()
+        os.truncate(path, committed)
+        return sizes
+
+    def _open(self, name: str, sizes: dict[str, int], header: list[str] | None):
+        path = os.path.join(self.out_dir, name)
+        if os.path.exists(path):
+            os.truncate(path, sizes.get(name, 0))
+        if header is None:
+            return open(path, "ab")
+        handle = open(path, "a", newline="")
+        if handle.tell() == 0:
+            csv.writer(handle).writerow(header)
+        return handle
+
+    def add(self, item: _Decoded, segments: list[tuple[float, float, np.ndarray, list[str]]]) -> None:
+        file_id = self.next_id
+        self.next_id += 1
+
+        top_category, top_score = "", ""
+        if segments:
+            scores = np.stack([s for _start, _end, s, _detections in segments])
+            _segment, best = np.unravel_index(np.argmax(scores), scores.shape)
+            top_category, top_score = self.categories[best], f"{scores.max():.4f}"
+        status = "ok" if item.error is None else "failed"
+        csv.writer(self._files).writerow([
+            file_id, item.path, f"{item.duration_s:.2f}", len(segments), status, item.error or "",
+            top_category, top_score,
+        ])
+
+        writer = csv.writer(self._segments)
+        records = np.zeros(len(segments), dtype=self.dtype)
+        for index, (start, end, scores, detections) in enumerate(segments):
+            writer.writerow([
+                file_id, index, f"{start:.2f}", f"{end:.2f}", ";".join(detections),
+                *(f"{s:.4f}" for s in scores),
+            ])
+            records[index] = (file_id, index, start, scores)
+        self._bin.write(records.tobytes())
+
+        self._pending.append({
+            "file_id": file_id, "path": item.path, "size": item.size, "mtime": item.mtime, "status": status,
+        })
+        self.done[item.path] = (item.size, item.mtime)
+
+    def checkpoint(self) -> None:
+        """Make everything added so far durable, then record it in the manifest."""
+        sizes = {}
+        for name, handle in ((FILES_CSV, self._files), (SEGMENTS_CSV, self._segments), (SEGMENTS_BIN, self._bin)):
+            handle.flush()
+            os.fsync(handle.fileno())
+            sizes[name] = handle.tell()
+        for entry in self._pending:
+            self._manifest.write(json.dumps(entry) + "\n")
+        self._manifest.write(json.dumps({"checkpoint": sizes}) + "\n")
+        self._manifest.flush()
+        os.fsync(self._manifest.fileno())
+        self._pending = []
+
+    def close(self) -> None:
+        for handle in (self._files, self._segments, self._bin, self._manifest):
+            handle.close()
+
+
+# ── Scan ──────────────────────────────────────────────────────────────────
+
+class Scanner:
+    """Batches decoded files through the classifier and writes their segments."""
+
+    def __init__(self, classifier: SoundClassifier, outputs: _Outputs, segment_frames: int) -> None:
+        self.classifier = classifier
+        self.outputs = outputs
+        self.segment_frames = max(1, segment_frames)
+        self.max_frames = max(config.INFERENCE_FRAME_BUCKETS)
+
+        self.files = 0
+        self.failed = 0
+        self.audio_s = 0.0
+
+    def run_batch(self, batch: list[_Decoded]) -> None:
+        pieces, owners = [], []
+        for index, item in enumerate(batch):
+            if item.waveform is not None:
+                split = _split(item.waveform, self.max_frames)
+                pieces.extend(split)
+                owners.extend([index] * len(split))
+        scored: dict[int, list[np.ndarray]] = {}
+        for owner, scores in zip(owners, self.classifier.score_waveforms(pieces) if pieces else []):
+            scored.setdefault(owner, []).append(scores)
+
+        for index, item in enumerate(batch):
+            segments = []
+            if index in scored:
+                segments = self._segments(np.concatenate(scored[index]))
+                self.audio_s += item.duration_s
+            else:
+                self.failed += 1
+            self.outputs.add(item, segments)
+        self.files += len(batch)
+        self.outputs.checkpoint()
+
+    def _segments(self, frames: np.ndarray) -> list[tuple[float, float, np.ndarray, list[str]]]:
+        segments = []
+        for first in range(0, len(frames), self.segment_frames):
+            block = frames[first:first + self.segment_frames]
+            segments.append((
+                first * FRAME_HOP_S,
+                (first + len(block)) * FRAME_HOP_S,
+                self.classifier.category_scores(block),
+                [d["sound_type"] for d in self.classifier.detect_all(block)],
+            ))
+        return segments
+
+
+def scan(
+    root: str,
+    out_dir: str,
+    workers: int,
+    segment_frames: int = config.OFFLINE_SEGMENT_FRAMES,
+    batch_frames: int = BATCH_FRAMES,
+) -> dict:
+    paths = find_audio(root)
+    classifier = SoundClassifier(cascade=False)
+    outputs = _Outputs(out_dir, classifier.categories, segment_frames)
+    todo = [p for p in paths if outputs.done.get(p) != _signature(p)]
+    if len(todo) < len(paths):
+        print(f"Resuming: {len(paths) - len(todo)} of {len(paths)} files already scanned")
+
+    scanner = Scanner(classifier, outputs, segment_frames)
+    started = time.perf_counter()
+    # Spawned, not forked: decoders must not inherit the loaded model's threads
+    pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        queue = iter(todo)
+        in_flight: deque[Future] = deque()
+        batch: list[_Decoded] = []
+        frames = 0
+        while True:
+            # Keep every decoder busy while the model works through a batch
+            while len(in_flight) < 2 * workers and (path := next(queue, None)) is not None:
+                in_flight.append(pool.submit(_decode_file, path))
+            if not in_flight:
+                break
+            item = in_flight.popleft().result()
+            batch.append(item)
+            if item.waveform is not None:
+                frames += len(item.waveform) // PATCH_HOP_SAMPLES + 1
+            if frames >= batch_frames:
+                scanner.run_batch(batch)
+                batch, frames = [], 0
+                _progress(scanner, len(todo), started)
+        if batch:
+            scanner.run_batch(batch)
+    finally:
+        pool.shutdown(cancel_futures=True)
+        outputs.close()
+
+    elapsed = time.perf_counter() - started
+    return {
+        "files": scanner.files,
+        "failed": scanner.failed,
+        "skipped": len(paths) - len(todo),
+        "audio_s": round(scanner.audio_s, 1),
+        "elapsed_s": round(elapsed, 1),
+        "files_per_s": round(scanner.files / elapsed, 2) if elapsed else None,
+        "audio_s_per_s": round(scanner.audio_s / elapsed, 1) if elapsed else None,
+    }
+
+
+def _progress(scanner: Scanner, total: int, started: float) -> None:
+    elapsed = time.perf_counter() - started
+    print(
+        f"  {scanner.files}/{total} files  "
+        f"{scanner.files / elapsed:.1f} files/s  {scanner.audio_s / elapsed:.0f} audio-s/s",
+        flush=True,
+    )
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Classify every recording under a directory.")
+    parser.add_argument("root", help="directory to scan")
+    parser.add_argument("--out", required=True, help="results directory (re-use it to resume)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="decoding processes")
+    parser.add_argument(
+        "--segment-frames", type=int, default=config.OFFLINE_SEGMENT_FRAMES,
+        help=f"YAMNet frames ({FRAME_HOP_S:.2f} s each) per output segment",
+    )
+    parser.add_argument("--batch-frames", type=int, default=BATCH_FRAMES, help="frames per inference batch")
+    args = parser.parse_args(argv)
+
+    result = scan(args.root, args.out, max(1, args.workers), args.segment_frames, args.batch_frames)
+    print(
+        f"Scanned {result['files']} files ({result['failed']} failed, {result['skipped']} skipped) "
+        f"in {result['elapsed_s']} s: {result['files_per_s']} files/s, "
+        f"{result['audio_s_per_s']} audio-s/s"
+    )
+    print(f"Results → {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,196 @@
+"""
+Shadow-Sound — Inference micro-batching scheduler
+
+Every open WebSocket submits its decoded waveform here instead of calling
+YAMNet directly.  A single background task drains the queue into batches
+(bounded by a maximum size and a maximum wait), scores each batch with one
+SoundClassifier.score_waveforms() call and resolves the future each
+connection is awaiting with that waveform's per-frame scores.
+
+Batches are executed on the WorkerPool's inference threads; while every
+thread is busy, new requests keep accumulating into the next batch.
+
+Background requests (offline recordings, see offline.py) wait in their own
+queue.  They are scored one per call, and only when no live chunk is
+waiting, so a large block never sits in a batch that carries someone's
+alert.
+"""
+
+import asyncio
+import time
+from collections import Counter
+
+import numpy as np
+
+import config
+import metrics
+from classifier import SoundClassifier
+from log import get_logger
+from workers import WorkerPool
+
+log = get_logger("scheduler")
+
+
+class InferenceScheduler:
+    """Coalesces waveforms from all connections into batched YAMNet calls."""
+
+    def __init__(
+        self,
+        classifier: SoundClassifier,
+        workers: WorkerPool,
+        max_batch_size: int = config.BATCH_MAX_SIZE,
+        max_wait_ms: float = config.BATCH_MAX_WAIT_MS,
+    ) -> None:
+        self.classifier = classifier
+        self.workers = workers
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait_ms = max(0.0, max_wait_ms)
+
+        self._queue: asyncio.Queue[tuple[np.ndarray, asyncio.Future]] = asyncio.Queue()
+        self._background: asyncio.Queue[tuple[np.ndarray, asyncio.Future]] = asyncio.Queue()
+        self._arrived = asyncio.Event()
+        self._task: asyncio.Task | None = None
+        self._slots = asyncio.Semaphore(workers.inference_threads)
+        self._in_flight: set[asyncio.Task] = set()
+
+        # Statistics
+        self._batch_sizes: Counter[int] = Counter()
+        self._inference_ms_total = 0.0
+
+    # ── lifecycle ──────────────────────────────────────────────────────
+
+    def start(self) -> None:
+        """Start the batching loop on the running event loop."""
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the batching loop and fail any requests still waiting."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+        for task in list(self._in_flight):
+            task.cancel()
+
+        for queue in (self._queue, self._background):
+            while not queue.empty():
+                _waveform, future = queue.get_nowait()
+                if not future.done():
+                    future.set_exception(RuntimeError("Inference scheduler stopped"))
+
+    # ── public API ─────────────────────────────────────────────────────
+
+    async def score(self, waveform: np.ndarray, background: bool = False) -> np.ndarray:
+        """
+        Queue one waveform for the next batch and wait for its frame scores.
+        ``background`` waveforms are scored only while no live one waits.
+        """
+        future = asyncio.get_running_loop().create_future()
+        await (self._background if background else self._queue).put((waveform, future))
+        self._arrived.set()
+        return await future
+
+    async def classify(self, waveform: np.ndarray) -> list[dict]:
+        """Queue one waveform for the next batch and wait for its detections."""
+        return self.classifier.detect_all(await self.score(waveform))
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> dict:
+        """Achieved batch sizes and timing since startup."""
+        batches = sum(self._batch_sizes.values())
+        items = sum(size * count for size, count in self._batch_sizes.items())
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": batches,
+            "waveforms": items,
+            "mean_batch_size": round(items / batches, 2) if batches else 0.0,
+            "mean_inference_ms": round(self._inference_ms_total / batches, 1) if batches else 0.0,
+            "batch_size_histogram": dict(sorted(self._batch_sizes.items())),
+            "queue_depth": self._queue.qsize(),
+            "background_depth": self._background.qsize(),
+        }
+
+    # ── internals ──────────────────────────────────────────────────────
+
+    async def _collect(self) -> list[tuple[np.ndarray, asyncio.Future]]:
+        """Wait for one request, then gather more until full or the deadline passes."""
+        while self._queue.empty() and self._background.empty():
+            self._arrived.clear()
+            await self._arrived.wait()
+        if self._queue.empty():
+            # Nothing live is waiting; score one background waveform on its own
+            return [self._background.get_nowait()]
+
+        batch = [self._queue.get_nowait()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            # Take whatever is already queued without yielding
+            while len(batch) < self.max_batch_size and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            if len(batch) >= self.max_batch_size:
+                break
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            # Wait for a free inference thread before sealing the next batch,
+            # so requests keep accumulating while the model is busy.
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                self._slots.release()
+                raise
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch: list[tuple[np.ndarray, asyncio.Future]]) -> None:
+        try:
+            # Connections that gave up while queued don't need scoring
+            batch = [(waveform, future) for waveform, future in batch if not future.done()]
+            if not batch:
+                return
+
+            waveforms = [waveform for waveform, _future in batch]
+            started = time.perf_counter()
+            try:
+                results = await self.workers.infer(self.classifier.score_waveforms, waveforms)
+            except Exception as exc:
+                log.error("Batch of %d failed: %s", len(batch), exc)
+                for _waveform, future in batch:
+                    if not future.done():
+                        future.set_exception(exc)
+                return
+
+            elapsed = time.perf_counter() - started
+            self._inference_ms_total += elapsed * 1000
+            self._batch_sizes[len(batch)] += 1
+            metrics.BATCH_SECONDS.observe(elapsed)
+            metrics.BATCH_SIZE.observe(len(batch))
+
+            for (_waveform, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
@@ -0,0 +1,254 @@
+"""
+Shadow-Sound — Stale-chunk shedding
+
+A safety alert about audio from ten seconds ago is worse than none, so when
+the server falls behind a connection must skip ahead instead of working
+through its backlog in order.  Each /ws/audio connection reads its socket
+from a separate task into a ChunkInbox, which stamps every message on
+arrival.  The handler takes messages back out in order, except that:
+
+  * an audio chunk older than CHUNK_DEADLINE_MS is dropped while a newer
+    chunk is already waiting — the newest chunk is always processed,
+  * beyond INBOX_MAX_CHUNKS queued chunks the oldest one is dropped,
+  * control messages (auth, …) are never dropped.
+
+A chunk's age is its wait in the inbox plus, when the client sends a
+capture time (``captured_at`` in JSON chunks, version 2 binary frames), its
+transit from the phone.  Transit is measured relative to the smallest
+capture-to-arrival offset seen on the connection, so clock skew between
+phone and server cancels out.
+
+While chunks are being dropped the client is sent a ``throttle`` message
+suggesting a longer chunk interval (and 16 kHz if it records above that);
+once nothing has been dropped for THROTTLE_RESUME_S it gets one saying it
+may resume.
+"""
+
+import asyncio
+import math
+import time
+from collections import Counter, deque
+from dataclasses import dataclass
+
+import config
+import metrics
+from decoding import TARGET_SR
+from protocol import AudioFrame
+
+MAX_SUGGESTED_CHUNK_MS = 5000
+_EMA = 0.2
+
+
+@dataclass
+class Inbound:
+    """One received WebSocket message, stamped on arrival."""
+
+    received_at: float                    # time.monotonic()
+    msg: dict | None = None               # parsed text message
+    frame: AudioFrame | None = None       # parsed binary frame
+    frame_error: str | None = None        # why a binary frame didn't parse
+    transit_s: float = 0.0                # capture → arrival, beyond the best seen
+    dropped_before: int = 0               # chunks dropped just before this one
+    dropped_seconds: float = 0.0          # their duration, where known
+
+    @property
+    def is_audio(self) -> bool:
+        return self.frame is not None or (self.msg is not None and self.msg.get("type") == "audio_chunk")
+
+    @property
+    def transport(self) -> str:
+        return "json" if self.msg is not None else "binary"
+
+    @property
+    def captured_at(self) -> float | None:
+        if self.frame is not None:
+            return self.frame.captured_at
+        captured_ms = self.msg.get("captured_at") if self.msg is not None else None
+        return captured_ms / 1000 if isinstance(captured_ms, (int, float)) and captured_ms > 0 else None
+
+    @property
+    def sample_rate(self) -> int | None:
+        if self.frame is not None:
+            return self.frame.sample_rate
+        rate = self.msg.get("sample_rate", TARGET_SR) if self.msg is not None else None
+        return rate if isinstance(rate, int) else None
+
+
+class ChunkInbox:
+    """Per-connection message queue that sheds stale audio chunks."""
+
+    def __init__(
+        self,
+        deadline_ms: int = config.CHUNK_DEADLINE_MS,
+        max_chunks: int = config.INBOX_MAX_CHUNKS,
+        throttle_interval_s: float = config.THROTTLE_INTERVAL_S,
+        resume_s: float = config.THROTTLE_RESUME_S,
+    ) -> None:
+        self.deadline_s = deadline_ms / 1000
+        self.max_chunks = max(1, max_chunks)
+        self.throttle_interval_s = throttle_interval_s
+        self.resume_s = resume_s
+
+        self._items: deque[Inbound] = deque()
+        self._audio = 0                       # audio chunks in _items
+        self._ready = asyncio.Event()
+        self._closed: BaseException | None = None
+        self._min_offset: float | None = None
+
+        # Drops not yet attached to the next processed chunk
+        self._gap_chunks = 0
+        self._gap_seconds = 0.0
+
+        # Load estimates behind the throttle suggestion
+        self._last_arrival: float | None = None
+        self._interval_s: float | None = None
+        self._service_s: float | None = None
+        self._taken_at: float | None = None
+        self._sample_rate: int | None = None
+
+        self.throttled = False
+        self._unreported = 0
+        self._last_notice = -math.inf
+        self._last_drop = -math.inf
+
+        self.received = 0
+        self.dropped: Counter[str] = Counter()
+
+    # ── producer side (socket reader task) ─────────────────────────────
+
+    def put(self, item: Inbound) -> None:
+        if item.is_audio:
+            self._observe_arrival(item)
+            self._audio += 1
+            self.received += 1
+            if self._audio > self.max_chunks:
+                oldest = next(i for i in self._items if i.is_audio)
+                self._drop(oldest, "overflow")
+        self._items.append(item)
+        self._ready.set()
+
+    def close(self, exc: BaseException, discard: bool = False) -> None:
+        """
+        No more messages: get() raises ``exc`` once the queue is empty, or
+        straight away with ``discard`` (the client has gone, so there's
+        no-one to answer what is still queued).
+        """
+        self._closed = exc
+        if discard:
+            self._items.clear()
+            self._audio = 0
+        self._ready.set()
+
+    # ── consumer side (connection handler) ─────────────────────────────
+
+    async def get(self) -> Inbound:
+        while True:
+            self._shed_stale()
+            if self._items:
+                item = self._items.popleft()
+                if item.is_audio:
+                    self._audio -= 1
+                    self._taken_at = time.monotonic()
+                    metrics.CHUNK_QUEUE_SECONDS.labels(item.transport).observe(
+                        self._taken_at - item.received_at
+                    )
+                    item.dropped_before, item.dropped_seconds = self._gap_chunks, self._gap_seconds
+                    self._gap_chunks, self._gap_seconds = 0, 0.0
+                return item
+            if self._closed is not None:
+                raise self._closed
+            self._ready.clear()
+            await self._ready.wait()
+
+    def done(self, item: Inbound) -> None:
+        """Record that a chunk's response was sent."""
+        now = time.monotonic()
+        age = self.age(item, now)
+        metrics.CHUNK_AGE_SECONDS.labels(item.transport).observe(age)
+        if self._taken_at is not None:
+            self._service_s = _ema(self._service_s, now - self._taken_at)
+
+    def age(self, item: Inbound, now: float | None = None) -> float:
+        """Seconds since the chunk was captured (or arrived, without a capture time)."""
+        if now is None:
+            now = time.monotonic()
+        return item.transit_s + (now - item.received_at)
+
+    def notice(self) -> dict | None:
+        """A ``throttle`` message to send now, if any."""
+        now = time.monotonic()
+        if self._unreported and now - self._last_notice >= self.throttle_interval_s:
+            message = {
+                "type": "throttle",
+                "action": "slow_down",
+                "dropped": self._unreported,
+                "deadline_ms": round(self.deadline_s * 1000),
+                "suggested_chunk_ms": self._suggested_chunk_ms(),
+            }
+            if self._sample_rate and self._sample_rate > TARGET_SR:
+                message["suggested_sample_rate"] = TARGET_SR
+            self._unreported = 0
+            self._last_notice = now
+            self.throttled = True
+            metrics.THROTTLES.labels("slow_down").inc()
+            return message
+
+        if self.throttled and not self._audio and now - self._last_drop >= self.resume_s:
+            self.throttled = False
+            self._last_notice = now
+            metrics.THROTTLES.labels("resume").inc()
+            return {"type": "throttle", "action": "resume"}
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "received": self.received,
+            "dropped": dict(self.dropped),
+            "queued": self._audio,
+            "throttled": self.throttled,
+        }
+
+    # ── internals ──────────────────────────────────────────────────────
+
+    def _observe_arrival(self, item: Inbound) -> None:
+        if self._last_arrival is not None:
+            self._interval_s = _ema(self._interval_s, item.received_at - self._last_arrival)
+        self._last_arrival = item.received_at
+        self._sample_rate = item.sample_rate or self._sample_rate
+
+        captured_at = item.captured_at
+        if captured_at is not None:
+            offset = time.time() - captured_at
+            if self._min_offset is None or offset < self._min_offset:
+                self._min_offset = offset
+            item.transit_s = offset - self._min_offset
+
+    def _shed_stale(self) -> None:
+        if self._audio < 2:
+            return
+        now = time.monotonic()
+        newest = next(i for i in reversed(self._items) if i.is_audio)
+        for item in [i for i in self._items if i.is_audio and i is not newest]:
+            if self.age(item, now) > self.deadline_s:
+                self._drop(item, "stale")
+
+    def _drop(self, item: Inbound, reason: str) -> None:
+        self._items.remove(item)
+        self._audio -= 1
+        self._gap_chunks += 1
+        if item.frame is not None:
+            self._gap_seconds += item.frame.duration_s
+        self._unreported += 1
+        self._last_drop = time.monotonic()
+        self.dropped[reason] += 1
+        metrics.CHUNKS_DROPPED.labels(item.transport, reason).inc()
+
+    def _suggested_chunk_ms(self) -> int:
+        # Chunks should arrive no faster than they can be handled, with headroom
+        busy_s = max(self._interval_s or 0.0, self._service_s or 0.0) * 1.5
+        step = 250
+        return min(MAX_SUGGESTED_CHUNK_MS, max(step, math.ceil(busy_s * 1000 / step) * step))
+
+
+def _ema(current: float | None, sample: float) -> float:
+    return sample if current is None else current + _EMA * (sample - current)
@@ -0,0 +1,224 @@
+"""
+Shadow-Sound — Per-connection stream decoding
+
+By default a phone sends every chunk as a complete compressed file (an
+M4A with its own container header), so each chunk is parsed from scratch,
+ffmpeg is started once per chunk, and the codec's priming samples cut a
+little audio out at every chunk boundary.
+
+Clients that authenticate with a ``stream_format`` send one continuous
+compressed stream instead, split across chunks at any byte:
+
+    "aac"    ADTS frames (raw AAC, each frame with its own 7-byte header)
+    "ogg"    Ogg pages with Opus (or Vorbis)
+    "webm"   WebM/Matroska with Opus, as MediaRecorder writes it
+
+The connection keeps one ffmpeg process for its whole life, fed over
+stdin.  A reader task collects the 16 kHz mono float32 it writes to stdout,
+and decode() hands back whatever was decoded since the last chunk.  The
+decoder keeps its state across chunks, so the audio has no gaps and no
+repeated priming, and process startup is paid once per connection.
+
+Each decoder holds one of the worker's STREAM_DECODERS_MAX slots from
+construction until close(), so the cap counts every connection that has
+been given a decoder, including those whose process has not started yet.
+ffmpeg's stderr is drained continuously and only its last few kilobytes
+are kept for the error message.
+
+ADTS and Ogg survive lost chunks (shedding, see shedding.py) by
+resynchronising on the next frame or page.  If ffmpeg exits, decode()
+raises StreamDecodeError, and the next chunk starts a fresh process.
+That is enough for ADTS.  Ogg and WebM streams must then restart from
+their headers.
+"""
+
+import asyncio
+import shutil
+from collections import deque
+
+import numpy as np
+
+import config
+import metrics
+from decoding import TARGET_SR
+from log import get_logger
+
+log = get_logger("stream_decoder")
+
+# stream_format → ffmpeg demuxer
+STREAM_FORMATS: dict[str, str] = {
+    "aac": "aac",
+    "ogg": "ogg",
+    "webm": "matroska",
+}
+
+PIPE_READ_BYTES = 64 * 1024
+STDERR_TAIL_LINES = 20  # ffmpeg stderr kept for the error message
+SETTLE_S = 0.005        # output that pauses this long is taken to be complete
+STARTUP_WAIT_S = 0.5    # extra wait for the first output of a new process
+
+
+class StreamDecodeError(Exception):
+    """Raised when a connection's decoder process fails."""
+
+
+class StreamDecoder:
+    """One long-lived ffmpeg decoding a connection's compressed stream to 16 kHz mono."""
+
+    # Decoder slots taken in this worker process
+    running = 0
+
+    def __init__(self, fmt: str, wait_ms: float = config.STREAM_DECODER_WAIT_MS) -> None:
+        self.fmt = fmt
+        self.demuxer = STREAM_FORMATS[fmt]
+        self.wait_s = wait_ms / 1000
+        self._process: asyncio.subprocess.Process | None = None
+        self._reader: asyncio.Task | None = None
+        self._stderr_reader: asyncio.Task | None = None
+        self._stderr: deque[str] = deque(maxlen=STDERR_TAIL_LINES)
+        self._pcm = bytearray()
+        self._output = asyncio.Event()
+        self.bytes_in = 0
+        self.samples_out = 0
+        self.starts = 0
+        # Take the slot now: available() and the constructor run without an
+        # await in between, so concurrent auths cannot overshoot the cap.
+        self._slot = True
+        StreamDecoder.running += 1
+        metrics.STREAM_DECODERS.inc()
+
+    @staticmethod
+    def available(fmt: str | None) -> bool:
+        """Whether a decoder for ``fmt`` can be opened now (format known, ffmpeg installed, below the cap)."""
+        return (
+            fmt in STREAM_FORMATS
+            and StreamDecoder.running < config.STREAM_DECODERS_MAX
+            and shutil.which("ffmpeg") is not None
+        )
+
+    async def decode(self, data: bytes) -> tuple[np.ndarray | None, None]:
+        """
+        Feed the next bytes of the stream and return the audio decoded
+        since the last call (None if none yet), as workers.decode() does.
+        Stream decoding is mono, so there is never a channel pair.
+        """
+        wait_s = self.wait_s
+        if self._process is None:
+            await self._start()
+            wait_s += STARTUP_WAIT_S
+        self._output.clear()
+        try:
+            self._process.stdin.write(data)
+            await self._process.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass    # ffmpeg is gone; _collect() reports why
+        self.bytes_in += len(data)
+
+        with metrics.stage("audio_decode"):
+            await self._collect(wait_s)
+        usable = len(self._pcm) - len(self._pcm) % 4
+        waveform = np.frombuffer(bytes(self._pcm[:usable]), dtype=np.float32) if usable else None
+        del self._pcm[:usable]
+
+        if self._reader.done():
+            await self._fail()
+        metrics.DECODES.labels(f"{self.fmt}_stream", "ok").inc()
+        if waveform is not None:
+            self.samples_out += len(waveform)
+        return waveform, None
+
+    async def close(self) -> None:
+        """Stop the decoder process and give up the slot (the connection is closing)."""
+        if self._slot:
+            self._slot = False
+            StreamDecoder.running -= 1
+            metrics.STREAM_DECODERS.dec()
+        await self._stop()
+
+    def stats(self) -> dict:
+        return {
+            "stream_format": self.fmt,
+            "bytes_in": self.bytes_in,
+            "seconds_out": round(self.samples_out / TARGET_SR, 2),
+            "starts": self.starts,
+        }
+
+    # ── internals ──────────────────────────────────────────────────────
+
+    async def _start(self) -> None:
+        if not self._slot:
+            raise StreamDecodeError(f"The {self.fmt} stream decoder is closed")
+        self._process = await asyncio.create_subprocess_exec(
+            "ffmpeg", "-hide_banner", "-loglevel", "error",
+            # Start decoding from the first bytes instead of probing ahead
+            "-fflags", "nobuffer", "-probesize", "32", "-analyzeduration", "0",
+            "-f", self.demuxer, "-i", "pipe:0",
+            "-f", "f32le", "-ac", "1", "-ar", str(TARGET_SR), "-flush_packets", "1", "pipe:1",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        self._pcm.clear()
+        self._stderr.clear()
+        self._reader = asyncio.create_task(self._read(self._process))
+        self._stderr_reader = asyncio.create_task(self._read_stderr(self._process))
+        self.starts += 1
+
+    async def _stop(self) -> None:
+        process, self._process = self._process, None
+        if process is None:
+            return
+        self._reader.cancel()
+        if process.returncode is None:
+            process.kill()
+            await process.wait()
+        # stderr reaches EOF once the process is gone; let the reader keep the last lines
+        try:
+            await asyncio.wait_for(self._stderr_reader, 1.0)
+        except asyncio.TimeoutError:
+            self._stderr_reader.cancel()
+
+    async def _read(self, process: asyncio.subprocess.Process) -> None:
+        while True:
+            data = await process.stdout.read(PIPE_READ_BYTES)
+            if not data:
+                break
+            self._pcm += data
+            self._output.set()
+        self._output.set()
+
+    async def _read_stderr(self, process: asyncio.subprocess.Process) -> None:
+        """Read stderr as it comes, so a chatty ffmpeg can never block on a full pipe."""
+        while True:
+            try:
+                line = await process.stderr.readline()
+            except ValueError:
+                continue    # a line over the reader's limit is discarded
+            if not line:
+                return
+            self._stderr.append(line.decode(errors="replace").rstrip())
+
+    async def _collect(self, wait_s: float) -> None:
+        """Wait up to ``wait_s`` for output, then until it pauses for SETTLE_S."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + wait_s
+        timeout = wait_s
+        while timeout > 0 and not self._reader.done():
+            try:
+                await asyncio.wait_for(self._output.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
+            self._output.clear()
+            timeout = min(SETTLE_S, deadline - loop.time())
+
+    async def _fail(self) -> None:
+        process = self._process
+        await self._stop()
+        stderr = "\n".join(line for line in self._stderr if line)
+        metrics.DECODES.labels(f"{self.fmt}_stream", "failed").inc()
+        log.warning("%s stream decoder exited with %s: %s", self.fmt, process.returncode, stderr)
+        raise StreamDecodeError(
+            f"The {self.fmt} stream could not be decoded ({stderr or 'decoder exited'}); "
+            "the next chunk starts a new decoder"
+            + ("" if self.fmt == "aac" else ", so it must begin with the stream headers")
+        )
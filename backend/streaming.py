@@ -0,0 +1,164 @@
+"""
+Shadow-Sound — Incremental streaming inference
+
+Phones send contiguous 1.5 s chunks, but classifying each chunk on its own
+means a siren that starts near the end of one chunk never fills a whole
+YAMNet window.  A StreamingSession treats a connection's chunks as one
+continuous 16 kHz stream:
+
+  * incoming samples go into a rolling buffer that keeps only what the
+    next unscored frame still needs (at most one 0.975 s window),
+  * push() returns just the span covering frames that became complete,
+    so each 0.48 s hop is scored exactly once,
+  * scored frames are cached, and detections are made per frame by pooling
+    the last few cached frames instead of re-running whole chunks.
+
+Stereo chunks' channel pairs (see direction.py) go through a second buffer
+kept in step with the first, so ``pair`` always matches the last segment.
+"""
+
+from collections import deque
+
+import numpy as np
+
+import config
+from classifier import SoundClassifier
+from decoding import PATCH_HOP_SAMPLES, PATCH_SAMPLES, TARGET_SR
+
+FRAME_HOP_S = PATCH_HOP_SAMPLES / TARGET_SR
+
+
+class StreamingSession:
+    """Rolling audio buffer + frame-score cache for one connection."""
+
+    def __init__(self, pool_frames: int = config.STREAM_POOL_FRAMES) -> None:
+        self.pool_frames = max(1, pool_frames)
+
+        # Rolling buffer holding samples from the start of the next unscored frame
+        self._buffer = np.zeros(PATCH_SAMPLES * 4, dtype=np.float32)
+        # The same span of the stereo pair, once a chunk has come with one
+        self._pair: np.ndarray | None = None
+        self._len = 0
+        # (samples, 2) pair behind the segment push() last returned, or None
+        self.pair: np.ndarray | None = None
+        self._next_frame = 0          # absolute index of the next frame to score
+
+        # (frame_index, scores) for recently scored frames
+        self._scores: deque[tuple[int, np.ndarray]] = deque(maxlen=self.pool_frames)
+
+        self.frames_scored = 0
+
+    def push(self, waveform: np.ndarray, pair: np.ndarray | None = None) -> tuple[int, np.ndarray] | None:
+        """
+        Append decoded samples and return the audio for newly complete frames.
+
+        Returns ``(first_frame_index, segment)`` where ``segment`` holds exactly
+        the samples those frames cover, or None if no new frame is complete.
+        ``pair`` is the chunk's stereo pair, if it had one; the segment's is
+        then in ``self.pair`` (silent where a chunk came without one).
+        """
+        self._append(waveform, pair)
+        if self._len < PATCH_SAMPLES:
+            return None
+
+        n_frames = 1 + (self._len - PATCH_SAMPLES) // PATCH_HOP_SAMPLES
+        seg_len = PATCH_SAMPLES + (n_frames - 1) * PATCH_HOP_SAMPLES
+        segment = self._buffer[:seg_len].copy()
+        self.pair = self._pair[:seg_len].copy() if self._pair is not None else None
+        first = self._next_frame
+
+        # Drop the hops we've consumed; keep the overlap the next frame needs
+        consumed = n_frames * PATCH_HOP_SAMPLES
+        self._buffer[:self._len - consumed] = self._buffer[consumed:self._len]
+        if self._pair is not None:
+            self._pair[:self._len - consumed] = self._pair[consumed:self._len]
+        self._len -= consumed
+        self._next_frame += n_frames
+        return first, segment
+
+    def flush(self) -> tuple[int, np.ndarray] | None:
+        """
+        At the end of a stream, zero-pad the buffered tail into one last
+        frame, if it holds audio no scored frame has covered yet.
+        """
+        covered = PATCH_SAMPLES - PATCH_HOP_SAMPLES if self._next_frame else 0
+        if self._len <= covered:
+            return None
+        segment = np.zeros(PATCH_SAMPLES, dtype=np.float32)
+        segment[:self._len] = self._buffer[:self._len]
+        first = self._next_frame
+        self._next_frame += 1
+        self._len = 0
+        return first, segment
+
+    def gap(self, seconds: float = 0.0) -> None:
+        """
+        Audio was dropped before reaching the session.
+
+        The partial frame in the buffer no longer lines up with what comes
+        next, so it is discarded, and the frame index skips ahead by the
+        dropped duration (at least one frame, which also breaks pooling).
+        """
+        self._len = 0
+        self._next_frame += max(1, round(seconds / FRAME_HOP_S))
+
+    def add_scores(self, first_frame: int, scores: np.ndarray) -> list[tuple[int, np.ndarray]]:
+        """
+        Cache newly computed frame scores.
+
+        Returns, for each new frame, its index and the scores pooled over it
+        and the ``pool_frames - 1`` frames before it.
+        """
+        pooled = []
+        for offset, row in enumerate(scores):
+            index = first_frame + offset
+            # A gap (a dropped or failed chunk) makes older frames irrelevant
+            if self._scores and self._scores[-1][0] != index - 1:
+                self._scores.clear()
+            self._scores.append((index, row))
+            pooled.append((index, np.stack([r for _i, r in self._scores])))
+        self.frames_scored += len(scores)
+        return pooled
+
+    def detections(
+        self,
+        classifier: SoundClassifier,
+        first_frame: int,
+        scores: np.ndarray,
+        threshold_scale: float | np.ndarray = 1.0,
+    ) -> list[dict]:
+        """
+        Cache new frame scores and return one detection per category.
+
+        Each new frame is evaluated on its own pooled window; when several
+        frames detect the same category the most confident one is kept and
+        tagged with its position in the stream.  Results are sorted by
+        confidence, highest first.
+        """
+        best: dict[str, dict] = {}
+        for index, window in self.add_scores(first_frame, scores):
+            for detection in classifier.detect_all(window, threshold_scale):
+                detection["stream_time_s"] = round(index * FRAME_HOP_S, 2)
+                current = best.get(detection["sound_type"])
+                if current is None or detection["confidence"] > current["confidence"]:
+                    best[detection["sound_type"]] = detection
+        return sorted(best.values(), key=lambda d: d["confidence"], reverse=True)
+
+    # ── internals ──────────────────────────────────────────────────────
+
+    def _append(self, waveform: np.ndarray, pair: np.ndarray | None = None) -> None:
+        needed = self._len + len(waveform)
+        if needed > len(self._buffer):
+            grown = np.zeros(max(needed, 2 * len(self._buffer)), dtype=np.float32)
+            grown[:self._len] = self._buffer[:self._len]
+            self._buffer = grown
+            if self._pair is not None:
+                grown_pair = np.zeros((len(grown), 2), dtype=np.float32)
+                grown_pair[:self._len] = self._pair[:self._len]
+                self._pair = grown_pair
+        self._buffer[self._len:needed] = waveform
+        if pair is not None and self._pair is None:
+            self._pair = np.zeros((len(self._buffer), 2), dtype=np.float32)
+        if self._pair is not None:
+            self._pair[self._len:needed] = pair[:len(waveform)] if pair is not None else 0.0
+        self._len = needed
@@ -0,0 +1,287 @@
+"""
+Shadow-Sound — Student model cascade
+
+Most chunks are plainly background, yet each one costs a full YAMNet
+call.  ``python train.py --student`` distils YAMNet's per-frame category
+scores into the small CNN from train.build_model, fed with the same
+0.96 s log-mel patches YAMNet frames use (computed here in numpy, so the
+server needs no audio library for them), and exports it as TFLite.
+
+With the student at CASCADE_STUDENT_PATH, SoundClassifier.triage() scores
+a chunk's frames with it first and only escalates to YAMNet when
+
+  * some category's pooled student score lies in the uncertainty band
+    [CASCADE_BAND_LOW, CASCADE_BAND_HIGH), or
+  * a critical category (siren, glass, tire screech) reaches
+    CASCADE_CRITICAL_FLOOR — a missed siren costs more than a YAMNet call.
+
+Otherwise the student's own result stands: categories at or above the
+band (and their threshold) are reported, everything else is background.
+
+    python student.py report --corpus data/ [--json report.json]
+
+replays a corpus through both models and prints, for a grid of bands, the
+escalation rate and how often the cascade's detections match YAMNet-only
+results (overall and for critical categories), to pick the band safely.
+"""
+
+import argparse
+import json
+import os
+import sys
+import threading
+from functools import lru_cache
+
+import numpy as np
+
+import config
+import metrics
+from backends import _tflite_interpreter_class
+from decoding import AUDIO_EXTENSIONS, PATCH_HOP_SAMPLES, PATCH_SAMPLES, TARGET_SR, decode_audio, num_frames
+
+# ── Log-mel patches (YAMNet's front end: 25 ms window, 10 ms hop, 64 bands) ─
+
+STFT_WINDOW = 400
+STFT_HOP = 160
+FFT_SIZE = 512
+MEL_BANDS = 64
+MEL_MIN_HZ = 125.0
+MEL_MAX_HZ = 7500.0
+LOG_OFFSET = 0.001
+
+PATCH_FRAMES = 1 + (PATCH_SAMPLES - STFT_WINDOW) // STFT_HOP      # 96
+PATCH_HOP_FRAMES = PATCH_HOP_SAMPLES // STFT_HOP                   # 48
+
+# A plausible score in any of these always goes to YAMNet
+CRITICAL_CATEGORIES: frozenset[str] = frozenset({
+    "emergency_siren",
+    "glass_breaking",
+    "tire_screech",
+})
+
+
+def _hz_to_mel(hz: np.ndarray) -> np.ndarray:
+    return 1127.0 * np.log1p(hz / 700.0)
+
+
+@lru_cache(maxsize=1)
+def _mel_matrix() -> np.ndarray:
+    """``(FFT_SIZE // 2 + 1, MEL_BANDS)`` triangular filterbank on the HTK mel scale."""
+    bins = FFT_SIZE // 2 + 1
+    spectrum_mel = _hz_to_mel(np.linspace(0.0, TARGET_SR / 2, bins))
+    edges = np.linspace(_hz_to_mel(np.array(MEL_MIN_HZ)), _hz_to_mel(np.array(MEL_MAX_HZ)), MEL_BANDS + 2)
+    lower, center, upper = edges[:-2], edges[1:-1], edges[2:]
+    rising = (spectrum_mel[:, None] - lower) / (center - lower)
+    falling = (upper - spectrum_mel[:, None]) / (upper - center)
+    matrix = np.maximum(0.0, np.minimum(rising, falling))
+    matrix[0, :] = 0.0      # no DC
+    return matrix.astype(np.float32)
+
+
+@lru_cache(maxsize=1)
+def _window() -> np.ndarray:
+    return (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(STFT_WINDOW) / STFT_WINDOW)).astype(np.float32)
+
+
+def log_mel_patches(waveform: np.ndarray) -> np.ndarray:
+    """
+    ``(frames, 96, 64)`` log-mel patches, one per YAMNet frame of the
+    waveform (padded the way YAMNet pads it).
+    """
+    frames = num_frames(len(waveform))
+    padded = np.zeros(PATCH_SAMPLES + (frames - 1) * PATCH_HOP_SAMPLES, dtype=np.float32)
+    padded[:len(waveform)] = waveform
+
+    stft_frames = 1 + (len(padded) - STFT_WINDOW) // STFT_HOP
+    windows = np.lib.stride_tricks.as_strided(
+        padded, (stft_frames, STFT_WINDOW), (padded.strides[0] * STFT_HOP, padded.strides[0]),
+    )
+    magnitude = np.abs(np.fft.rfft(windows * _window(), n=FFT_SIZE))
+    log_mel = np.log(magnitude.astype(np.float32) @ _mel_matrix() + LOG_OFFSET)
+
+    starts = np.arange(frames) * PATCH_HOP_FRAMES
+    return np.stack([log_mel[start:start + PATCH_FRAMES] for start in starts])
+
+
+# ── Student model ─────────────────────────────────────────────────────────
+
+def metadata_path(model_path: str) -> str:
+    return os.path.splitext(model_path)[0] + ".json"
+
+
+class StudentModel:
+    """The exported student: log-mel patches → per-frame category scores."""
+
+    def __init__(self, path: str) -> None:
+        with open(metadata_path(path)) as f:
+            self.categories: list[str] = json.load(f)["categories"]
+        self._interpreter = _tflite_interpreter_class()(model_path=path, num_threads=1)
+        self._input_index = self._interpreter.get_input_details()[0]["index"]
+        self._output_index = self._interpreter.get_output_details()[0]["index"]
+        self._batch = 0
+        # One interpreter, shared by the inference threads
+        self._lock = threading.Lock()
+
+    def predict(self, patches: np.ndarray) -> np.ndarray:
+        """``(frames, len(categories))`` scores for ``(frames, 96, 64)`` patches."""
+        with self._lock:
+            if self._batch != len(patches):
+                self._interpreter.resize_tensor_input(self._input_index, [len(patches), PATCH_FRAMES, MEL_BANDS, 1])
+                self._interpreter.allocate_tensors()
+                self._batch = len(patches)
+            self._interpreter.set_tensor(self._input_index, patches[..., np.newaxis].astype(np.float32))
+            self._interpreter.invoke()
+            return self._interpreter.get_tensor(self._output_index).copy()
+
+
+def load_student(path: str = config.CASCADE_STUDENT_PATH) -> StudentModel | None:
+    """The exported student, or None when there isn't one."""
+    if not path or not os.path.exists(path) or not os.path.exists(metadata_path(path)):
+        return None
+    return StudentModel(path)
+
+
+class Cascade:
+    """Decides per chunk whether the student's answer is good enough."""
+
+    def __init__(
+        self,
+        student: StudentModel,
+        categories: list[str],
+        band: tuple[float, float] = (config.CASCADE_BAND_LOW, config.CASCADE_BAND_HIGH),
+        critical_floor: float = config.CASCADE_CRITICAL_FLOOR,
+    ) -> None:
+        missing = [c for c in categories if c not in student.categories]
+        if missing:
+            # The student can't vouch for a category it never learned
+            raise ValueError(f"Student model lacks categories {missing}; re-run `python train.py --student`")
+        self.student = student
+        self.band = band
+        self.critical_floor = critical_floor
+        # Student output column feeding each classifier category
+        self._columns = np.array([student.categories.index(c) for c in categories])
+        self._critical = np.array([c in CRITICAL_CATEGORIES for c in categories])
+        self.outcomes = {"student": 0, "uncertain": 0, "critical": 0}
+
+    def frame_scores(self, waveform: np.ndarray) -> np.ndarray:
+        """``(frames, categories)`` student scores in classifier category order."""
+        return self.student.predict(log_mel_patches(waveform))[:, self._columns]
+
+    def decide(self, pooled: np.ndarray, band: tuple[float, float] | None = None) -> str:
+        """Return "student", or why the chunk has to go to YAMNet ("critical" / "uncertain")."""
+        low, high = band or self.band
+        if np.any(self._critical & (pooled >= self.critical_floor)):
+            return "critical"
+        if np.any((pooled >= low) & (pooled < high)):
+            return "uncertain"
+        return "student"
+
+    def record(self, outcome: str) -> None:
+        self.outcomes[outcome] += 1
+        metrics.CASCADE_DECISIONS.labels(outcome).inc()
+
+    def stats(self) -> dict:
+        total = sum(self.outcomes.values())
+        escalated = total - self.outcomes["student"]
+        return {
+            "band": list(self.band),
+            "critical_floor": self.critical_floor,
+            "chunks": total,
+            **self.outcomes,
+            "escalation_rate": round(escalated / total, 3) if total else None,
+        }
+
+
+# ── Report ────────────────────────────────────────────────────────────────
+
+BAND_GRID = [
+    (low, high)
+    for low in (0.05, 0.1, 0.15, 0.2, 0.3)
+    for high in (0.4, 0.5, 0.6, 0.7, 0.8)
+]
+CHUNK_FRAMES = 3           # a 1.5 s phone chunk spans 3 YAMNet frames
+
+
+def _corpus(corpus_dir: str) -> list[np.ndarray]:
+    waveforms = []
+    for root, dirs, files in os.walk(corpus_dir):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(AUDIO_EXTENSIONS):
+                with open(os.path.join(root, name), "rb") as f:
+                    waveform = decode_audio(f.read(), TARGET_SR)
+                if waveform is not None and len(waveform):
+                    waveforms.append(waveform)
+    return waveforms
+
+
+def report(corpus_dir: str) -> dict:
+    """Escalation rate and agreement with YAMNet-only results for every band in BAND_GRID."""
+    from classifier import SoundClassifier
+
+    classifier = SoundClassifier(cascade=False)
+    student = load_student()
+    if student is None:
+        raise SystemExit(f"No student model at {config.CASCADE_STUDENT_PATH}; run `python train.py --student`")
+    cascade = Cascade(student, classifier.categories)
+    thresholds = classifier._thresholds
+
+    # Per 3-frame chunk: YAMNet's and the student's pooled category scores
+    teacher, pupil = [], []
+    for waveform in _corpus(corpus_dir):
+        frames = classifier.frame_category_scores(classifier.score_waveforms([waveform])[0])
+        student_frames = cascade.frame_scores(waveform)
+        for start in range(0, len(frames), CHUNK_FRAMES):
+            teacher.append(classifier.pool_categories(frames[start:start + CHUNK_FRAMES]))
+            pupil.append(classifier.pool_categories(student_frames[start:start + CHUNK_FRAMES]))
+    if not teacher:
+        raise SystemExit(f"No audio under {corpus_dir}")
+    teacher_hits = np.array(teacher) >= thresholds
+    pupil_scores = np.array(pupil)
+    critical = cascade._critical
+
+    rows = []
+    for band in BAND_GRID:
+        escalated = np.array([cascade.decide(p, band) != "student" for p in pupil_scores])
+        student_hits = pupil_scores >= np.maximum(thresholds, band[1])
+        # Escalated chunks get YAMNet's own answer
+        cascade_hits = np.where(escalated[:, None], teacher_hits, student_hits)
+        agree = np.all(cascade_hits == teacher_hits, axis=1)
+        critical_chunks = np.any(teacher_hits & critical, axis=1)
+        critical_kept = np.all(cascade_hits[:, critical] == teacher_hits[:, critical], axis=1)
+        rows.append({
+            "band": list(band),
+            "escalation_rate": round(float(escalated.mean()), 3),
+            "agreement": round(float(agree.mean()), 4),
+            "critical_recall": (
+                round(float(critical_kept[critical_chunks].mean()), 4) if critical_chunks.any() else None
+            ),
+        })
+
+    print(f"{len(teacher)} chunks of {CHUNK_FRAMES} frames, critical floor {cascade.critical_floor}")
+    print(f"{'band':<14}{'escalated':>11}{'agreement':>11}{'critical':>10}")
+    for row in rows:
+        low, high = row["band"]
+        critical_recall = "—" if row["critical_recall"] is None else f"{row['critical_recall']:.1%}"
+        print(f"{low:.2f}–{high:.2f}    {row['escalation_rate']:>9.1%}{row['agreement']:>11.1%}{critical_recall:>10}")
+    return {"chunks": len(teacher), "critical_floor": cascade.critical_floor, "bands": rows}
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description="Student cascade tools.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    report_cmd = sub.add_parser("report", help="escalation rate and agreement with YAMNet per band")
+    report_cmd.add_argument("--corpus", required=True)
+    report_cmd.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args(argv)
+
+    result = report(args.corpus)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"Report saved → {args.json}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
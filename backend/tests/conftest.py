@@ -0,0 +1,10 @@
+"""
+Backend modules import each other by bare name (``import config``), as
+they do when run from backend/, so the tests put that directory first on
+sys.path.  Only modules that work without TensorFlow are tested here.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
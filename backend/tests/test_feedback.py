@@ -0,0 +1,152 @@
+"""Feedback segment log: batched writes, crash recovery and reading (feedback.py)."""
+
+import os
+
+import numpy as np
+import pytest
+
+from feedback import (
+    NO_LABEL, RECORD_DTYPE, SOURCE_STUDENT, SOURCE_YAMNET, FeedbackEntry, FeedbackLog, FeedbackWriter,
+    _LogFiles, connection_of, log_dir, new_connection_id, worker_of,
+)
+from head import BACKGROUND
+
+CATEGORIES = ["emergency_siren", "horn"]
+
+
+def _entry(n: int, **overrides) -> FeedbackEntry:
+    fields = dict(
+        detection_id=f"1-abc-{n}",
+        device_id="d1",
+        audio=np.full(100 + n, n, dtype=np.int16),
+        scores=np.array([0.9, 0.1], dtype=np.float32),
+        predicted="emergency_siren",
+        confidence=0.9,
+        correct=True,
+        actual_sound=None,
+        comment=None,
+        created=1000.0 + n,
+    )
+    fields.update(overrides)
+    return FeedbackEntry(**fields)
+
+
+def _write(root, entries: list[FeedbackEntry]) -> None:
+    writer = FeedbackWriter(CATEGORIES, root=str(root), flush_s=0.0)
+    for entry in entries:
+        assert writer.submit(entry)
+    writer.close()
+    assert writer.failed == 0
+
+
+@pytest.fixture
+def files(tmp_path) -> _LogFiles:
+    return _LogFiles(log_dir(str(tmp_path), CATEGORIES))
+
+
+# ── Writing and reading ───────────────────────────────────────────────────
+
+def test_round_trip(tmp_path, files):
+    _write(tmp_path, [
+        _entry(0),
+        _entry(1, correct=False),
+        _entry(2, scores=None, predicted="horn", correct=False, actual_sound="emergency_siren", comment="far"),
+    ])
+    log = FeedbackLog(files.dir)
+    assert len(log) == 3
+    assert log.categories == CATEGORIES
+    assert [log.label(i) for i in range(3)] == ["emergency_siren", BACKGROUND, "emergency_siren"]
+    for i in range(3):
+        np.testing.assert_array_equal(log.clip_bytes(i), np.full(100 + i, i, dtype="<i2").tobytes())
+    assert list(log.index["source"]) == [SOURCE_YAMNET, SOURCE_YAMNET, SOURCE_STUDENT]
+    assert log.scores[0].tolist() == pytest.approx([0.9, 0.1], abs=1e-3)
+    assert np.isnan(log.scores[2]).all()
+    assert log.details(2) == {
+        "detection_id": "1-abc-2", "device_id": "d1", "predicted": "horn",
+        "label": "emergency_siren", "comment": "far",
+    }
+
+
+def test_label_outside_the_categories(tmp_path, files):
+    _write(tmp_path, [_entry(0, predicted="dog", correct=False, actual_sound="doorbell")])
+    log = FeedbackLog(files.dir)
+    assert int(log.index[0]["label"]) == NO_LABEL
+    assert int(log.index[0]["predicted"]) == NO_LABEL
+    assert log.label(0) == "doorbell"
+
+
+def test_later_batches_append(tmp_path, files):
+    _write(tmp_path, [_entry(0)])
+    _write(tmp_path, [_entry(1), _entry(2)])
+    log = FeedbackLog(files.dir)
+    assert len(log) == 3
+    assert list(log.index["audio_offset"]) == [0, 100, 201]
+    assert log.clip(2)[0] == pytest.approx(2 / 32768)
+
+
+# ── Crash recovery ────────────────────────────────────────────────────────
+
+def _append(path: str, data: bytes) -> None:
+    with open(path, "ab") as f:
+        f.write(data)
+
+
+def _sizes(files: _LogFiles) -> dict[str, int]:
+    return {path: os.path.getsize(path) for path in (files.audio, files.scores, files.details, files.index)}
+
+
+def test_partial_batch_is_truncated(tmp_path, files):
+    _write(tmp_path, [_entry(0), _entry(1)])
+    complete = _sizes(files)
+
+    # A crash mid-batch: data appended, index row only half written
+    _append(files.audio, np.zeros(50, dtype="<i2").tobytes())
+    _append(files.scores, np.zeros(2, dtype="<f2").tobytes())
+    _append(files.details, b'{"detection_id": "lost"')
+    _append(files.index, b"\0" * (RECORD_DTYPE.itemsize // 2))
+
+    # Readers only see complete rows, even before recovery
+    assert len(FeedbackLog(files.dir)) == 2
+
+    assert files.recover(len(CATEGORIES)) == 2
+    assert _sizes(files) == complete
+
+
+def test_data_without_an_index_row_is_truncated(tmp_path, files):
+    _write(tmp_path, [_entry(0)])
+    complete = _sizes(files)
+    _append(files.audio, b"\1\0" * 10)
+    _append(files.details, b"{}\n")
+
+    assert files.recover(len(CATEGORIES)) == 1
+    assert _sizes(files) == complete
+
+
+def test_writes_after_a_crash_line_up(tmp_path, files):
+    _write(tmp_path, [_entry(0)])
+    _append(files.audio, b"\7\7" * 33)
+    _append(files.details, b"garbage")
+    _append(files.index, b"\1" * 5)
+
+    _write(tmp_path, [_entry(1)])   # the writer recovers under its lock first
+    log = FeedbackLog(files.dir)
+    assert len(log) == 2
+    assert int(log.index[1]["audio_offset"]) == 100
+    np.testing.assert_array_equal(log.clip_bytes(1), np.full(101, 1, dtype="<i2").tobytes())
+    assert log.details(1)["detection_id"] == "1-abc-1"
+
+
+def test_recover_empty_log(files):
+    os.makedirs(files.dir)
+    _append(files.audio, b"\0" * 64)    # audio written, crashed before the first index row
+    assert files.recover(len(CATEGORIES)) == 0
+    assert set(_sizes(files).values()) == {0}
+
+
+# ── Detection ids ─────────────────────────────────────────────────────────
+
+def test_detection_ids_name_their_worker_and_connection():
+    connection_id = new_connection_id()
+    detection_id = f"{connection_id}-17"
+    assert worker_of(detection_id) == str(os.getpid())
+    assert connection_of(detection_id) == connection_id
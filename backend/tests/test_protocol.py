@@ -0,0 +1,141 @@
+"""Binary WebSocket audio frames (protocol.py)."""
+
+import numpy as np
+import pytest
+
+from protocol import (
+    CAPTURE_TIME, CHANNELS, FORMAT_FLOAT32, FORMAT_INT16, FORMAT_STREAM, FRAME_MAGIC, HEADER,
+    FrameError, parse_frame, supports_binary,
+)
+
+
+def _frame(
+    payload: bytes,
+    version: int = 1,
+    fmt: int = FORMAT_INT16,
+    sample_rate: int = 16000,
+    sequence: int = 7,
+    captured_ms: int = 0,
+    channels: int = 1,
+    magic: bytes = FRAME_MAGIC,
+) -> bytes:
+    data = HEADER.pack(magic, version, fmt, sample_rate, sequence)
+    if version >= 2:
+        data += CAPTURE_TIME.pack(captured_ms)
+    if version >= 3:
+        data += CHANNELS.pack(channels)
+    return data + payload
+
+
+# ── Well-formed frames ────────────────────────────────────────────────────
+
+def test_v1_int16():
+    samples = np.array([0, 1, -1, 32767, -32768], dtype="<i2")
+    frame = parse_frame(_frame(samples.tobytes()))
+    assert (frame.sample_rate, frame.sequence, frame.channels) == (16000, 7, 1)
+    assert frame.captured_at is None
+    assert not frame.encoded
+    np.testing.assert_array_equal(frame.samples, samples)
+    assert frame.duration_s == pytest.approx(5 / 16000)
+
+
+def test_v1_float32_is_a_view():
+    samples = np.linspace(-1, 1, 8, dtype="<f4")
+    data = bytearray(_frame(samples.tobytes(), fmt=FORMAT_FLOAT32, sample_rate=48000))
+    frame = parse_frame(data)
+    np.testing.assert_array_equal(frame.samples, samples)
+    data[-4:] = np.float32(0.5).tobytes()
+    assert frame.samples[-1] == 0.5
+
+
+def test_v2_capture_time():
+    frame = parse_frame(_frame(b"\0\0" * 4, version=2, captured_ms=1_700_000_000_123))
+    assert frame.captured_at == pytest.approx(1_700_000_000.123)
+    assert len(frame.samples) == 4
+
+
+def test_v2_zero_capture_time_means_unknown():
+    assert parse_frame(_frame(b"", version=2)).captured_at is None
+
+
+def test_v3_stereo_is_reshaped():
+    samples = np.arange(12, dtype="<i2")
+    frame = parse_frame(_frame(samples.tobytes(), version=3, channels=2))
+    assert frame.channels == 2
+    assert frame.samples.shape == (6, 2)
+    np.testing.assert_array_equal(frame.samples[:, 1], samples[1::2])
+
+
+def test_stream_bytes_skip_the_pcm_rate_check():
+    frame = parse_frame(_frame(b"\xff\xf1abc", version=3, fmt=FORMAT_STREAM, sample_rate=4000))
+    assert frame.encoded
+    assert frame.samples.tobytes() == b"\xff\xf1abc"
+    assert frame.duration_s == 0.0
+
+
+def test_empty_payload():
+    assert len(parse_frame(_frame(b"")).samples) == 0
+
+
+# ── Malformed frames ──────────────────────────────────────────────────────
+
+@pytest.mark.parametrize("length", [0, 1, HEADER.size - 1])
+def test_shorter_than_the_header(length):
+    with pytest.raises(FrameError, match="too short"):
+        parse_frame(_frame(b"")[:length])
+
+
+@pytest.mark.parametrize("version, cut", [
+    (2, HEADER.size + CAPTURE_TIME.size - 1),                    # capture time cut off
+    (3, HEADER.size + CAPTURE_TIME.size),                        # channel count missing
+    (3, HEADER.size + CAPTURE_TIME.size + CHANNELS.size - 1),    # channel count cut off
+])
+def test_truncated_extended_header(version, cut):
+    with pytest.raises(FrameError, match="too short"):
+        parse_frame(_frame(b"", version=version)[:cut])
+
+
+@pytest.mark.parametrize("kwargs, message", [
+    ({"magic": b"XX"}, "magic"),
+    ({"version": 0}, "version"),
+    ({"version": 4}, "version"),
+    ({"fmt": 0}, "format"),
+    ({"fmt": 9}, "format"),
+    ({"sample_rate": 0}, "positive"),
+    ({"sample_rate": 7999}, "8000–96000"),
+    ({"sample_rate": 96001}, "8000–96000"),
+    ({"fmt": FORMAT_STREAM, "sample_rate": 0}, "positive"),
+])
+def test_bad_header_fields(kwargs, message):
+    with pytest.raises(FrameError, match=message):
+        parse_frame(_frame(b"\0\0", **kwargs))
+
+
+@pytest.mark.parametrize("payload, kwargs", [
+    (b"\0" * 3, {}),                                        # half an int16 sample
+    (b"\0" * 6, {"fmt": FORMAT_FLOAT32}),                   # 1.5 float32 samples
+    (b"\0" * 6, {"version": 3, "channels": 2}),             # 1.5 stereo int16 frames
+])
+def test_partial_samples(payload, kwargs):
+    with pytest.raises(FrameError, match="whole number"):
+        parse_frame(_frame(payload, **kwargs))
+
+
+@pytest.mark.parametrize("fmt, channels", [(FORMAT_INT16, 0), (FORMAT_STREAM, 2)])
+def test_bad_channel_count(fmt, channels):
+    with pytest.raises(FrameError, match="channel count"):
+        parse_frame(_frame(b"", version=3, fmt=fmt, channels=channels))
+
+
+def test_frame_error_is_a_value_error():
+    assert issubclass(FrameError, ValueError)
+
+
+# ── Negotiation ───────────────────────────────────────────────────────────
+
+@pytest.mark.parametrize("api_version, expected", [
+    ("2.0", True), ("2", True), ("2.1.3", True), ("10.0", True),
+    ("1.9", False), ("1", False), ("", False), (None, False), ("two", False),
+])
+def test_supports_binary(api_version, expected):
+    assert supports_binary(api_version) is expected
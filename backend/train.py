@@ -15,17 +15,65 @@ Usage
     └── shouting/       ← WAV files of shouting
 
 2. Run:
-    python train.py
+    python train.py [--workers N]
 
 3. Output → backend/model/sound_model.keras
+
+Embedding head
+--------------
+    python train.py --head
+
+trains a dense classifier on YAMNet's 1024-d frame embeddings instead,
+with one class per data/ subdirectory (name them after app categories,
+e.g. glass_breaking/, and add a background/ of ordinary street noise).
+Embeddings are extracted once per file and cached under
+backend/model/embedding_cache/, so re-training takes seconds.  The weights
+go to EMBEDDING_HEAD_PATH, where the server picks them up (see head.py).
+
+Student model
+-------------
+    python train.py --student [--corpus DIR]
+
+distils YAMNet into the CNN below for the serving cascade: every clip
+under the corpus (default data/, any layout) is scored by YAMNet once, and
+the CNN learns each frame's app-category scores from the log-mel patch
+YAMNet saw.  Teacher scores are cached under backend/model/student_cache/;
+the float16 TFLite export goes to CASCADE_STUDENT_PATH (see student.py).
+
+Spectrograms are extracted in a process pool and cached under
+backend/model/feature_cache/, keyed by the feature settings and each
+file's content hash, in memory-mapped shards.  Re-runs only extract new or
+changed files, and training streams batches from the shards through
+tf.data, so the dataset doesn't have to fit in RAM.
+
+Feedback
+--------
+    python train.py --feedback [DIR]      (also with --head)
+
+adds the clips users labelled from the app (see feedback.py; default
+FEEDBACK_LOG_DIR) to data/: each clip whose label is one of the classes
+being trained joins that class, cached by its content like any file.
 """
 
+import argparse
+import hashlib
+import json
 import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import librosa
 import tensorflow as tf
 from sklearn.model_selection import train_test_split
 
+import config
+from backends import load_backend
+from classifier import _bucket_samples
+from decoding import decode_audio
+from feedback import open_logs
+from head import EMBEDDING_SIZE, EmbeddingHead
+from student import MEL_BANDS, PATCH_FRAMES, log_mel_patches, metadata_path
+
 # ── Settings (must match classifier.py) ───────────────────────────────────
 
 TARGET_SR = 16000
@@ -43,13 +91,38 @@ BATCH_SIZE = 32
 EPOCHS = 30
 VALIDATION_SPLIT = 0.2
 
+AUDIO_EXTENSIONS = (".wav", ".mp3", ".ogg", ".flac")
+
+# ── Feature cache ─────────────────────────────────────────────────────────
+
+CACHE_DIR = os.path.join(MODEL_DIR, "feature_cache")
+SHARD_CLIPS = 1024         # spectrograms per memory-mapped shard file
+FEATURE_VERSION = 1        # bump when audio_to_spectrogram() changes
+
+# ── Embedding head ────────────────────────────────────────────────────────
+
+EMBEDDING_CACHE_DIR = os.path.join(MODEL_DIR, "embedding_cache")
+HEAD_HIDDEN = 256
+HEAD_EPOCHS = 50
+HEAD_BATCH_SIZE = 256
+
+# ── Student model ─────────────────────────────────────────────────────────
+
+STUDENT_CACHE_DIR = os.path.join(MODEL_DIR, "student_cache")
+STUDENT_EPOCHS = 40
+STUDENT_BATCH_SIZE = 128
+
 
 # ── Data loading ──────────────────────────────────────────────────────────
 
 def audio_to_spectrogram(file_path: str) -> np.ndarray:
     """Load a WAV file and return a normalised mel-spectrogram."""
     waveform, _ = librosa.load(file_path, sr=TARGET_SR, mono=True)
+    return waveform_to_spectrogram(waveform)
 
+
+def waveform_to_spectrogram(waveform: np.ndarray) -> np.ndarray:
+    """A normalised mel-spectrogram of a 16 kHz mono waveform."""
     # Pad or trim to fixed duration
     target_len = int(TARGET_SR * CLIP_DURATION)
     if len(waveform) < target_len:
@@ -68,34 +141,441 @@ def audio_to_spectrogram(file_path: str) -> np.ndarray:
     return log_mel.astype(np.float32)
 
 
-def load_dataset():
-    """Walk data/ subdirectories and build X, y arrays."""
-    X, y = [], []
+def list_files() -> list[tuple[str, int]]:
+    """(path, label index) for every clip under data/."""
+    files = []
     for label_idx, class_name in enumerate(CLASS_NAMES):
         class_dir = os.path.join(DATA_DIR, class_name)
         if not os.path.isdir(class_dir):
             print(f"⚠  Missing directory: {class_dir} — skipping")
             continue
 
-        files = [f for f in os.listdir(class_dir) if f.endswith((".wav", ".mp3", ".ogg", ".flac"))]
-        print(f"  {class_name}: {len(files)} files")
-
-        for fname in files:
-            try:
-                spec = audio_to_spectrogram(os.path.join(class_dir, fname))
-                X.append(spec)
+        names = sorted(f for f in os.listdir(class_dir) if f.endswith(AUDIO_EXTENSIONS))
+        print(f"  {class_name}: {len(names)} files")
+        files.extend((os.path.join(class_dir, name), label_idx) for name in names)
+    return files
+
+
+def feedback_clips(classes: list[str], root: str) -> list[tuple[str, np.ndarray, int]]:
+    """(content hash, waveform, class index) for every feedback clip labelled with one of ``classes``."""
+    clips = []
+    for feedback_log in open_logs(root):
+        before = len(clips)
+        for i in range(len(feedback_log)):
+            label = feedback_log.label(i)
+            if label in classes:
+                content_hash = hashlib.sha1(feedback_log.clip_bytes(i)).hexdigest()
+                clips.append((content_hash, feedback_log.clip(i), classes.index(label)))
+        print(f"  feedback {os.path.basename(feedback_log.path)}: {len(clips) - before} of {len(feedback_log)} clips")
+    return clips
+
+
+def file_hash(path: str) -> str:
+    """SHA-1 of a file's contents."""
+    digest = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _extract(path: str) -> tuple[np.ndarray | None, str | None]:
+    """Runs in a pool process."""
+    try:
+        return audio_to_spectrogram(path), None
+    except Exception as exc:
+        return None, str(exc)
+
+
+class FeatureCache:
+    """
+    Content-addressed spectrogram cache.
+
+    Spectrograms live in .npy shards of up to SHARD_CLIPS rows, opened with
+    mmap_mode="r" so only the rows a batch touches are read.  index.json
+    maps each file's content hash to its (shard, row), plus a
+    path → (size, mtime, hash) memo so unchanged files aren't re-hashed.
+    """
+
+    def __init__(self, cache_dir: str = CACHE_DIR) -> None:
+        settings = f"{FEATURE_VERSION}:{TARGET_SR}:{CLIP_DURATION}:{N_MELS}:{HOP_LENGTH}"
+        self.dir = os.path.join(cache_dir, hashlib.sha1(settings.encode()).hexdigest()[:12])
+        os.makedirs(self.dir, exist_ok=True)
+        self.index_path = os.path.join(self.dir, "index.json")
+
+        self.entries: dict[str, list] = {}     # content hash → [shard, row]
+        self.stats: dict[str, list] = {}       # path → [size, mtime, content hash]
+        self.failed: dict[str, str] = {}       # content hash → extraction error
+        self.shards: list[str] = []
+        if os.path.exists(self.index_path):
+            with open(self.index_path) as f:
+                index = json.load(f)
+            self.entries, self.stats, self.shards = index["entries"], index["stats"], index["shards"]
+            self.failed = index["failed"]
+        self._open: dict[int, np.ndarray] = {}
+
+    def content_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        memo = self.stats.get(path)
+        if memo and memo[0] == stat.st_size and memo[1] == stat.st_mtime:
+            return memo[2]
+        content_hash = file_hash(path)
+        self.stats[path] = [stat.st_size, stat.st_mtime, content_hash]
+        return content_hash
+
+    def build(self, paths: list[str], workers: int) -> dict[str, str]:
+        """Extract every path not cached yet; returns path → content hash."""
+        hashes = {path: self.content_hash(path) for path in paths}
+        missing = list({
+            h: p for p, h in hashes.items() if h not in self.entries and h not in self.failed
+        }.items())
+        for path, content_hash in hashes.items():
+            if content_hash in self.failed:
+                print(f"    ✗ {os.path.basename(path)}: {self.failed[content_hash]} (cached)")
+        cached = {h for h in hashes.values() if h in self.entries}
+        print(f"Features: {len(cached)} cached, {len(missing)} to extract")
+
+        if missing:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                for start in range(0, len(missing), SHARD_CLIPS):
+                    batch = missing[start:start + SHARD_CLIPS]
+                    results = pool.map(_extract, [p for _h, p in batch], chunksize=8)
+                    self._write_shard(batch, results)
+        self._save()
+        return hashes
+
+    def add_waveforms(self, items: list[tuple[str, np.ndarray]]) -> None:
+        """Extract (content hash, waveform) pairs not cached yet, such as feedback clips."""
+        missing = list({h: w for h, w in items if h not in self.entries and h not in self.failed}.items())
+        print(f"Feedback features: {len(items) - len(missing)} cached, {len(missing)} to extract")
+        for start in range(0, len(missing), SHARD_CLIPS):
+            batch = missing[start:start + SHARD_CLIPS]
+            self._write_shard(
+                [(h, f"feedback-{h[:12]}") for h, _w in batch],
+                [(waveform_to_spectrogram(w), None) for _h, w in batch],
+            )
+        self._save()
+
+    def _write_shard(self, batch: list[tuple[str, str]], results) -> None:
+        specs, done = [], []
+        for (content_hash, path), (spec, error) in zip(batch, results):
+            if spec is None:
+                print(f"    ✗ {os.path.basename(path)}: {error}")
+                self.failed[content_hash] = error
+                continue
+            specs.append(spec)
+            done.append(content_hash)
+        if not specs:
+            self._save()
+            return
+
+        shard = len(self.shards)
+        name = f"shard-{shard:05d}.npy"
+        tmp = os.path.join(self.dir, name + ".tmp")
+        out = np.lib.format.open_memmap(tmp, mode="w+", dtype=np.float32, shape=(len(specs), *specs[0].shape))
+        for row, spec in enumerate(specs):
+            out[row] = spec
+        out.flush()
+        del out
+        os.replace(tmp, os.path.join(self.dir, name))
+
+        self.shards.append(name)
+        for row, content_hash in enumerate(done):
+            self.entries[content_hash] = [shard, row]
+        self._save()
+
+    def _save(self) -> None:
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump({
+                "shards": self.shards, "entries": self.entries, "stats": self.stats, "failed": self.failed,
+            }, f)
+        os.replace(tmp, self.index_path)
+
+    def shard(self, shard: int) -> np.ndarray:
+        if shard not in self._open:
+            self._open[shard] = np.load(os.path.join(self.dir, self.shards[shard]), mmap_mode="r")
+        return self._open[shard]
+
+    def gather(self, locations: np.ndarray) -> np.ndarray:
+        """Spectrograms for an (n, 2) array of (shard, row), in order."""
+        return np.stack([self.shard(int(shard))[int(row)] for shard, row in locations])
+
+
+def load_dataset(
+    workers: int = os.cpu_count() or 1, feedback_root: str | None = None,
+) -> tuple[FeatureCache, np.ndarray, np.ndarray]:
+    """
+    Extract (or reuse) features for every clip under data/, plus the
+    feedback clips under ``feedback_root`` labelled with a CLASS_NAMES class.
+
+    Returns the cache, an (N, 2) array of (shard, row) locations and the
+    N labels; the spectrograms themselves stay on disk.
+    """
+    files = list_files()
+    cache = FeatureCache()
+    hashes = cache.build([path for path, _label in files], workers)
+
+    locations, y = [], []
+    for path, label_idx in files:
+        entry = cache.entries.get(hashes[path])
+        if entry is not None:
+            locations.append(entry)
+            y.append(label_idx)
+
+    if feedback_root:
+        clips = feedback_clips(CLASS_NAMES, feedback_root)
+        cache.add_waveforms([(content_hash, waveform) for content_hash, waveform, _label in clips])
+        for content_hash, _waveform, label_idx in clips:
+            entry = cache.entries.get(content_hash)
+            if entry is not None:
+                locations.append(entry)
                 y.append(label_idx)
-            except Exception as exc:
-                print(f"    ✗ {fname}: {exc}")
+    return cache, np.array(locations, dtype=np.int64).reshape(-1, 2), np.array(y)
+
+
+def make_dataset(cache: FeatureCache, locations: np.ndarray, y: np.ndarray, shuffle: bool) -> tf.data.Dataset:
+    """Batches of (spectrogram, label) read from the cache shards."""
+    spec_shape = cache.shard(int(locations[0, 0])).shape[1:]
+
+    def read(batch_locations, batch_y):
+        X = cache.gather(batch_locations)[..., np.newaxis]  # add channel dim → (B, n_mels, time, 1)
+        return X.astype(np.float32), batch_y
+
+    def load(batch_locations, batch_y):
+        X, labels = tf.numpy_function(read, [batch_locations, batch_y], [tf.float32, batch_y.dtype])
+        X.set_shape([None, *spec_shape, 1])
+        labels.set_shape([None])
+        return X, labels
 
-    X = np.array(X)[..., np.newaxis]  # add channel dim → (N, n_mels, time, 1)
-    y = np.array(y)
-    return X, y
+    ds = tf.data.Dataset.from_tensor_slices((locations, y))
+    if shuffle:
+        ds = ds.shuffle(len(y), reshuffle_each_iteration=True)
+    return ds.batch(BATCH_SIZE).map(load, num_parallel_calls=tf.data.AUTOTUNE).prefetch(tf.data.AUTOTUNE)
+
+
+def head_classes() -> list[str]:
+    """Every subdirectory of data/, one head category each."""
+    return sorted(
+        d for d in os.listdir(DATA_DIR)
+        if os.path.isdir(os.path.join(DATA_DIR, d)) and not d.startswith(".")
+    )
+
+
+def load_embeddings(classes: list[str], feedback_root: str | None = None) -> tuple[list[np.ndarray], np.ndarray]:
+    """
+    ``(frames, 1024)`` YAMNet embeddings per clip and the clip labels, for
+    data/ and the feedback clips under ``feedback_root`` labelled with one
+    of ``classes``.
+
+    Embeddings are cached per file content and YAMNet artifact, so only new
+    or changed clips go through the model.
+    """
+    backend = load_backend([_bucket_samples(f) for f in config.INFERENCE_FRAME_BUCKETS], with_head=False)
+    model_key = hashlib.sha1(str(backend.artifact.checksum or backend.artifact.location).encode()).hexdigest()
+    cache_dir = os.path.join(EMBEDDING_CACHE_DIR, f"{backend.name}-{model_key[:12]}")
+    os.makedirs(cache_dir, exist_ok=True)
+
+    clips, labels = [], []
+    extracted = 0
+    for label_idx, class_name in enumerate(classes):
+        class_dir = os.path.join(DATA_DIR, class_name)
+        names = sorted(f for f in os.listdir(class_dir) if f.endswith(AUDIO_EXTENSIONS))
+        print(f"  {class_name}: {len(names)} files")
+        for name in names:
+            path = os.path.join(class_dir, name)
+            cached = os.path.join(cache_dir, file_hash(path) + ".npy")
+            if os.path.exists(cached):
+                embeddings = np.load(cached)
+            else:
+                with open(path, "rb") as f:
+                    waveform = decode_audio(f.read(), TARGET_SR)
+                if waveform is None or len(waveform) == 0:
+                    print(f"    ✗ {name}: could not decode")
+                    continue
+                _scores, embeddings = backend.run_with_embeddings(waveform)
+                with open(cached + ".tmp", "wb") as f:
+                    np.save(f, embeddings.astype(np.float32))
+                os.replace(cached + ".tmp", cached)
+                extracted += 1
+            clips.append(embeddings)
+            labels.append(label_idx)
+
+    for content_hash, waveform, label_idx in feedback_clips(classes, feedback_root) if feedback_root else ():
+        cached = os.path.join(cache_dir, content_hash + ".npy")
+        if os.path.exists(cached):
+            embeddings = np.load(cached)
+        else:
+            _scores, embeddings = backend.run_with_embeddings(waveform)
+            with open(cached + ".tmp", "wb") as f:
+                np.save(f, embeddings.astype(np.float32))
+            os.replace(cached + ".tmp", cached)
+            extracted += 1
+        clips.append(embeddings)
+        labels.append(label_idx)
+    print(f"Embeddings: {len(clips) - extracted} cached, {extracted} extracted")
+    return clips, np.array(labels)
+
+
+def train_head(feedback_root: str | None = None) -> None:
+    classes = head_classes()
+    print(f"Extracting YAMNet embeddings for {', '.join(classes)} …")
+    clips, labels = load_embeddings(classes, feedback_root)
+    if not clips:
+        raise SystemExit(f"No usable clips under {DATA_DIR}")
+
+    # Split by clip, not by frame, so no recording is on both sides
+    train_idx, val_idx = train_test_split(
+        np.arange(len(clips)), test_size=VALIDATION_SPLIT, stratify=labels, random_state=42,
+    )
+
+    def frames(indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        X = np.concatenate([clips[i] for i in indices])
+        y = np.concatenate([np.full(len(clips[i]), labels[i]) for i in indices])
+        return X, y
+
+    X_train, y_train = frames(train_idx)
+    X_val, y_val = frames(val_idx)
+    print(f"Train: {len(X_train)} frames — Val: {len(X_val)} frames")
+
+    model = tf.keras.Sequential([
+        tf.keras.layers.Input(shape=(EMBEDDING_SIZE,)),
+        tf.keras.layers.Dense(HEAD_HIDDEN, activation="relu"),
+        tf.keras.layers.Dropout(0.3),
+        tf.keras.layers.Dense(len(classes), activation="softmax"),
+    ])
+    model.compile(
+        optimizer=tf.keras.optimizers.Adam(learning_rate=1e-3),
+        loss="sparse_categorical_crossentropy",
+        metrics=["accuracy"],
+    )
+    model.fit(
+        X_train, y_train,
+        validation_data=(X_val, y_val),
+        batch_size=HEAD_BATCH_SIZE,
+        epochs=HEAD_EPOCHS,
+        callbacks=[tf.keras.callbacks.EarlyStopping(
+            monitor="val_accuracy", patience=5, restore_best_weights=True,
+        )],
+        verbose=2,
+    )
+    loss, acc = model.evaluate(X_val, y_val, verbose=0)
+    print(f"\nValidation accuracy (per frame): {acc:.2%}")
+
+    # Serving runs the head in numpy, so only the Dense weights are saved
+    layers = [
+        tuple(layer.get_weights()) for layer in model.layers
+        if isinstance(layer, tf.keras.layers.Dense)
+    ]
+    EmbeddingHead(classes, layers).save(config.EMBEDDING_HEAD_PATH)
+    print(f"Head saved → {config.EMBEDDING_HEAD_PATH}")
+
+
+def load_teacher_scores(corpus_dir: str) -> tuple[list[str], list[np.ndarray], list[np.ndarray]]:
+    """
+    The classifier's categories, plus log-mel patches and YAMNet's
+    ``(frames, categories)`` scores per clip.
+
+    Teacher scores are cached per file content, YAMNet artifact and
+    category list; patches are cheap and recomputed.
+    """
+    from classifier import SoundClassifier
+
+    classifier = SoundClassifier(cascade=False)
+    artifact = classifier.backend.artifact
+    key = f"{artifact.checksum or artifact.location}:{','.join(classifier.categories)}"
+    cache_dir = os.path.join(
+        STUDENT_CACHE_DIR, f"{classifier.backend.name}-{hashlib.sha1(key.encode()).hexdigest()[:12]}",
+    )
+    os.makedirs(cache_dir, exist_ok=True)
+
+    patches, targets = [], []
+    extracted = 0
+    for root, dirs, names in os.walk(corpus_dir):
+        dirs.sort()
+        for name in sorted(names):
+            if not name.lower().endswith(AUDIO_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            with open(path, "rb") as f:
+                waveform = decode_audio(f.read(), TARGET_SR)
+            if waveform is None or len(waveform) == 0:
+                print(f"    ✗ {name}: could not decode")
+                continue
+            cached = os.path.join(cache_dir, file_hash(path) + ".npy")
+            if os.path.exists(cached):
+                scores = np.load(cached)
+            else:
+                scores = classifier.frame_category_scores(classifier.score_waveforms([waveform])[0])
+                with open(cached + ".tmp", "wb") as f:
+                    np.save(f, scores.astype(np.float32))
+                os.replace(cached + ".tmp", cached)
+                extracted += 1
+            patches.append(log_mel_patches(waveform))
+            targets.append(scores)
+    print(f"Teacher scores: {len(targets) - extracted} cached, {extracted} extracted")
+    return classifier.categories, patches, targets
+
+
+def train_student(corpus_dir: str) -> None:
+    print(f"Scoring {corpus_dir} with YAMNet …")
+    categories, patches, targets = load_teacher_scores(corpus_dir)
+    if not patches:
+        raise SystemExit(f"No usable clips under {corpus_dir}")
+
+    # Split by clip, not by frame, so no recording is on both sides
+    train_idx, val_idx = train_test_split(np.arange(len(patches)), test_size=VALIDATION_SPLIT, random_state=42)
+
+    def frames(indices: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        X = np.concatenate([patches[i] for i in indices])[..., np.newaxis]
+        y = np.concatenate([targets[i] for i in indices])
+        return X, y
+
+    X_train, y_train = frames(train_idx)
+    X_val, y_val = frames(val_idx)
+    print(f"Train: {len(X_train)} frames — Val: {len(X_val)} frames")
+
+    # Soft targets: one independent sigmoid per category, as YAMNet scores them
+    model = build_model(
+        (PATCH_FRAMES, MEL_BANDS, 1), len(categories),
+        activation="sigmoid", loss="binary_crossentropy", metrics=["binary_accuracy"],
+    )
+    model.fit(
+        X_train, y_train,
+        validation_data=(X_val, y_val),
+        batch_size=STUDENT_BATCH_SIZE,
+        epochs=STUDENT_EPOCHS,
+        callbacks=[tf.keras.callbacks.EarlyStopping(
+            monitor="val_loss", patience=5, restore_best_weights=True,
+        )],
+        verbose=2,
+    )
+    loss, _acc = model.evaluate(X_val, y_val, verbose=0)
+    print(f"\nValidation loss: {loss:.4f}")
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.target_spec.supported_types = [tf.float16]
+    path = config.CASCADE_STUDENT_PATH
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path + ".tmp", "wb") as f:
+        f.write(converter.convert())
+    with open(metadata_path(path), "w") as f:
+        json.dump({"categories": categories}, f, indent=2)
+    os.replace(path + ".tmp", path)
+    print(f"Student saved → {path}")
+    print("Check the band with `python student.py report --corpus <held-out audio>`")
 
 
 # ── Model architecture ────────────────────────────────────────────────────
 
-def build_model(input_shape: tuple, num_classes: int) -> tf.keras.Model:
+def build_model(
+    input_shape: tuple,
+    num_classes: int,
+    activation: str = "softmax",
+    loss: str = "sparse_categorical_crossentropy",
+    metrics: list[str] | None = None,
+) -> tf.keras.Model:
     """Small CNN suitable for fast inference on a server or edge device."""
     model = tf.keras.Sequential([
         tf.keras.layers.Input(shape=input_shape),
@@ -122,13 +602,13 @@ def build_model(input_shape: tuple, num_classes: int) -> tf.keras.Model:
         tf.keras.layers.GlobalAveragePooling2D(),
         tf.keras.layers.Dense(128, activation="relu"),
         tf.keras.layers.Dropout(0.4),
-        tf.keras.layers.Dense(num_classes, activation="softmax"),
+        tf.keras.layers.Dense(num_classes, activation=activation),
     ])
 
     model.compile(
         optimizer=tf.keras.optimizers.Adam(learning_rate=1e-3),
-        loss="sparse_categorical_crossentropy",
-        metrics=["accuracy"],
+        loss=loss,
+        metrics=metrics or ["accuracy"],
     )
     return model
 
@@ -136,16 +616,39 @@ def build_model(input_shape: tuple, num_classes: int) -> tf.keras.Model:
 # ── Training ──────────────────────────────────────────────────────────────
 
 def main():
-    print("Loading dataset …")
-    X, y = load_dataset()
-    print(f"Dataset: {X.shape[0]} samples, shape {X.shape[1:]}")
+    parser = argparse.ArgumentParser(description="Train the mel-spectrogram CNN on data/.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1, help="feature extraction processes")
+    parser.add_argument("--head", action="store_true", help="train the YAMNet embedding head instead")
+    parser.add_argument("--student", action="store_true", help="distil YAMNet into the cascade's student model")
+    parser.add_argument("--corpus", default=DATA_DIR, help="audio to distil the student on (default data/)")
+    parser.add_argument(
+        "--feedback", nargs="?", const=config.FEEDBACK_LOG_DIR, default=None, metavar="DIR",
+        help="also train on labelled feedback clips (default FEEDBACK_LOG_DIR)",
+    )
+    args = parser.parse_args()
 
-    X_train, X_val, y_train, y_val = train_test_split(
-        X, y, test_size=VALIDATION_SPLIT, stratify=y, random_state=42,
+    if args.head:
+        train_head(args.feedback)
+        return
+    if args.student:
+        train_student(args.corpus)
+        return
+
+    print("Loading dataset …")
+    cache, locations, y = load_dataset(max(1, args.workers), args.feedback)
+    if not len(y):
+        raise SystemExit(f"No usable clips under {DATA_DIR}")
+    spec_shape = cache.shard(int(locations[0, 0])).shape[1:]
+    print(f"Dataset: {len(y)} samples, shape {(*spec_shape, 1)}")
+
+    loc_train, loc_val, y_train, y_val = train_test_split(
+        locations, y, test_size=VALIDATION_SPLIT, stratify=y, random_state=42,
     )
-    print(f"Train: {len(X_train)} — Val: {len(X_val)}")
+    print(f"Train: {len(y_train)} — Val: {len(y_val)}")
+    train_ds = make_dataset(cache, loc_train, y_train, shuffle=True)
+    val_ds = make_dataset(cache, loc_val, y_val, shuffle=False)
 
-    model = build_model(X_train.shape[1:], len(CLASS_NAMES))
+    model = build_model((*spec_shape, 1), len(CLASS_NAMES))
     model.summary()
 
     callbacks = [
@@ -158,15 +661,14 @@ def main():
     ]
 
     model.fit(
-        X_train, y_train,
-        validation_data=(X_val, y_val),
-        batch_size=BATCH_SIZE,
+        train_ds,
+        validation_data=val_ds,
         epochs=EPOCHS,
         callbacks=callbacks,
     )
 
     # Evaluate
-    loss, acc = model.evaluate(X_val, y_val, verbose=0)
+    loss, acc = model.evaluate(val_ds, verbose=0)
     print(f"\nValidation accuracy: {acc:.2%}")
 
     # Save
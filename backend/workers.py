@@ -0,0 +1,168 @@
+"""
+Shadow-Sound — Worker pools for decode and inference
+
+Keeps the asyncio event loop free for socket I/O.  Audio decoding (pydub /
+ffmpeg, resampling) runs in a thread or process pool and YAMNet runs in a
+dedicated thread pool.  Admission is bounded: once MAX_PENDING_CHUNKS chunks
+are in flight, new chunks are rejected immediately so the client can back
+off instead of piling up latency.
+"""
+
+import asyncio
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Callable
+
+import numpy as np
+
+import config
+import metrics
+from decoding import TARGET_SR, DecodeTimings, decode_with_info, pcm_to_waveform, split_channels
+
+
+class PoolSaturated(Exception):
+    """Raised when a chunk arrives while the pending-chunk queue is full."""
+
+
+class WorkerPool:
+    """Bounded decode + inference executors shared by every connection."""
+
+    def __init__(
+        self,
+        decode_workers: int = config.DECODE_WORKERS,
+        decode_mode: str = config.DECODE_POOL,
+        inference_threads: int = config.INFERENCE_THREADS,
+        max_pending: int = config.MAX_PENDING_CHUNKS,
+        decode_timeout_s: float = config.DECODE_TIMEOUT_S,
+        inference_timeout_s: float = config.INFERENCE_TIMEOUT_S,
+    ) -> None:
+        if decode_mode not in ("thread", "process"):
+            raise ValueError(f"DECODE_POOL must be 'thread' or 'process', got {decode_mode!r}")
+
+        self.decode_mode = decode_mode
+        self.decode_workers = max(1, decode_workers)
+        self.inference_threads = max(1, inference_threads)
+        self.max_pending = max(1, max_pending)
+        self.decode_timeout_s = decode_timeout_s
+        self.inference_timeout_s = inference_timeout_s
+
+        self._decode_executor: Executor = (
+            ProcessPoolExecutor(max_workers=self.decode_workers)
+            if decode_mode == "process"
+            else ThreadPoolExecutor(max_workers=self.decode_workers, thread_name_prefix="decode")
+        )
+        self._inference_executor = ThreadPoolExecutor(
+            max_workers=self.inference_threads, thread_name_prefix="inference",
+        )
+
+        self.decode_timings = DecodeTimings()
+        self._pending = 0
+        self.rejected = 0
+        self.timeouts = 0
+
+    # ── admission ──────────────────────────────────────────────────────
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def admit(self) -> None:
+        """Reserve a slot for one chunk or raise PoolSaturated."""
+        if self._pending >= self.max_pending:
+            self.rejected += 1
+            raise PoolSaturated(
+                f"Server busy: {self._pending} chunks pending (limit {self.max_pending})"
+            )
+        self._pending += 1
+
+    def release(self) -> None:
+        """Give back a slot reserved with admit()."""
+        self._pending = max(0, self._pending - 1)
+
+    def retry_after_ms(self) -> int:
+        """Rough hint for how long a rejected client should wait."""
+        return int(self.inference_timeout_s * 1000 * self._pending / self.max_pending)
+
+    # ── work ───────────────────────────────────────────────────────────
+
+    async def decode(
+        self, audio_bytes: bytes, sample_rate: int,
+    ) -> tuple[np.ndarray | None, np.ndarray | None]:
+        """
+        Decode a chunk in the decode pool, bounded by DECODE_TIMEOUT_S.
+
+        Returns the waveform (None if undecodable) and, with DOA_ENABLED,
+        a stereo chunk's channel pair.
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(
+            self._decode_executor, decode_with_info, audio_bytes, sample_rate, config.DOA_ENABLED,
+        )
+        result = await self.with_timeout(future, self.decode_timeout_s)
+        self.decode_timings.record(result)
+        metrics.DECODES.labels(result.fmt, "ok" if result.decoder else "failed").inc()
+        metrics.STAGE_SECONDS.labels("audio_decode").observe((result.elapsed_ms - result.resample_ms) / 1000)
+        if result.resample_ms:
+            metrics.STAGE_SECONDS.labels("resample").observe(result.resample_ms / 1000)
+        return result.waveform, result.pair
+
+    async def decode_pcm(self, samples: np.ndarray, sample_rate: int) -> tuple[np.ndarray, np.ndarray | None]:
+        """
+        Convert binary-frame PCM to a waveform, plus the channel pair of
+        (frames, channels) stereo samples as in decode().
+
+        At 16 kHz this is a single cheap dtype conversion and stays on the
+        event loop; anything needing a resample goes to the decode pool.
+        """
+        if samples.ndim == 1:
+            convert, args = pcm_to_waveform, (samples, sample_rate)
+        else:
+            convert, args = split_channels, (samples, sample_rate, config.DOA_ENABLED)
+        if sample_rate == TARGET_SR:
+            with metrics.stage("audio_decode"):
+                result = convert(*args)
+        else:
+            loop = asyncio.get_running_loop()
+            with metrics.stage("resample"):
+                future = loop.run_in_executor(self._decode_executor, convert, *args)
+                result = await self.with_timeout(future, self.decode_timeout_s)
+        return result if samples.ndim > 1 else (result, None)
+
+    async def offload(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run a numpy step that can overlap inference (direction finding) in the decode pool."""
+        loop = asyncio.get_running_loop()
+        return await self.with_timeout(
+            loop.run_in_executor(self._decode_executor, fn, *args), self.decode_timeout_s,
+        )
+
+    async def infer(self, fn: Callable[..., Any], *args: Any) -> Any:
+        """Run a model call in the inference thread pool."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._inference_executor, fn, *args)
+
+    async def with_timeout(self, awaitable, timeout_s: float):
+        """Await one pipeline step, counting it as a timeout if it overruns."""
+        try:
+            return await asyncio.wait_for(awaitable, timeout_s)
+        except asyncio.TimeoutError:
+            # A worker that is already running can't be interrupted; its
+            # result is simply discarded when it eventually finishes.
+            self.timeouts += 1
+            raise
+
+    # ── lifecycle / stats ──────────────────────────────────────────────
+
+    def shutdown(self) -> None:
+        self._decode_executor.shutdown(wait=False, cancel_futures=True)
+        self._inference_executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "decode_pool": self.decode_mode,
+            "decode_workers": self.decode_workers,
+            "inference_threads": self.inference_threads,
+            "pending": self._pending,
+            "max_pending": self.max_pending,
+            "rejected": self.rejected,
+            "timeouts": self.timeouts,
+            "decode_by_format": self.decode_timings.snapshot(),
+        }
@@ -9,6 +9,7 @@ export interface Detection {
     haptic_pattern: string;
     direction_degrees?: number;
     direction_label?: string;
+    direction_confidence?: number;
     estimated_distance?: string;
 }
 